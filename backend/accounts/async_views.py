@@ -0,0 +1,114 @@
+"""
+조회가 많은 accounts 엔드포인트의 비동기 버전 (backend/asgi_routes.py 에서 호출)
+
+인증(viewer 조회)과 본 조회를 asyncio.gather 로 동시에 실행한다.
+version, 응답 캐시, 이미지 URL(storage 확인) 처럼 동기로만 할 수 있는 작업은 sync_to_async 로 스레드에서 실행한다.
+(status, data, headers) 를 반환하고, 응답 모양은 accounts/views.py 와 같다.
+프로필/팔로워/팔로잉은 Django view 와 같은 유저 version 으로 ETag/Last-Modified 를 붙여 304 로 응답하고,
+같은 응답 캐시를 함께 사용한다.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from backend import mongo
+from backend.asgi_routes import authenticate
+from backend.metrics import aserialized
+from backend.pagination import KeysetPagination
+
+from . import cache
+from .models import User
+from .repository import AsyncUserRepository
+from .serializers import UserListSerializer, UserProfileSerializer
+from .views import user_etag, user_last_modified, user_version
+
+
+def get_repository():
+    return AsyncUserRepository(mongo.collection(User))
+
+
+def _user_state(request, userid):
+    # version 은 공유 캐시(와 없으면 MongoDB)를 동기로 읽는다.
+    return user_etag(request, userid), user_last_modified(request, userid), user_version(request, userid)
+
+
+async def cached_user_response(name, request, userid, build):
+    """
+    accounts/views.py 의 conditional_on_user + cached_user_response 와 같은 처리.
+    build() 는 (status, data) 를 반환하는 coroutine 이다. ETag 에는 협상된 형식이 들어가고,
+    Vary: Accept 는 AsyncRouter.respond 가 붙인다.
+    """
+    etag, last_modified, version = await sync_to_async(_user_state)(request, userid)
+    etag = quote_etag(etag)
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified.timestamp())}
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if conditional is not None:
+        await authenticate(request)  # Django view 와 같이 인증이 먼저다.
+        return conditional.status_code, None, headers
+
+    uri = request.build_absolute_uri()
+    data = await sync_to_async(cache.get_response)(name, userid, version, uri)
+    if data is not None:
+        await authenticate(request)
+        return 200, data, headers
+
+    _, (response_status, data) = await asyncio.gather(authenticate(request), build())
+    if response_status == 200:
+        await sync_to_async(cache.set_response)(name, userid, version, uri, data)
+    return response_status, data, headers
+
+
+async def profile(request, userid):
+    async def build():
+        user = await get_repository().get_profile(userid)
+        if user is None:
+            return 404, None
+        return 200, await aserialized(UserProfileSerializer(user, context={'request': request}))
+
+    return await cached_user_response('profile', request, userid, build)
+
+
+async def _related_list(name, request, userid, fetch_name):
+    repository = get_repository()
+    fetch = getattr(repository, fetch_name)
+
+    async def build():
+        paginator = KeysetPagination(ordering='-id')
+        users = await paginator.apaginate_documents(lambda position, limit: fetch(userid, position, limit), request)
+        if users is None:
+            return 404, None
+
+        serializer = UserListSerializer(users, many=True, context={'request': request})
+        return 200, paginator.get_paginated_response(await aserialized(serializer)).data
+
+    return await cached_user_response(name, request, userid, build)
+
+
+async def followers(request, userid):
+    return await _related_list('followers', request, userid, 'get_followers')
+
+
+async def following(request, userid):
+    return await _related_list('following', request, userid, 'get_following')
+
+
+async def search(request):
+    term = request.query_params.get('q', request.query_params.get('userid', None))
+
+    if not term:
+        await authenticate(request)
+        return 400, None
+
+    repository = get_repository()
+    paginator = KeysetPagination(ordering='userid')
+
+    _, users = await asyncio.gather(
+        authenticate(request),
+        paginator.apaginate_documents(lambda position, limit: repository.search(term, position, limit), request),
+    )
+
+    serializer = UserListSerializer(users, many=True, context={'request': request})
+    return 200, paginator.get_paginated_response(await aserialized(serializer)).data
@@ -0,0 +1,229 @@
+"""
+accounts 캐시
+
+- 팔로워/팔로잉 id 집합을 캐시해서 공개 범위 확인(맞팔로우 여부 등)이
+  매번 MongoDB 를 읽지 않도록 한다. 팔로우/언팔로우 시 무효화된다.
+  공유 캐시(SHARED_BACKEND)가 없으면 다른 프로세스의 무효화가 전달되지 않으므로 짧은 TTL 로만 캐시한다.
+- JWT 인증/verify 에서 userid 로 유저를 찾을 때 프로세스 내부 TTL 캐시와
+  (선택) 공유 캐시를 거친다. 유저가 저장(비밀번호, is_active, 프로필 변경)되거나
+  팔로우 관계가 바뀌면 무효화된다.
+- 유저마다 version 을 두고 프로필/팔로워/팔로잉 응답을 (userid, version) 으로 캐시한다.
+  version 은 프로필 저장, 팔로우/언팔로우 시 올라가며 ETag, Last-Modified 로도 쓰인다.
+  모든 프로세스가 같은 version 을 보아야 하므로 공유 캐시(SHARED_BACKEND)에만 두고, 일정 시간 뒤 만료된다.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+
+FOLLOW_SETS_KEY = 'accounts:follow_sets:%s'
+USER_KEY = 'accounts:user:%s'
+VERSION_KEY = 'accounts:version:%s'
+RESPONSE_KEY = 'accounts:response:%s:%s:%s:%s'
+
+DEFAULT_USER_CACHE_SETTINGS = {
+    'TTL': 10,                # 프로세스 내부 캐시 유지 시간(초). 비활성화된 계정이 거절되기까지의 최대 지연
+    'MAX_ENTRIES': 10000,
+    'SHARED_BACKEND': None,   # 공유 캐시로 쓸 CACHES alias (ex. 'accounts'). None 이면 사용하지 않는다.
+    'SHARED_TTL': 60,
+}
+
+
+def follow_sets_timeout():
+    """
+    공유 캐시에서는 팔로우/언팔로우 시 모든 프로세스에서 함께 무효화되므로 길게,
+    프로세스 내부 캐시에서는 다른 프로세스의 무효화가 전달되지 않으므로 짧게 유지한다.
+    """
+    if _shared_user_cache() is not None:
+        return getattr(settings, 'FOLLOW_SETS_CACHE_TIMEOUT', 300)
+    return getattr(settings, 'FOLLOW_SETS_LOCAL_CACHE_TIMEOUT', 5)
+
+
+def _follow_sets_cache():
+    return _shared_user_cache() or cache
+
+
+def get_follow_sets(user_pk):
+    """
+    (followers, following) pk 집합을 반환한다.
+    """
+    from .models import User
+
+    key = FOLLOW_SETS_KEY % user_pk
+    backend = _follow_sets_cache()
+    sets = backend.get(key)
+    if sets is None:
+        doc = User.objects.mongo_find_one({'id': user_pk}, {'followers_id': True, 'following_id': True}) or {}
+        sets = (frozenset(doc.get('followers_id') or ()), frozenset(doc.get('following_id') or ()))
+        backend.set(key, sets, follow_sets_timeout())
+    return sets
+
+
+def invalidate_follow_sets(*user_pks):
+    _follow_sets_cache().delete_many([FOLLOW_SETS_KEY % pk for pk in user_pks])
+
+
+def user_cache_settings():
+    conf = dict(DEFAULT_USER_CACHE_SETTINGS)
+    conf.update(getattr(settings, 'ACCOUNTS_USER_CACHE', {}))
+    return conf
+
+
+class LocalTTLCache:
+    """
+    프로세스 내부 LRU + TTL 캐시
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_users = None
+
+
+def _local_user_cache():
+    global _local_users
+    if _local_users is None:
+        conf = user_cache_settings()
+        _local_users = LocalTTLCache(conf['TTL'], conf['MAX_ENTRIES'])
+    return _local_users
+
+
+def _shared_user_cache():
+    alias = user_cache_settings()['SHARED_BACKEND']
+    return caches[alias] if alias else None
+
+
+def get_user(userid):
+    """
+    userid 로 유저를 찾는다. 없으면 User.DoesNotExist 를 발생시킨다.
+    요청마다 다른 객체를 돌려주도록 캐시된 객체의 복사본을 반환한다.
+    """
+    from .models import User
+
+    local = _local_user_cache()
+    user = local.get(userid)
+    if user is not None:
+        return copy.copy(user)
+
+    shared = _shared_user_cache()
+    key = USER_KEY % userid
+    if shared is not None:
+        user = shared.get(key)
+
+    if user is None:
+        user = User.objects.get_by_natural_key(userid)
+        if shared is not None:
+            shared.set(key, user, user_cache_settings()['SHARED_TTL'])
+
+    local.set(userid, user)
+    return copy.copy(user)
+
+
+def invalidate_user(*userids):
+    local = _local_user_cache()
+    for userid in userids:
+        local.delete(userid)
+
+    shared = _shared_user_cache()
+    if shared is not None:
+        shared.delete_many([USER_KEY % userid for userid in userids])
+
+
+def _now_version():
+    return int(time.time() * 1000)
+
+
+def version_cache_timeout():
+    return getattr(settings, 'ACCOUNTS_VERSION_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _version_cache():
+    """
+    프로세스마다 다른 version 을 쓰면 worker 마다 ETag 가 달라지고 다른 worker 의 bump 가 보이지 않는다.
+    """
+    shared = _shared_user_cache()
+    if shared is None:
+        raise ImproperlyConfigured("ACCOUNTS_USER_CACHE['SHARED_BACKEND'] is required for user response versions.")
+    return shared
+
+
+def get_version(userid):
+    """
+    userid 의 응답 version. 밀리초 timestamp 라서 캐시에서 만료된 뒤 다시 만들어도 이전 값보다 크다.
+    없는 userid 는 key 를 만들지 않고 0 을 반환한다.
+    """
+    from .models import User
+
+    backend = _version_cache()
+    key = VERSION_KEY % userid
+    version = backend.get(key)
+    if version is None:
+        if not User.objects.mongo_find_one({'userid': userid}, {'_id': False, 'id': True}):
+            return 0
+        version = _now_version()
+        if not backend.add(key, version, version_cache_timeout()):
+            version = backend.get(key) or version
+    return version
+
+
+def bump_version(*userids):
+    """
+    version 이 있는 userid 만 올린다. 없으면 다음 get_version 이 지금 시각으로 만들므로 이전 값보다 크다.
+    """
+    backend = _version_cache()
+    now = _now_version()
+    versions = backend.get_many([VERSION_KEY % userid for userid in userids])
+    if versions:
+        backend.set_many({key: max(now, version + 1) for key, version in versions.items()}, version_cache_timeout())
+
+
+def response_cache_timeout():
+    return getattr(settings, 'ACCOUNTS_RESPONSE_CACHE_TIMEOUT', 60)
+
+
+def _response_key(name, userid, version, uri):
+    return RESPONSE_KEY % (name, userid, version, hashlib.md5(uri.encode('utf-8')).hexdigest())
+
+
+def get_response(name, userid, version, uri):
+    return cache.get(_response_key(name, userid, version, uri))
+
+
+def set_response(name, userid, version, uri, data):
+    cache.set(_response_key(name, userid, version, uri), data, response_cache_timeout())
@@ -0,0 +1,43 @@
+"""
+한글 검색 키 유틸
+
+초성 검색("ㄱㅁㅅ" -> "김민수")을 위해 완성형 한글 음절을 초성으로 분해한다.
+"""
+import re
+
+HANGUL_BEGIN = 0xAC00
+HANGUL_END = 0xD7A3
+CHOSUNG_PERIOD = 21 * 28
+
+CHOSUNG = 'ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ'
+CHOSUNG_SET = frozenset(CHOSUNG)
+
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize(text):
+    """
+    검색 키 정규화: 소문자로 바꾸고 단어 문자(영문, 숫자, _, 한글)만 남긴다.
+    정규식 특수문자가 제거되므로 prefix 검색이 그대로 인덱스를 탈 수 있다.
+    """
+    if not text:
+        return ''
+    return _NON_WORD.sub('', text).lower()
+
+
+def chosung(text):
+    """
+    완성형 음절은 초성으로 바꾸고 나머지 문자는 그대로 둔다.
+    """
+    result = []
+    for char in normalize(text):
+        code = ord(char)
+        if HANGUL_BEGIN <= code <= HANGUL_END:
+            result.append(CHOSUNG[(code - HANGUL_BEGIN) // CHOSUNG_PERIOD])
+        else:
+            result.append(char)
+    return ''.join(result)
+
+
+def has_chosung(text):
+    return any(char in CHOSUNG_SET for char in text)
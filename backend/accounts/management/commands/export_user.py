@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from backend import export
+
+
+def last_cursor(path):
+    """
+    내보내던 파일의 마지막 완전한 줄의 cursor. 중간에 끊긴 마지막 줄은 잘라낸다.
+    """
+    with open(path, 'rb+') as f:
+        position = f.seek(0, os.SEEK_END)
+        tail = b''
+        # 끝에서부터 읽어서 완전한 줄이 하나 이상 들어올 때까지 늘린다.
+        while position > 0 and tail.count(b'\n') < 2:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+
+        if not tail.endswith(b'\n'):
+            cut = tail.rfind(b'\n') + 1
+            f.truncate(position + cut)
+            tail = tail[:cut]
+
+    line = tail.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+    return json.loads(line.decode('utf-8'))['cursor'] if line else None
+
+
+class Command(BaseCommand):
+    help = '유저의 개인 데이터를 NDJSON 으로 내보낸다. --resume 으로 중단된 파일에 이어서 쓴다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('userid')
+        parser.add_argument('--output', help='출력 파일 (기본 stdout)')
+        parser.add_argument('--cursor', help='이 cursor 다음 레코드부터 내보낸다')
+        parser.add_argument('--resume', action='store_true', help='--output 파일의 마지막 줄 cursor 부터 이어서 쓴다')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(userid=options['userid'])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist.' % options['userid'])
+
+        path = options['output']
+        cursor = options['cursor']
+        mode = 'w'
+        if options['resume']:
+            if not path:
+                raise CommandError('--resume requires --output.')
+            if os.path.exists(path):
+                cursor = last_cursor(path)
+                mode = 'a'
+
+        try:
+            export.decode_cursor(cursor)
+        except export.InvalidCursor:
+            raise CommandError('Invalid cursor.')
+
+        out = open(path, mode, encoding='utf-8') if path else sys.stdout
+        count = 0
+        try:
+            for line in export.lines(user, cursor, options['batch_size']):
+                out.write(line)
+                count += 1
+        finally:
+            if path:
+                out.close()
+
+        if path:
+            self.stdout.write(self.style.SUCCESS('Exported %d records to %s.' % (count, path)))
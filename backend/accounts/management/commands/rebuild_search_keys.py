@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from accounts import hangul
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = '기존 유저의 검색 키(search_userid, search_username, search_chosung)를 다시 계산한다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        cursor = User.objects.mongo_find({}, {'id': True, 'userid': True, 'username': True})
+
+        updated = 0
+        batch = []
+        for doc in cursor.batch_size(batch_size):
+            batch.append(UpdateOne({'id': doc['id']}, {'$set': {
+                'search_userid': hangul.normalize(doc.get('userid')),
+                'search_username': hangul.normalize(doc.get('username')),
+                'search_chosung': hangul.chosung(doc.get('username')),
+            }}))
+            if len(batch) >= batch_size:
+                updated += User.objects.mongo_bulk_write(batch, ordered=False).modified_count
+                batch = []
+
+        if batch:
+            updated += User.objects.mongo_bulk_write(batch, ordered=False).modified_count
+
+        self.stdout.write(self.style.SUCCESS('%d users updated.' % updated))
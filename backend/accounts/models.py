@@ -1,12 +1,17 @@
+from collections import defaultdict
+
 from django.contrib.auth.models import (
     BaseUserManager, AbstractBaseUser, PermissionsMixin
 )
 from djongo import models # djongo 라이브러리의 model 폴더의 fields.py 1014번째 줄 부근에 있는 from_db_value()함수의 인자 context를 context=None으로 수정해야함.
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
+from pymongo import UpdateOne
+
+from . import cache, hangul
 
 
-class UserManager(BaseUserManager):
+class UserManager(BaseUserManager, models.DjongoManager):
     use_in_migrations = True
 
     def create_user(self, email, userid, password, username=None):
@@ -42,8 +47,181 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def increment_counters(self, pk, **deltas):
+        """
+        카운터 필드를 $inc 로 원자적으로 증감한다.
+        ex) User.objects.increment_counters(user.pk, followers_count=1)
+        """
+        self.mongo_update_one({'id': pk}, {'$inc': deltas})
+
+    def _apply_edges(self, user, targets, operator, inverse):
+        """
+        user.following_id 에 targets 를 더하거나(operator '$setUnion') 빼고(operator '$setDifference'),
+        바뀌기 전 배열과 비교해 실제로 바뀐 target 만 골라낸다.
+        following_id 와 following_count 는 pipeline update 하나로 함께 갱신하므로, 동시에 같은 요청이
+        여러번 와도 각 edge 는 한번만 반영된다. (request.user 처럼 읽어둔 배열은 판정에 쓰지 않는다)
+
+        반대쪽(targets 의 followers_id) 은 그 다음 bulk_write 로 반영한다. 두 문서에 걸친 쓰기는
+        원자적이지 않으므로(ordered=True 는 순서만 보장한다) 그 사이에 실패하면 followers 쪽이 빠진다.
+        반대쪽 update 는 바뀐 edge 뿐 아니라 요청한 모든 target 에 membership 조건을 걸어 보내므로,
+        같은 요청을 다시 보내면 빠진 쪽이 채워지고 카운터는 두번 세지 않는다.
+        다시 보내지 않은 경우는 rebuild_counters 가 following_id 를 기준으로 followers_id 를 맞춘다. (repair_followers)
+        """
+        targets = {target.pk: target for target in targets if target.pk != user.pk}
+        if not targets:
+            return []
+
+        before = self.mongo_find_one_and_update(
+            {'id': user.pk},
+            [
+                {'$set': {'following_id': {operator: [{'$ifNull': ['$following_id', []]}, list(targets)]}}},
+                {'$set': {'following_count': {'$size': '$following_id'}}},
+            ],
+            projection={'_id': False, 'following_id': True},
+        )
+        if before is None:
+            return []
+        previous = set(before.get('following_id') or ())
+        if operator == '$setUnion':
+            changed = [target for pk, target in targets.items() if pk not in previous]
+        else:
+            changed = [target for pk, target in targets.items() if pk in previous]
+
+        self.mongo_bulk_write([inverse(pk) for pk in targets], ordered=False)
+
+        if changed:
+            cache.invalidate_follow_sets(user.pk, *(target.pk for target in changed))
+            cache.invalidate_user(user.userid, *(target.userid for target in changed))
+            cache.bump_version(user.userid, *(target.userid for target in changed))
+        return changed
+
+    def follow(self, user, targets):
+        """
+        user 가 targets 를 팔로우하고, 새로 팔로우한 유저 목록을 반환한다.
+        """
+        changed = self._apply_edges(user, targets, '$setUnion', lambda pk: UpdateOne(
+            {'id': pk, 'followers_id': {'$ne': user.pk}},
+            {'$addToSet': {'followers_id': user.pk}, '$inc': {'followers_count': 1}}
+        ))
+
+        user.following_id = set(user.following_id or ()) | {target.pk for target in changed}
+        for target in changed:
+            target.followers_id = set(target.followers_id or ()) | {user.pk}
+        return changed
+
+    def unfollow(self, user, targets):
+        """
+        user 가 targets 를 언팔로우하고, 언팔로우된 유저 목록을 반환한다.
+        """
+        changed = self._apply_edges(user, targets, '$setDifference', lambda pk: UpdateOne(
+            {'id': pk, 'followers_id': user.pk},
+            {'$pull': {'followers_id': user.pk}, '$inc': {'followers_count': -1}}
+        ))
+
+        user.following_id = set(user.following_id or ()) - {target.pk for target in changed}
+        for target in changed:
+            target.followers_id = set(target.followers_id or ()) - {user.pk}
+        return changed
+
+    def search(self, term):
+        """
+        userid, username prefix 검색. 초성이 포함되어 있으면 초성으로 검색한다.
+        """
+        if hangul.has_chosung(term):
+            return self.filter(search_chosung__startswith=hangul.chosung(term))
+
+        key = hangul.normalize(term)
+        if not key:
+            return self.none()
+        return self.filter(
+            models.Q(search_userid__startswith=key) | models.Q(search_username__startswith=key)
+        )
+
+    def rebuild_counters(self, query=None):
+        """
+        followers, following 배열의 길이로 카운터를 다시 계산한다. query 가 없으면 모든 유저
+        """
+        query = query or {}
+        self.repair_followers(query)
+        result = self.mongo_update_many(query, [{'$set': {
+            'followers_count': {'$size': {'$ifNull': ['$followers_id', []]}},
+            'following_count': {'$size': {'$ifNull': ['$following_id', []]}},
+        }}])
+        self.invalidate_cached(query, follow_sets=True)
+        return result
+
+    def repair_followers(self, query=None, batch_size=1000):
+        """
+        following_id 를 기준으로 query 에 맞는 유저의 followers_id 를 다시 맞추고 고친 유저 수를 반환한다.
+        _apply_edges 의 두 쓰기 사이에 실패해서 한쪽에만 남은 edge 를 고친다. 카운터는 고치지 않는다.
+        """
+        repaired = 0
+        for docs in _batches(self.mongo_find(query or {}, {'_id': False, 'id': True, 'followers_id': True}), batch_size):
+            pks = [doc['id'] for doc in docs]
+            expected = defaultdict(set)
+            for follower in self.mongo_find({'following_id': {'$in': pks}}, {'_id': False, 'id': True, 'following_id': True}):
+                for pk in set(follower['following_id']).intersection(pks):
+                    expected[pk].add(follower['id'])
+
+            operations = []
+            for doc in docs:
+                current = set(doc.get('followers_id') or ())
+                missing, extra = expected[doc['id']] - current, current - expected[doc['id']]
+                if missing:
+                    operations.append(UpdateOne({'id': doc['id']}, {'$addToSet': {'followers_id': {'$each': list(missing)}}}))
+                if extra:
+                    operations.append(UpdateOne({'id': doc['id']}, {'$pull': {'followers_id': {'$in': list(extra)}}}))
+                if missing or extra:
+                    repaired += 1
+            if operations:
+                self.mongo_bulk_write(operations, ordered=False)
+        return repaired
+
+    def invalidate_cached(self, query, follow_sets=False, batch_size=1000):
+        """
+        pymongo 로 직접 고친(signal 을 거치지 않은) 유저의 캐시를 지우고 응답 version 을 올린다.
+        follow_sets 면 팔로워/팔로잉 집합 캐시도 지운다.
+        """
+        def invalidate(docs):
+            userids = [doc['userid'] for doc in docs]
+            cache.invalidate_user(*userids)
+            cache.bump_version(*userids)
+            if follow_sets:
+                cache.invalidate_follow_sets(*(doc['id'] for doc in docs))
+
+        for docs in _batches(self.mongo_find(query, {'_id': False, 'id': True, 'userid': True}), batch_size):
+            invalidate(docs)
 
-class User(AbstractBaseUser, PermissionsMixin):
+
+def _batches(cursor, batch_size):
+    docs = []
+    for doc in cursor.batch_size(batch_size):
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            yield docs
+            docs = []
+    if docs:
+        yield docs
+
+
+class AtomicFieldsMixin:
+    """
+    $inc/$addToSet/$pull 로만 고치는 필드(ATOMIC_FIELDS)를 문서 전체 save() 에서 제외한다.
+    이미 저장된 문서는 update_fields 를 주지 않아도 나머지 필드만 저장하므로,
+    읽은 시점의 카운터/배열 값을 다시 써서 그 사이의 동시 갱신을 덮어쓰지 않는다.
+    """
+    ATOMIC_FIELDS = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and self.pk is not None and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.ATOMIC_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(AtomicFieldsMixin, AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(
         verbose_name=_('Email address'),
         max_length=255,
@@ -80,9 +258,35 @@ class User(AbstractBaseUser, PermissionsMixin):
     profile_image = models.ImageField(
         null=True,
     )
+    followers_count = models.IntegerField(  # followers 배열 길이의 비정규화 카운터
+        default=0,
+    )
+    following_count = models.IntegerField(
+        default=0,
+    )
+
+    # 검색용 정규화 키. 대소문자 무시 regex 는 인덱스를 사용하지 못하므로
+    # 소문자로 저장해 두고 대소문자 구분 prefix 검색(^키)으로 조회한다.
+    search_userid = models.CharField(
+        max_length=30,
+        blank=True,
+        db_index=True,
+    )
+    search_username = models.CharField(
+        max_length=100,
+        blank=True,
+        db_index=True,
+    )
+    search_chosung = models.CharField(  # username 의 초성 ("김민수" -> "ㄱㅁㅅ")
+        max_length=100,
+        blank=True,
+        db_index=True,
+    )
 
     objects = UserManager()
 
+    ATOMIC_FIELDS = ('followers', 'following', 'followers_count', 'following_count')  # UserManager.follow/unfollow
+
     USERNAME_FIELD = 'userid'
     REQUIRED_FIELDS = ['email']
 
@@ -94,6 +298,15 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.userid
 
+    def save(self, *args, **kwargs):
+        self.update_search_keys()
+        super().save(*args, **kwargs)
+
+    def update_search_keys(self):
+        self.search_userid = hangul.normalize(self.userid)
+        self.search_username = hangul.normalize(self.username)
+        self.search_chosung = hangul.chosung(self.username)
+
     def get_full_name(self):
         return self.username
 
@@ -109,11 +322,58 @@ class User(AbstractBaseUser, PermissionsMixin):
         # Simplest possible answer: All superusers are staff
         return self.is_superuser
 
-    @property
-    def followers_count(self):
-        return self.followers.all().count()
+    def is_following(self, user):
+        return user.pk in (self.following_id or ())
 
-    @property
-    def following_count(self):
-        return self.following.all().count()
 
+
+class FollowSuggestionManager(models.DjongoManager):
+
+    def suggested_users(self, user, limit):
+        """
+        미리 계산된 팔로우 추천 유저 목록. 계산된 적이 없으면 None.
+        """
+        doc = self.mongo_find_one({'owner_id': user.pk}, {'user_ids': True})
+        if doc is None:
+            return None
+
+        following = set(user.following_id or ())
+        pks = [pk for pk in doc.get('user_ids') or () if pk not in following and pk != user.pk][:limit]
+        users = User.objects.in_bulk(pks)
+        return [users[pk] for pk in pks if pk in users]
+
+    def mark_stale(self, user, targets):
+        """
+        팔로우 관계가 바뀌면 user 와 user 의 팔로워(2단계 관계가 바뀜)의 추천을 다시 계산하도록 표시하고,
+        새로 팔로우한 유저는 바로 추천에서 뺀다.
+        """
+        # request.user 는 요청 시작 시점(또는 캐시)의 값이라 팔로워가 빠져 있을 수 있으므로 DB 에서 읽는다.
+        doc = User.objects.mongo_find_one({'id': user.pk}, {'_id': False, 'followers_id': True}) or {}
+        owners = [user.pk, *(doc.get('followers_id') or ())]
+        self.mongo_update_many({'owner_id': {'$in': owners}}, {'$set': {'stale': True}})
+        self.mongo_update_one(
+            {'owner_id': user.pk},
+            {'$pull': {'user_ids': {'$in': [target.pk for target in targets]}}},
+        )
+
+
+class FollowSuggestion(models.Model):
+    """
+    유저별 팔로우 추천 (musicmaps/suggestions.py 의 배치 작업이 계산한다)
+    """
+    owner = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='follow_suggestion'
+    )
+    user_ids = models.JSONField(default=list)  # 추천 순서대로 정렬된 User pk
+    scores = models.JSONField(default=list)
+    stale = models.BooleanField(  # 팔로우 관계가 바뀌어서 다시 계산해야 하는지
+        default=False
+    )
+    date_computed = models.DateTimeField(
+        default=timezone.now
+    )
+
+    objects = FollowSuggestionManager()
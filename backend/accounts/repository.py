@@ -0,0 +1,124 @@
+"""
+accounts 읽기 repository
+
+자주 호출되는 조회(프로필, 팔로워, 팔로잉, 검색)를 djongo 의 SQL 변환을 거치지 않고
+pymongo 로 직접 실행한다. 필요한 필드만 projection 으로 읽고, serializer 가 그대로
+사용할 수 있는 dict 를 반환한다.
+
+settings.READ_REPOSITORY_ENDPOINTS 에 엔드포인트 이름을 넣으면 해당 view 가
+ORM 대신 이 repository 를 사용한다.
+"""
+import re
+
+from django.conf import settings
+
+from . import hangul
+from .models import User
+
+LIST_PROJECTION = {
+    '_id': False,
+    'id': True,
+    'userid': True,
+    'username': True,
+    'profile_image': True,
+}
+
+PROFILE_PROJECTION = dict(
+    LIST_PROJECTION,
+    followers_count=True,
+    following_count=True,
+)
+
+
+def enabled(endpoint):
+    return endpoint in getattr(settings, 'READ_REPOSITORY_ENDPOINTS', ())
+
+
+def _prefix(key):
+    return {'$regex': '^' + re.escape(key)}
+
+
+def related_query(doc, field, position):
+    """
+    followers/following 배열의 유저를 pk 역순으로 읽는 조건
+    """
+    query = {'id': {'$in': list(doc.get(field) or ())}}
+    if position is not None:
+        query['id']['$lt'] = position[1]
+    return query
+
+
+def search_query(term, position):
+    """
+    User.objects.search 와 같은 조건. 검색할 키가 없으면 None.
+    """
+    if hangul.has_chosung(term):
+        query = {'search_chosung': _prefix(hangul.chosung(term))}
+    else:
+        key = hangul.normalize(term)
+        if not key:
+            return None
+        query = {'$or': [{'search_userid': _prefix(key)}, {'search_username': _prefix(key)}]}
+
+    if position is not None:
+        query = {'$and': [query, {'userid': {'$gt': position[0]}}]}
+    return query
+
+
+class UserRepository:
+
+    def __init__(self, manager=None):
+        self.manager = manager or User.objects
+
+    def get_profile(self, userid):
+        return self.manager.mongo_find_one({'userid': userid}, PROFILE_PROJECTION)
+
+    def _related(self, userid, field, position, limit):
+        doc = self.manager.mongo_find_one({'userid': userid}, {'_id': False, field: True})
+        if doc is None:
+            return None
+        return list(self.manager.mongo_find(related_query(doc, field, position), LIST_PROJECTION).sort('id', -1).limit(limit))
+
+    def get_followers(self, userid, position=None, limit=20):
+        return self._related(userid, 'followers_id', position, limit)
+
+    def get_following(self, userid, position=None, limit=20):
+        return self._related(userid, 'following_id', position, limit)
+
+    def search(self, term, position=None, limit=20):
+        query = search_query(term, position)
+        if query is None:
+            return []
+        return list(self.manager.mongo_find(query, LIST_PROJECTION).sort('userid', 1).limit(limit))
+
+
+class AsyncUserRepository:
+    """
+    UserRepository 와 같은 조회를 motor(비동기 드라이버) 컬렉션으로 실행한다.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get_profile(self, userid):
+        return await self.collection.find_one({'userid': userid}, PROFILE_PROJECTION)
+
+    async def _related(self, userid, field, position, limit):
+        doc = await self.collection.find_one({'userid': userid}, {'_id': False, field: True})
+        if doc is None:
+            return None
+        cursor = self.collection.find(related_query(doc, field, position), LIST_PROJECTION).sort('id', -1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def get_followers(self, userid, position=None, limit=20):
+        return await self._related(userid, 'followers_id', position, limit)
+
+    async def get_following(self, userid, position=None, limit=20):
+        return await self._related(userid, 'following_id', position, limit)
+
+    async def search(self, term, position=None, limit=20):
+        query = search_query(term, position)
+        if query is None:
+            return []
+        cursor = self.collection.find(query, LIST_PROJECTION).sort('userid', 1).limit(limit)
+        return await cursor.to_list(length=limit)
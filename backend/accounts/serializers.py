@@ -5,7 +5,9 @@ from rest_framework import serializers
 from rest_framework_jwt.serializers import VerifyJSONWebTokenSerializer, jwt_decode_handler
 from rest_framework_jwt.settings import api_settings
 from django.utils.translation import ugettext as _
+from backend.images import DerivativeImageField
 from .models import User
+from . import cache, tokens
 
 jwt_get_username_from_payload = api_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER
 
@@ -14,24 +16,31 @@ class UserSerializerWithToken(serializers.ModelSerializer):
 
     token = serializers.SerializerMethodField()
     password = serializers.CharField(write_only=True)
+    profile_image = DerivativeImageField(required=False, allow_null=True)
 
     def get_token(self, obj):
-        jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
-        jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
+        return tokens.get_token(obj)
 
-        payload = jwt_payload_handler(obj)
-        token = jwt_encode_handler(payload)
+    class Meta:
+        model = User
+        fields = ('token', 'userid', 'username', 'email', 'password', 'profile_image')
 
-        return token
+
+class UserListSerializer(serializers.ModelSerializer):
+    """
+    유저 목록(검색, 탐색, 팔로워, 팔로잉)용 serializer. 토큰을 포함하지 않는다.
+    """
+    profile_image = DerivativeImageField(read_only=True)
 
     class Meta:
         model = User
-        fields = ('token', 'userid', 'username', 'email', 'password', 'profile_image')
+        fields = ('userid', 'username', 'profile_image')
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
     followers_count = serializers.ReadOnlyField()
     following_count = serializers.ReadOnlyField()
+    profile_image = DerivativeImageField(required=False, allow_null=True)
 
     class Meta:
         model = User
@@ -78,7 +87,7 @@ class CustomVerifyJSONWebTokenSerializer(VerifyJSONWebTokenSerializer):
             raise serializers.ValidationError(msg)
 
         try:
-            user = User.objects.get_by_natural_key(userid)
+            user = cache.get_user(userid)
         except User.DoesNotExist:
             msg = _("User doesn't exist.")
             raise serializers.ValidationError(msg)
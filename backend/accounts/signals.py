@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import cache, tokens
+from .models import FollowSuggestion, User
+
+# 팔로우 관계가 바뀐 뒤에 보낸다. sender=User, user=팔로우 한 유저, targets=팔로우 대상 목록
+user_followed = Signal(providing_args=['user', 'targets'])
+user_unfollowed = Signal(providing_args=['user', 'targets'])
+
+
+# 유저 목록(UserListSerializer) 에 나오는 필드. 바뀌면 이 유저가 들어 있는 다른 유저의 팔로워/팔로잉 응답도 바뀐다.
+LIST_FIELDS = ('userid', 'username', 'profile_image')
+
+
+def _list_values(values):
+    return tuple(getattr(values.get(field), 'name', values.get(field)) or '' for field in LIST_FIELDS)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    instance._list_fields_changed = False
+    if instance.pk is None or (update_fields is not None and not set(update_fields) & set(LIST_FIELDS)):
+        return  # 로그인(last_login) 등은 목록에 나오는 필드를 바꾸지 않는다.
+    doc = User.objects.mongo_find_one({'id': instance.pk}, {'_id': False, 'userid': True, 'username': True, 'profile_image': True})
+    current = _list_values({field: getattr(instance, field) for field in LIST_FIELDS})
+    instance._list_fields_changed = doc is None or _list_values(doc) != current
+
+
+def bump_related_versions(user_pk, batch_size=1000):
+    """
+    user 가 들어 있는 팔로워/팔로잉 목록의 주인(user 의 팔로워와 팔로잉)의 version 을 올린다.
+    bump_version 은 version 이 있는(최근에 응답한) 유저만 올린다.
+    """
+    doc = User.objects.mongo_find_one({'id': user_pk}, {'_id': False, 'followers_id': True, 'following_id': True}) or {}
+    pks = list(set(doc.get('followers_id') or ()) | set(doc.get('following_id') or ()))
+    for start in range(0, len(pks), batch_size):
+        docs = User.objects.mongo_find({'id': {'$in': pks[start:start + batch_size]}}, {'_id': False, 'userid': True})
+        userids = [doc['userid'] for doc in docs]
+        if userids:
+            cache.bump_version(*userids)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    # 비밀번호, is_active, 프로필 변경 모두 저장을 거치므로 저장될 때마다 지운다.
+    cache.invalidate_user(instance.userid)
+    cache.bump_version(instance.userid)
+    tokens.invalidate_token(instance.userid)
+    if getattr(instance, '_list_fields_changed', False):
+        bump_related_versions(instance.pk)
+
+
+@receiver(user_followed, sender=User)
+@receiver(user_unfollowed, sender=User)
+def invalidate_follow_suggestions(sender, user, targets, **kwargs):
+    FollowSuggestion.objects.mark_stale(user, targets)
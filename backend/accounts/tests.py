@@ -1,3 +1,455 @@
-from django.test import TestCase
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from backend import export
+from backend.pagination import KeysetPagination
+from musicmaps.models import MusicMaps
+
+from . import cache, hangul, tokens, views
+from .models import User
+from .repository import UserRepository
+from .serializers import UserListSerializer, UserProfileSerializer, UserSerializerWithToken
+
+
+class UserRepositoryParityTest(TestCase):
+    """
+    repository(pymongo) 조회 결과가 ORM 조회 결과와 같은 응답을 만드는지 확인한다.
+    """
+
+    def setUp(self):
+        self.repository = UserRepository()
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+        self.others = [
+            User.objects.create_user(email='u%d@test.com' % i, userid='user%d' % i, password='pw', username='유저%d' % i)
+            for i in range(5)
+        ]
+        User.objects.follow(self.user, self.others[:3])
+        for other in self.others[2:]:
+            User.objects.follow(other, [self.user])
+
+    def test_profile(self):
+        orm = UserProfileSerializer(User.objects.get(userid='minsu')).data
+        repo = UserProfileSerializer(self.repository.get_profile('minsu')).data
+        self.assertEqual(orm, repo)
+        self.assertEqual(repo['followers_count'], 3)
+        self.assertEqual(repo['following_count'], 3)
+
+    def test_missing_user(self):
+        self.assertIsNone(self.repository.get_profile('nobody'))
+        self.assertIsNone(self.repository.get_followers('nobody'))
+
+    def test_followers_and_following(self):
+        user = User.objects.get(userid='minsu')
+        for name, fetch in (('followers', self.repository.get_followers), ('following', self.repository.get_following)):
+            orm = UserListSerializer(getattr(user, name).all().order_by('-id'), many=True).data
+            repo = UserListSerializer(fetch('minsu', limit=100), many=True).data
+            self.assertEqual(orm, repo, name)
+
+    def test_followers_position(self):
+        first = self.repository.get_followers('minsu', limit=2)
+        rest = self.repository.get_followers('minsu', position=(None, first[-1]['id']), limit=100)
+        orm = list(User.objects.get(userid='minsu').followers.all().order_by('-id').values_list('id', flat=True))
+        self.assertEqual([doc['id'] for doc in first + rest], orm)
+
+    def test_search(self):
+        for term in ('user', 'USER1', '유저', 'ㅇㅈ', 'ㄱㅁ', '!!'):
+            orm = UserListSerializer(User.objects.search(term).order_by('userid'), many=True).data
+            repo = UserListSerializer(self.repository.search(term, limit=100), many=True).data
+            self.assertEqual(orm, repo, term)
+
+
+class CounterTest(TestCase):
+    """
+    followers_count, following_count 는 배열과 함께 원자적으로 바뀌고, 문서 전체 저장으로 덮어쓰이지 않는다.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+        self.others = [
+            User.objects.create_user(email='u%d@test.com' % i, userid='user%d' % i, password='pw', username='유저%d' % i)
+            for i in range(3)
+        ]
+
+    def counters(self, user):
+        doc = User.objects.mongo_find_one({'id': user.pk}, {'followers_count': True, 'following_count': True})
+        return doc['followers_count'], doc['following_count']
+
+    def test_follow(self):
+        self.assertEqual(User.objects.follow(self.user, self.others), self.others)
+        self.assertEqual(User.objects.follow(self.user, self.others), [])  # 다시 팔로우해도 세지 않는다.
+        self.assertEqual(self.counters(self.user), (0, 3))
+        self.assertEqual([self.counters(other) for other in self.others], [(1, 0)] * 3)
+
+        User.objects.unfollow(self.user, self.others[:1])
+        User.objects.unfollow(self.user, self.others[:1])
+        self.assertEqual(self.counters(self.user), (0, 2))
+        self.assertEqual(self.counters(self.others[0]), (0, 0))
+
+    def test_save_keeps_counters(self):
+        stale = User.objects.get(pk=self.user.pk)
+        User.objects.follow(self.others[0], [self.user])
+        stale.username = '김민지'
+        stale.save()
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.username, '김민지')
+        self.assertEqual(self.counters(self.user), (1, 0))
+        self.assertEqual(set(user.followers_id), {self.others[0].pk})
+
+    def test_rebuild_counters(self):
+        User.objects.follow(self.user, self.others)
+        self.assertEqual(cache.get_user('minsu').following_count, 3)
+        version = cache.get_version('minsu')
+
+        User.objects.mongo_update_many({}, {'$set': {'followers_count': 7, 'following_count': 7}})
+        User.objects.rebuild_counters()
+        self.assertEqual(self.counters(self.user), (0, 3))
+        self.assertEqual([self.counters(other) for other in self.others], [(1, 0)] * 3)
+        # pymongo 로 고쳤으므로 캐시도 직접 지우고 version 을 올린다.
+        self.assertEqual(cache.get_user('minsu').following_count, 3)
+        self.assertGreater(cache.get_version('minsu'), version)
+
+
+class TokenCacheTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+        tokens.invalidate_token('minsu')
+
+    def test_reuse(self):
+        with mock.patch.object(tokens, 'mint_token', wraps=tokens.mint_token) as mint:
+            token = UserSerializerWithToken(self.user).data['token']
+            self.assertEqual(tokens.get_token(self.user), token)
+            self.assertEqual(mint.call_count, 1)
+
+            # 저장(비밀번호, is_active 변경 등)하면 다시 발급한다.
+            self.user.set_password('new')
+            self.user.save()
+            tokens.get_token(self.user)
+            self.assertEqual(mint.call_count, 2)
+
+    @override_settings(JWT_TOKEN_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        with mock.patch.object(tokens, 'mint_token', wraps=tokens.mint_token) as mint:
+            tokens.get_token(self.user)
+            tokens.get_token(self.user)
+            self.assertEqual(mint.call_count, 2)
+
+    def test_list_without_token(self):
+        with mock.patch.object(tokens, 'mint_token') as mint:
+            data = UserListSerializer([self.user], many=True).data
+        self.assertEqual(set(data[0]), {'userid', 'username', 'profile_image'})
+        mint.assert_not_called()
+
+
+class FollowTest(TestCase):
+    """
+    여러 유저 팔로우/언팔로우와 FollowUsers(follow/) API
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+        self.others = [
+            User.objects.create_user(email='u%d@test.com' % i, userid='user%d' % i, password='pw', username='유저%d' % i)
+            for i in range(3)
+        ]
+
+    def follow_users(self, data):
+        request = APIRequestFactory().post('/', data, format='json')
+        force_authenticate(request, user=User.objects.get(pk=self.user.pk))
+        return views.FollowUsers.as_view()(request)
+
+    def test_bulk_follow(self):
+        User.objects.follow(self.user, self.others[:1])
+        self.assertEqual(User.objects.follow(self.user, self.others + [self.user]), self.others[1:])
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(set(user.following_id), {other.pk for other in self.others})
+        self.assertEqual(user.following_count, 3)
+        for other in User.objects.filter(pk__in=[other.pk for other in self.others]):
+            self.assertEqual(set(other.followers_id), {self.user.pk})
+
+    def test_bulk_unfollow(self):
+        User.objects.follow(self.user, self.others)
+        self.assertEqual(User.objects.unfollow(self.user, self.others[:2]), self.others[:2])
+        self.assertEqual(User.objects.unfollow(self.user, self.others[:2]), [])
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(set(user.following_id), {self.others[2].pk})
+        self.assertEqual(set(User.objects.get(pk=self.others[0].pk).followers_id), set())
+
+    def test_repair_one_sided_edge(self):
+        # _apply_edges 가 following_id 만 쓰고 멈춘 경우와 followers_id 만 남은 경우
+        User.objects.mongo_update_one({'id': self.user.pk}, {'$addToSet': {'following_id': self.others[0].pk}})
+        User.objects.mongo_update_one({'id': self.others[1].pk}, {'$addToSet': {'followers_id': self.user.pk}})
+
+        User.objects.rebuild_counters()
+        self.assertEqual(set(User.objects.get(pk=self.others[0].pk).followers_id), {self.user.pk})
+        self.assertEqual(set(User.objects.get(pk=self.others[1].pk).followers_id), set())
+        self.assertEqual(User.objects.get(pk=self.others[0].pk).followers_count, 1)
+        self.assertEqual(User.objects.repair_followers(), 0)
+
+    def test_follow_users_view(self):
+        User.objects.follow(self.user, self.others[:1])
+        response = self.follow_users({'userids': ['user0', 'user1', 'nobody']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'followed': ['user1'], 'not_found': ['nobody']})
+        self.assertEqual(User.objects.get(pk=self.user.pk).following_count, 2)
+
+    def test_follow_users_view_invalid(self):
+        for data in ({}, {'userids': []}, {'userids': 'user0'}, {'userids': ['u'] * (views.FollowUsers.max_userids + 1)}):
+            self.assertEqual(self.follow_users(data).status_code, 400, data)
+
+
+class UserCacheTest(TestCase):
+    """
+    JWT 인증에서 쓰는 유저 캐시 (프로세스 내부 + 공유 캐시)
+    """
+
+    def setUp(self):
+        cache._local_user_cache().clear()
+        cache.invalidate_user('minsu')
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+
+    def test_cached_copy(self):
+        with mock.patch.object(User.objects, 'get_by_natural_key', wraps=User.objects.get_by_natural_key) as get:
+            user = cache.get_user('minsu')
+            user.username = 'changed'
+            self.assertEqual(cache.get_user('minsu').username, '김민수')  # 복사본을 돌려준다.
+            self.assertEqual(get.call_count, 1)
+
+            # 다른 프로세스(내부 캐시 없음)는 공유 캐시에서 읽는다.
+            cache._local_user_cache().clear()
+            self.assertEqual(cache.get_user('minsu').pk, self.user.pk)
+            self.assertEqual(get.call_count, 1)
+
+    def test_invalidated_on_save(self):
+        cache.get_user('minsu')
+        self.user.username = '김민지'
+        self.user.save()
+        self.assertEqual(cache.get_user('minsu').username, '김민지')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(cache.get_user('minsu').is_active)
+
+    def test_invalidated_on_follow(self):
+        other = User.objects.create_user(email='u@test.com', userid='other', password='pw', username='유저')
+        cache.get_user('minsu')
+        User.objects.follow(self.user, [other])
+        self.assertEqual(cache.get_user('minsu').following_count, 1)
+        self.assertEqual(cache.get_user('other').followers_count, 1)
+
+    def test_invalidated_on_delete(self):
+        cache.get_user('minsu')
+        self.user.delete()
+        with self.assertRaises(User.DoesNotExist):
+            cache.get_user('minsu')
+
+
+class ConditionalResponseTest(TestCase):
+    """
+    프로필/팔로워/팔로잉 응답의 ETag, 304, Vary: Accept 와 version 갱신
+    """
+
+    def setUp(self):
+        cache._local_user_cache().clear()
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+        self.other = User.objects.create_user(email='u@test.com', userid='other', password='pw', username='유저')
+        User.objects.follow(self.other, [self.user])
+
+    def get(self, view, userid='minsu', **headers):
+        request = APIRequestFactory().get('/', **headers)
+        force_authenticate(request, user=User.objects.get(pk=self.user.pk))
+        return view.as_view()(request, userid=userid)
+
+    def test_not_modified(self):
+        response = self.get(views.UserProfile)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Accept', response['Vary'])
+        etag = response['ETag']
+
+        response = self.get(views.UserProfile, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept', response['Vary'])
+
+        # 형식이 다르면 ETag 도 다르다.
+        response = self.get(views.UserProfile, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_version_bumped_on_follow(self):
+        etag = self.get(views.UserFollowers)['ETag']
+        third = User.objects.create_user(email='t@test.com', userid='third', password='pw', username='셋')
+        User.objects.follow(third, [self.user])
+        response = self.get(views.UserFollowers, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['userid'] for user in response.data['results']], ['third', 'other'])
+
+    def test_list_changes_with_listed_user(self):
+        etag = self.get(views.UserFollowers)['ETag']
+
+        # 로그인(last_login 만 저장)은 목록을 바꾸지 않는다.
+        other = User.objects.get(pk=self.other.pk)
+        other.save(update_fields=['last_login'])
+        self.assertEqual(self.get(views.UserFollowers, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        other.username = '바뀐 이름'
+        other.save()
+        response = self.get(views.UserFollowers, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['username'], '바뀐 이름')
+
+    def test_put_not_stale(self):
+        self.assertEqual(self.get(views.UserProfile).data['username'], '김민수')
+
+        request = APIRequestFactory().put('/', {'username': '김민지'}, format='json')
+        force_authenticate(request, user=User.objects.get(pk=self.user.pk))
+        self.assertEqual(views.UserProfile.as_view()(request, userid='minsu').status_code, 200)
+
+        self.assertEqual(self.get(views.UserProfile).data['username'], '김민지')
+        self.assertEqual(cache.get_user('minsu').username, '김민지')
+
+
+def paginated_request(**params):
+    return Request(APIRequestFactory().get('/', params))
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.repository = UserRepository()
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+        self.others = [
+            User.objects.create_user(email='u%d@test.com' % i, userid='user%d' % i, password='pw', username='유저%d' % i)
+            for i in range(7)
+        ]
+        for other in self.others:
+            User.objects.follow(other, [self.user])
+
+    def pages(self, paginate, **params):
+        """
+        next 링크의 cursor 를 따라가며 모든 페이지를 읽는다.
+        """
+        pages = []
+        while True:
+            paginator = KeysetPagination()
+            pages.append(paginate(paginator, paginated_request(**params)))
+            link = paginator.get_next_link()
+            if link is None:
+                return pages
+            params['cursor'] = parse_qs(urlparse(link).query)['cursor'][0]
+
+    def test_documents(self):
+        pages = self.pages(
+            lambda paginator, request: paginator.paginate_documents(
+                lambda position, limit: self.repository.get_followers('minsu', position, limit), request
+            ),
+            page_size=3,
+        )
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        expected = sorted((other.pk for other in self.others), reverse=True)
+        self.assertEqual([doc['id'] for page in pages for doc in page], expected)
+
+    def test_queryset(self):
+        pages = self.pages(
+            lambda paginator, request: paginator.paginate_queryset(User.objects.all(), request),
+            page_size=3,
+        )
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual([user.pk for page in pages for user in page], list(User.objects.order_by('-id').values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        for cursor in ('not base64!', 'e30=', 'bnVsbA=='):  # 깨진 값, {}, null
+            with self.assertRaises(NotFound):
+                KeysetPagination().paginate_documents(lambda position, limit: [], paginated_request(cursor=cursor))
+
+        # 모양은 맞지만 정렬 필드나 pk 로 바꿀 수 없는 값
+        paginator = KeysetPagination(ordering='-date_joined')
+        date_joined = self.user.date_joined.isoformat()
+        for value, pk in (('x', 1), (None, 1), (date_joined, 'x'), (date_joined, [1]), (date_joined, None)):
+            with self.assertRaises(NotFound):
+                paginator.paginate_queryset(
+                    User.objects.all(), paginated_request(cursor=paginator.encode_cursor(value, pk))
+                )
+        with self.assertRaises(NotFound):
+            KeysetPagination().paginate_queryset(
+                User.objects.all(), paginated_request(cursor=KeysetPagination().encode_cursor(None, {}))
+            )
+
+
+class UserSearchTest(TestCase):
+
+    def setUp(self):
+        for userid, username in (('minsu', '김민수'), ('minji', '김민지'), ('kimchi', '박지성'), ('sungmin', 'Sung Min')):
+            User.objects.create_user(email='%s@test.com' % userid, userid=userid, password='pw', username=username)
+
+    def userids(self, term):
+        return sorted(User.objects.search(term).values_list('userid', flat=True))
+
+    def test_chosung(self):
+        self.assertEqual(hangul.chosung('김민수!'), 'ㄱㅁㅅ')
+        self.assertEqual(hangul.chosung('Sung 민'), 'sungㅁ')
+        self.assertTrue(hangul.has_chosung('ㄱ민'))
+        self.assertFalse(hangul.has_chosung('김민'))
+
+        self.assertEqual(self.userids('ㄱㅁ'), ['minji', 'minsu'])
+        self.assertEqual(self.userids('ㄱㅁㅅ'), ['minsu'])
+        self.assertEqual(self.userids('김ㅁ'), ['minji', 'minsu'])  # 완성형이 섞여도 초성으로 비교한다.
+        self.assertEqual(self.userids('ㅂㅈ'), ['kimchi'])
+
+    def test_prefix(self):
+        self.assertEqual(self.userids('min'), ['minji', 'minsu'])
+        self.assertEqual(self.userids('김민'), ['minji', 'minsu'])
+        self.assertEqual(self.userids('sung min'), ['sungmin'])  # 공백, 대소문자는 무시한다.
+        self.assertEqual(self.userids('.*'), [])  # 정규식 특수문자는 지운다.
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+        self.others = [
+            User.objects.create_user(email='u%d@test.com' % i, userid='user%d' % i, password='pw', username='유저%d' % i)
+            for i in range(3)
+        ]
+        User.objects.follow(self.user, self.others[:2])
+        for other in self.others[1:]:
+            User.objects.follow(other, [self.user])
+        for i in range(3):
+            MusicMaps.objects.create(
+                images=[],
+                content='map %d' % i,
+                open_range=MusicMaps.OpenRange.PUBLIC,
+                comments_on=True,
+                author=self.user,
+                location={'type': 'Point', 'coordinates': [127.0, 37.5]},
+                street_address='서울',
+                building_number=str(i),
+            )
+        self.user = User.objects.get(pk=self.user.pk)
+
+    def test_records(self):
+        records = list(export.records(self.user, batch_size=2))
+        self.assertEqual(
+            [record['type'] for record in records],
+            ['user', 'follower', 'follower', 'following', 'following', 'musicmap', 'musicmap', 'musicmap'],
+        )
+        self.assertEqual(records[0]['data']['userid'], 'minsu')
+        self.assertEqual([record['data']['content'] for record in records[5:]], ['map 0', 'map 1', 'map 2'])
+
+    def test_resume(self):
+        records = list(export.records(self.user, batch_size=2))
+        for index, record in enumerate(records):
+            resumed = list(export.records(self.user, cursor=record['cursor'], batch_size=2))
+            self.assertEqual(resumed, records[index + 1:], record['type'])
+
+    def test_invalid_cursor(self):
+        for cursor in ('not base64!', 'WzksbnVsbCxudWxsXQ=='):  # 깨진 값, 없는 구간 [9, null, null]
+            with self.assertRaises(export.InvalidCursor):
+                list(export.records(self.user, cursor=cursor))
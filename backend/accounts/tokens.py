@@ -0,0 +1,47 @@
+"""
+JWT 발급 캐시
+
+로그인/verify 재시도가 몰려도 같은 유저의 토큰을 매번 새로 서명하지 않도록,
+발급한 토큰을 만료 시간보다 짧게 캐시해서 재사용한다.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_jwt.settings import api_settings
+
+from backend.metrics import timed_function
+
+TOKEN_CACHE_KEY = 'accounts:jwt:%s'
+
+
+def token_cache_timeout():
+    timeout = getattr(settings, 'JWT_TOKEN_CACHE_TIMEOUT', None)
+    if timeout is None:
+        # 재사용된 토큰도 충분한 유효기간이 남도록 만료 시간의 절반만 캐시한다.
+        timeout = api_settings.JWT_EXPIRATION_DELTA.total_seconds() / 2
+    return int(timeout)
+
+
+@timed_function('jwt')
+def mint_token(user):
+    payload = api_settings.JWT_PAYLOAD_HANDLER(user)
+    return api_settings.JWT_ENCODE_HANDLER(payload)
+
+
+def get_token(user):
+    """
+    캐시된 토큰이 있으면 재사용하고, 없으면 새로 발급해서 캐시한다.
+    """
+    timeout = token_cache_timeout()
+    if timeout <= 0:
+        return mint_token(user)
+
+    key = TOKEN_CACHE_KEY % user.userid
+    token = cache.get(key)
+    if token is None:
+        token = mint_token(user)
+        cache.set(key, token, timeout)
+    return token
+
+
+def invalidate_token(userid):
+    cache.delete(TOKEN_CACHE_KEY % userid)
@@ -20,9 +20,11 @@ urlpatterns = [
 
     url(r'^search/$', views.Search.as_view(), name='search'),
     url(r'^explore/$', views.ExploreUsers.as_view(), name='explore_user'),
+    url(r'^follow/$', views.FollowUsers.as_view(), name='follow_users'),
+    url(r'^export/$', views.ExportUserData.as_view(), name='export_user_data'),
     url(r'^(?P<userid>\w+)/$', views.UserProfile.as_view(), name='user_profile'),
-    url(r'^(?P<userid>\d+)/follow/$', views.FollowUser.as_view(), name='follow_user'),
-    url(r'^(?P<userid>\d+)/unfollow/$', views.UnFollowUser.as_view(), name='unfollow_user'),
+    url(r'^(?P<userid>\w+)/follow/$', views.FollowUser.as_view(), name='follow_user'),
+    url(r'^(?P<userid>\w+)/unfollow/$', views.UnFollowUser.as_view(), name='unfollow_user'),
     url(r'^(?P<userid>\w+)/followers/$', views.UserFollowers.as_view(), name='user_followers'),
     url(r'^(?P<userid>\w+)/following/$', views.UserFollowing.as_view(), name='user_following'), # 로그인 되어 있는 유저가 팔로우한 다른 유저목록
 ]
@@ -1,5 +1,12 @@
+import datetime
+
 from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 from django.contrib.auth import get_user_model
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from rest_auth.registration.views import SocialLoginView
 from allauth.socialaccount.providers.oauth2.client import OAuth2Client
 
@@ -9,7 +16,17 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import api_view
 
-from .serializers import UserSerializerWithToken, UserProfileSerializer, CustomVerifyJSONWebTokenSerializer
+from backend import export
+from backend.metrics import serialized
+from backend.pagination import KeysetPagination
+from backend.renderers import renderer_for
+
+from . import cache, repository
+from .models import FollowSuggestion
+from .signals import user_followed, user_unfollowed
+from .serializers import (
+    UserSerializerWithToken, UserListSerializer, UserProfileSerializer, CustomVerifyJSONWebTokenSerializer
+)
 
 User = get_user_model()
 
@@ -21,8 +38,52 @@ class GoogleLogin(SocialLoginView):
 
 @api_view(['GET'])
 def current_user(request):
-    serializer = UserSerializerWithToken(request.user)
-    return Response(serializer.data)
+    serializer = UserSerializerWithToken(request.user, context={'request': request})
+    return Response(serialized(serializer))
+
+
+def user_version(request, userid, format=None):
+    # 한 요청에서 ETag, Last-Modified, 응답 캐시가 같은 version 을 쓰도록 request 에 보관한다.
+    versions = request.__dict__.setdefault('_user_versions', {})
+    if userid not in versions:
+        versions[userid] = cache.get_version(userid)
+    return versions[userid]
+
+
+def user_etag(request, userid, format=None):
+    # 같은 version 이라도 JSON 과 MessagePack 응답은 본문이 다르므로 협상된 형식을 ETag 에 넣는다.
+    media_format = format or renderer_for(request.META.get('HTTP_ACCEPT')).format
+    return '%s-%s' % (user_version(request, userid), media_format)
+
+
+def user_last_modified(request, userid, format=None):
+    return datetime.datetime.fromtimestamp(user_version(request, userid) // 1000, tz=timezone.utc)
+
+
+# 유저 version 으로 ETag/Last-Modified 를 붙이고 If-None-Match/If-Modified-Since 에 304 로 응답한다.
+# 응답 형식은 Accept 로 정해지므로 304 에도 Vary: Accept 를 붙인다.
+conditional_on_user = method_decorator([
+    vary_on_headers('Accept'),
+    condition(etag_func=user_etag, last_modified_func=user_last_modified),
+])
+
+
+def cached_user_response(name, request, userid, build):
+    """
+    (name, userid, version, URL) 로 응답 data 를 캐시한다. build() 는 (data, status) 를 반환한다.
+    렌더링 전의 data 를 캐시하므로 JSON, MessagePack 요청이 같은 항목을 쓴다.
+    """
+    version = user_version(request, userid)
+    uri = request.build_absolute_uri()
+
+    data = cache.get_response(name, userid, version, uri)
+    if data is not None:
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    data, response_status = build()
+    if response_status == status.HTTP_200_OK:
+        cache.set_response(name, userid, version, uri, data)
+    return Response(data=data, status=response_status)
 
 
 class UserProfile(APIView):
@@ -37,16 +98,23 @@ class UserProfile(APIView):
         except User.DoesNotExist:
             return None
 
+    @conditional_on_user
     def get(self, request, userid, format=None):
+        return cached_user_response('profile', request, userid, lambda: self.build(request, userid))
 
-        user = self.get_user(userid)
+    def build(self, request, userid):
+
+        if repository.enabled('profile'):
+            user = repository.UserRepository().get_profile(userid)
+        else:
+            user = self.get_user(userid)
 
         if user is None:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+            return None, status.HTTP_404_NOT_FOUND
 
-        serializer = UserProfileSerializer(user)
+        serializer = UserProfileSerializer(user, context={'request': request})
 
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return serialized(serializer), status.HTTP_200_OK
 
     def put(self, request, userid, format=None):
 
@@ -64,13 +132,21 @@ class UserProfile(APIView):
 
         else:
 
-            serializer = UserProfileSerializer(user, data=request.data, partial=True)
+            serializer = UserProfileSerializer(user, data=request.data, partial=True, context={'request': request})
 
             if serializer.is_valid():
 
+                previous_userid = user.userid
+
                 serializer.save()
 
-                return Response(data=serializer.data, status=status.HTTP_200_OK)
+                # 새 userid 는 post_save signal 이 지운다. userid 가 바뀐 경우 이전 userid 의 캐시도 지운다.
+                # (저장 전에 지우면 그 사이의 조회가 이전 값으로 다시 캐시한다)
+                if previous_userid != user.userid:
+                    cache.invalidate_user(previous_userid)
+                    cache.bump_version(previous_userid)
+
+                return Response(data=serialized(serializer), status=status.HTTP_200_OK)
 
             else:
 
@@ -79,13 +155,23 @@ class UserProfile(APIView):
 
 class ExploreUsers(APIView):
     """
-    신규 가입 유저 5명을 탐색한다.
+    팔로우 추천 유저를 탐색한다. (기본 5명)
+    추천이 계산되지 않은 유저에게는 신규 가입 유저를 보여준다.
     """
     def get(self, request, format=None):
-        last_five = User.objects.all().order_by('-date_joined')[:5]
-        serializer = UserSerializerWithToken(last_five, many=True)
+        paginator = KeysetPagination(ordering='-date_joined')
+        paginator.page_size = 5
+
+        if paginator.cursor_query_param not in request.query_params:
+            suggested = FollowSuggestion.objects.suggested_users(request.user, paginator.get_page_size(request))
+            if suggested:
+                serializer = UserListSerializer(suggested, many=True, context={'request': request})
+                return Response(data={'next': None, 'results': serialized(serializer)}, status=status.HTTP_200_OK)
 
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        users = paginator.paginate_queryset(User.objects.all(), request, view=self)
+        serializer = UserListSerializer(users, many=True, context={'request': request})
+
+        return paginator.get_paginated_response(serialized(serializer))
 
 
 class FollowUser(APIView):
@@ -99,12 +185,42 @@ class FollowUser(APIView):
         except User.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        user.following.add(user_to_follow)
-        user_to_follow.followers.add(user)
+        followed = User.objects.follow(user, [user_to_follow])
+        if followed:
+            user_followed.send(sender=User, user=user, targets=followed)
 
         return Response(status=status.HTTP_200_OK)
 
 
+class FollowUsers(APIView):
+    """
+    여러 유저를 한번에 팔로우한다. (연락처 가져오기 등)
+    request:
+        "userids" : [string]
+    """
+    max_userids = 500
+
+    def post(self, request, format=None):
+        user = request.user
+
+        userids = request.data.get('userids')
+        if not isinstance(userids, list) or not userids or len(userids) > self.max_userids:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        targets = list(User.objects.filter(userid__in=userids))
+        followed = User.objects.follow(user, targets)
+        if followed:
+            user_followed.send(sender=User, user=user, targets=followed)
+
+        found = {target.userid for target in targets}
+        data = {
+            'followed': [target.userid for target in followed],
+            'not_found': [userid for userid in userids if userid not in found],
+        }
+
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
 class UnFollowUser(APIView):
 
     def put(self, request, userid, format=None):
@@ -117,25 +233,58 @@ class UnFollowUser(APIView):
         except User.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        user.following.remove(user_to_follow)
-        user_to_follow.followers.remove(user)
+        unfollowed = User.objects.unfollow(user, [user_to_follow])
+        if unfollowed:
+            user_unfollowed.send(sender=User, user=user, targets=unfollowed)
 
         return Response(status=status.HTTP_200_OK)
 
 
-class Search(APIView): # 유저 한글 이름(현재 하단에 구현된 코드)과 유저 닉네임으로 검색하는 기능(추후 추가)
+class ExportUserData(APIView):
+    """
+    로그인한 유저의 개인 데이터를 NDJSON 으로 스트리밍한다. (backend/export.py)
+    request query: "cursor" (받은 마지막 줄의 cursor. 그 다음 레코드부터 이어서 받는다)
+    """
 
     def get(self, request, format=None):
 
-        userid = request.query_params.get('userid', None)
+        cursor = request.query_params.get('cursor')
+        try:
+            export.decode_cursor(cursor)
+        except export.InvalidCursor:
+            return Response(data={'detail': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(export.lines(request.user, cursor, request=request), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="%s.ndjson"' % request.user.userid
+        response['Cache-Control'] = 'no-store'
+        return response
 
-        if userid is not None:
 
-            users = User.objects.filter(userid__istartswith=userid)
+class Search(APIView):
+    """
+    유저 닉네임(userid)과 한글 이름(username) prefix 검색. 초성 검색("ㄱㅁㅅ")도 지원한다.
+    request query: "q" (또는 "userid")
+    """
+
+    def get(self, request, format=None):
+
+        term = request.query_params.get('q', request.query_params.get('userid', None))
+
+        if term:
+
+            paginator = KeysetPagination(ordering='userid')
+
+            if repository.enabled('search'):
+                users = paginator.paginate_documents(
+                    lambda position, limit: repository.UserRepository().search(term, position, limit),
+                    request, view=self
+                )
+            else:
+                users = paginator.paginate_queryset(User.objects.search(term), request, view=self)
 
-            serializer = UserSerializerWithToken(users, many=True)
+            serializer = UserListSerializer(users, many=True, context={'request': request})
 
-            return Response(data=serializer.data, status=status.HTTP_200_OK)
+            return paginator.get_paginated_response(serialized(serializer))
 
         else:
 
@@ -144,34 +293,64 @@ class Search(APIView): # 유저 한글 이름(현재 하단에 구현된 코드)
 
 class UserFollowers(APIView):
 
+    @conditional_on_user
     def get(self, request, userid, format=None):
+        return cached_user_response('followers', request, userid, lambda: self.build(request, userid))
 
-        try:
-            user = User.objects.get(userid=userid)
-        except User.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+    def build(self, request, userid):
+
+        paginator = KeysetPagination(ordering='-id')
+
+        if repository.enabled('followers'):
+            followers = paginator.paginate_documents(
+                lambda position, limit: repository.UserRepository().get_followers(userid, position, limit),
+                request, view=self
+            )
+            if followers is None:
+                return None, status.HTTP_404_NOT_FOUND
+
+        else:
+            try:
+                user = User.objects.get(userid=userid)
+            except User.DoesNotExist:
+                return None, status.HTTP_404_NOT_FOUND
 
-        followers = user.followers.all()
+            followers = paginator.paginate_queryset(user.followers.all(), request, view=self)
 
-        serializer = UserSerializerWithToken(followers, many=True)
+        serializer = UserListSerializer(followers, many=True, context={'request': request})
 
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serialized(serializer)).data, status.HTTP_200_OK
 
 
 class UserFollowing(APIView):
 
+    @conditional_on_user
     def get(self, request, userid, format=None):
+        return cached_user_response('following', request, userid, lambda: self.build(request, userid))
 
-        try:
-            user = User.objects.get(userid=userid)
-        except User.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+    def build(self, request, userid):
+
+        paginator = KeysetPagination(ordering='-id')
+
+        if repository.enabled('following'):
+            following = paginator.paginate_documents(
+                lambda position, limit: repository.UserRepository().get_following(userid, position, limit),
+                request, view=self
+            )
+            if following is None:
+                return None, status.HTTP_404_NOT_FOUND
+
+        else:
+            try:
+                user = User.objects.get(userid=userid)
+            except User.DoesNotExist:
+                return None, status.HTTP_404_NOT_FOUND
 
-        following = user.following.all()
+            following = paginator.paginate_queryset(user.following.all(), request, view=self)
 
-        serializer = UserSerializerWithToken(following, many=True)
+        serializer = UserListSerializer(following, many=True, context={'request': request})
 
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serialized(serializer)).data, status.HTTP_200_OK
 
 
 class UserTokenVerify(APIView):
@@ -185,7 +364,7 @@ class UserTokenVerify(APIView):
         token, user = serializer_class.validate(serializer_class, request.data)
 
         serializer = UserSerializerWithToken(user)
-        user_token = serializer.data.get('token')
+        user_token = serialized(serializer).get('token')
         data = {'token': user_token,
                 'user': {
                     "profile_image": serializer.data.get('profile_image'),
@@ -220,7 +399,7 @@ class UserLogin(APIView):
 
         serializer = UserSerializerWithToken(user)
 
-        user_token = serializer.data.get('token')
+        user_token = serialized(serializer).get('token')
         data = {'token': user_token,
                 'user': {
                     "profile_image": serializer.data.get('profile_image'),
@@ -2,6 +2,8 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+GET requests for the endpoints listed in ``ASYNC_READ_ENDPOINTS`` are served by
+``backend.asgi_routes.AsyncReadRouter`` on motor; everything else goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -13,4 +15,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from .asgi_routes import AsyncReadRouter  # noqa: E402 (Django 설정 이후에 import 해야 한다)
+
+application = AsyncReadRouter(django_application)
@@ -0,0 +1,195 @@
+"""
+비동기 조회 라우터
+
+djongo 는 동기 드라이버(pymongo)만 지원하고 Django 3.0 은 비동기 view 를 지원하지 않으므로,
+조회가 많은 GET 엔드포인트는 Django 앞단의 ASGI 라우터에서 motor 로 직접 처리한다.
+MongoDB 응답을 기다리는 동안 worker 스레드를 잡지 않으므로 uvicorn worker 하나가
+훨씬 많은 동시 요청을 처리할 수 있다.
+
+settings.ASYNC_READ_ENDPOINTS 에 들어있는 엔드포인트만 처리하고, 나머지 요청과
+처리할 수 없는 요청(JWT 가 아닌 인증, bbox 검색 등)은 그대로 Django 로 넘긴다.
+응답 모양은 Django view 와 같다. Django view 와 같은 계측(backend/metrics.py)을 거치고,
+view 가 돌려준 헤더(ETag, Last-Modified 등)를 함께 보낸다.
+"""
+import re
+from importlib import import_module
+from urllib.parse import urljoin
+
+import jwt
+from django.conf import settings
+from django.http import QueryDict
+from django.utils.translation import ugettext as _
+from rest_framework.exceptions import APIException
+from rest_framework_jwt.settings import api_settings
+
+from . import metrics, mongo
+from .renderers import renderer_for
+
+jwt_decode_handler = api_settings.JWT_DECODE_HANDLER
+jwt_get_username_from_payload = api_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER
+
+# accounts/<userid>/ 로 해석되면 안 되는 경로
+RESERVED_ACCOUNT_PATHS = ('search', 'explore', 'follow', 'login', 'logout', 'register', 'verify', 'refresh', 'rest-auth', 'export')
+
+ROUTES = (
+    ('search', r'^/accounts/search/$', 'accounts.async_views.search'),
+    ('followers', r'^/accounts/(?P<userid>\w+)/followers/$', 'accounts.async_views.followers'),
+    ('following', r'^/accounts/(?P<userid>\w+)/following/$', 'accounts.async_views.following'),
+    ('profile', r'^/accounts/(?!(?:%s)/)(?P<userid>\w+)/$' % '|'.join(RESERVED_ACCOUNT_PATHS),
+     'accounts.async_views.profile'),
+    ('nearby', r'^/musicmaps/list/$', 'musicmaps.async_views.nearby'),
+)
+
+VIEWER_PROJECTION = {
+    '_id': False,
+    'id': True,
+    'userid': True,
+    'is_active': True,
+    'followers_id': True,
+    'following_id': True,
+}
+
+
+class AsyncAPIError(Exception):
+
+    def __init__(self, status, detail=None):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class AsyncRequest:
+    """
+    비동기 view 에 넘기는 최소한의 request. (query_params, build_absolute_uri, 조건부 요청 처리에 쓰는 META)
+    """
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'').decode('latin-1')
+        self.query_params = QueryDict(self.query_string)
+        self.headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope.get('headers', ())
+        }
+        self.META = {'HTTP_%s' % name.upper().replace('-', '_'): value for name, value in self.headers.items()}
+
+    @property
+    def jwt(self):
+        auth = self.headers.get('authorization', '').split()
+        prefix = api_settings.JWT_AUTH_HEADER_PREFIX.lower()
+        if len(auth) != 2 or auth[0].lower() != prefix:
+            return None
+        return auth[1]
+
+    def build_absolute_uri(self, location=None):
+        host = self.headers.get('host')
+        if host is None:
+            server = self.scope.get('server') or ('localhost', 80)
+            host = '%s:%s' % server
+        origin = '%s://%s' % (self.scope.get('scheme', 'http'), host)
+        if location is not None:
+            return urljoin(origin + self.path, location)
+        uri = origin + self.path
+        return '%s?%s' % (uri, self.query_string) if self.query_string else uri
+
+
+async def authenticate(request):
+    """
+    CachedJSONWebTokenAuthentication 과 같은 검사를 motor 로 수행하고 viewer 문서를 반환한다.
+    """
+    from accounts.models import User
+
+    try:
+        payload = jwt_decode_handler(request.jwt)
+    except jwt.ExpiredSignature:
+        raise AsyncAPIError(401, _('Signature has expired.'))
+    except jwt.InvalidTokenError:
+        raise AsyncAPIError(401, _('Error decoding signature.'))
+
+    userid = jwt_get_username_from_payload(payload)
+    if not userid:
+        raise AsyncAPIError(401, _('Invalid payload.'))
+
+    viewer = await mongo.collection(User).find_one({'userid': userid}, VIEWER_PROJECTION)
+    if viewer is None:
+        raise AsyncAPIError(401, _('Invalid signature.'))
+    if not viewer.get('is_active', True):
+        raise AsyncAPIError(401, _('User account is disabled.'))
+    return viewer
+
+
+class AsyncReadRouter:
+
+    def __init__(self, application, routes=ROUTES):
+        self.application = application
+        self.routes = [(name, re.compile(pattern), view) for name, pattern, view in routes]
+        self._views = {}
+        if metrics.metrics_settings()['ENABLED']:
+            metrics.install()
+
+    def enabled(self, name):
+        return name in getattr(settings, 'ASYNC_READ_ENDPOINTS', ())
+
+    def get_view(self, path):
+        view = self._views.get(path)
+        if view is None:
+            module, name = path.rsplit('.', 1)
+            view = self._views[path] = getattr(import_module(module), name)
+        return view
+
+    def resolve(self, scope):
+        """
+        (route 이름, view, kwargs). 처리하지 않는 요청이면 (None, None, None)
+        """
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return None, None, None
+        for name, pattern, view in self.routes:
+            match = pattern.match(scope['path'])
+            if match is not None:
+                return (name, view, match.groupdict()) if self.enabled(name) else (None, None, None)
+        return None, None, None
+
+    async def __call__(self, scope, receive, send):
+        name, view, kwargs = self.resolve(scope)
+
+        if view is not None:
+            request = AsyncRequest(scope)
+            if request.jwt is not None:
+                with metrics.measure('async:%s' % name, request.method) as measured:
+                    try:
+                        result = await self.get_view(view)(request, **kwargs)
+                    except AsyncAPIError as error:
+                        result = (error.status, {'detail': error.detail} if error.detail else None)
+                    except APIException as error:
+                        # view 와 함께 쓰는 코드(KeysetPagination 등)가 DRF 예외를 던지면 DRF 와 같은 응답을 보낸다.
+                        result = (error.status_code, {'detail': error.detail})
+
+                    if result is None:
+                        measured['status'] = None  # Django 로 넘기는 요청은 Django 쪽에서 기록한다.
+                    else:
+                        measured['status'] = result[0]
+                        await self.respond(send, *result, accept=request.headers.get('accept'))
+                        return
+
+        await self.application(scope, receive, send)
+
+    async def respond(self, send, status, data=None, extra_headers=None, accept=None):
+        renderer = renderer_for(accept)
+        with metrics.timed('render'):
+            body = renderer.render(data) if data is not None else b''
+        # 응답 형식이 Accept 로 정해지므로 캐시가 형식별로 따로 저장하도록 한다. (304 포함)
+        headers = [(b'content-length', str(len(body)).encode('latin-1')), (b'vary', b'Accept')]
+        if data is not None:
+            headers.append((b'content-type', renderer.media_type.encode('latin-1')))
+        if status == 401:
+            headers.append((b'www-authenticate', api_settings.JWT_AUTH_HEADER_PREFIX.encode('latin-1')))
+        for header, value in (extra_headers or {}).items():
+            headers.append((header.lower().encode('latin-1'), value.encode('latin-1')))
+        request_metrics = metrics.current()
+        if request_metrics is not None and metrics.metrics_settings()['SERVER_TIMING']:
+            headers.append((b'server-timing', metrics.server_timing(request_metrics).encode('latin-1')))
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
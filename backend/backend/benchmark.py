@@ -0,0 +1,562 @@
+"""
+부하 테스트 / 벤치마크
+
+벤치마크용 유저, 팔로우 그래프, MusicMaps 를 만들고(seed), 엔드포인트를 정해진 동시성으로
+호출해서 지연시간 분위수(p50/p95/p99), 처리량, 요청당 MongoDB 왕복 횟수를 잰다.
+요청은 Django test Client 로 프로세스 안에서 보내므로 네트워크 비용 없이 view, serializer,
+DB 비용만 측정된다. 결과는 JSON 으로 남겨서 리뷰에서 이전 결과와 비교한다.
+
+벤치마크는 Django test runner 와 같은 방법(create_test_db)으로 만든 전용 데이터베이스
+('<NAME>_benchmark')에서만 실행한다. seed 로 만든 문서에는 모두 {"benchmark": prefix} 표시를 붙이고,
+cleanup 은 이 표시가 있는 문서만 지운다.
+
+사용: python manage.py benchmark --users 1000 --follow-density 0.02 --maps 5000 --concurrency 8
+
+renderer 벤치마크(python manage.py benchmark_renderers)는 같은 데이터로 만든 UserSerializerWithToken,
+MusicMapSerializer 목록을 renderer/parser 별로 직렬화/역직렬화하는 시간과 크기만 잰다.
+"""
+import io
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from pymongo import UpdateOne, monitoring
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+# seed 로 만든 문서에 붙이는 필드. 값은 prefix 이다.
+TAG_FIELD = 'benchmark'
+
+# 서울 시청 기준
+DEFAULT_CENTER = (126.9780, 37.5665)
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """
+    스레드별로 MongoDB 에 보낸 명령 수를 센다.
+    명령 이벤트는 명령을 보낸 스레드에서 동기적으로 발생하므로 thread-local 로 충분하다.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.commands = Counter()
+
+    def commands(self):
+        return getattr(self._local, 'commands', Counter())
+
+    def started(self, event):
+        commands = getattr(self._local, 'commands', None)
+        if commands is not None:
+            commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+_counter = None
+
+
+def install_counter():
+    """
+    MongoClient 가 만들어지기 전에 호출해야 한다. (pymongo 는 생성 시점의 listener 만 사용한다)
+    """
+    global _counter
+    if _counter is None:
+        _counter = RoundTripCounter()
+        monitoring.register(_counter)
+    return _counter
+
+
+def use_mongomock():
+    """
+    MongoDB 대신 mongomock 으로 실행한다. 왕복 횟수는 측정되지 않는다.
+    mongomock 은 2dsphere/text 인덱스 연산자를 지원하지 않으므로 위치 검색은 grid, 전문 검색은 local 로 바꾼다.
+    """
+    import mongomock
+    from djongo import database
+
+    database.MongoClient = mongomock.MongoClient
+    database.clients.clear()
+
+    settings.MUSICMAPS_GEO = dict(getattr(settings, 'MUSICMAPS_GEO', {}), BACKEND='grid')
+    settings.MUSICMAPS_SEARCH = dict(getattr(settings, 'MUSICMAPS_SEARCH', {}), BACKEND='local')
+
+
+def setup_database(name=None, keepdb=False):
+    """
+    벤치마크 전용 데이터베이스를 만들고(migrate, 인덱스) default 연결을 그쪽으로 바꾼다.
+    keepdb 이면 이미 있는 데이터베이스를 그대로 쓴다. 원래 데이터베이스 이름을 반환한다.
+    """
+    from django.core.management import call_command
+    from django.db import connections
+
+    connection = connections['default']
+    old_name = connection.settings_dict['NAME']
+    connection.settings_dict['TEST']['NAME'] = name or '%s_benchmark' % old_name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    call_command('ensure_indexes', verbosity=0)
+    return old_name
+
+
+def teardown_database(old_name, keepdb=False):
+    from django.db import connections
+
+    connections['default'].creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def percentile(values, q):
+    """
+    정렬된 values 의 q 분위수 (선형 보간)
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return values[lower]
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample['latency'] for sample in samples)
+    round_trips = sorted(sample['round_trips'] for sample in samples)
+    commands = Counter()
+    for sample in samples:
+        commands.update(sample['commands'])
+
+    count = len(samples)
+    return {
+        'requests': count,
+        'errors': sum(1 for sample in samples if sample['status'] >= 400),
+        'statuses': dict(Counter(str(sample['status']) for sample in samples)),
+        'throughput': round(count / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / count * 1000, 3) if count else None,
+            'p50': _ms(percentile(latencies, 0.50)),
+            'p95': _ms(percentile(latencies, 0.95)),
+            'p99': _ms(percentile(latencies, 0.99)),
+            'max': _ms(latencies[-1] if latencies else None),
+        },
+        'round_trips': {
+            'mean': round(sum(round_trips) / count, 2) if count else None,
+            'p95': percentile(round_trips, 0.95),
+            'max': round_trips[-1] if round_trips else None,
+            'commands': {name: round(total / count, 2) for name, total in sorted(commands.items())},
+        },
+    }
+
+
+def _ms(value):
+    return round(value * 1000, 3) if value is not None else None
+
+
+class Dataset:
+    """
+    seed 로 만든 데이터. 시나리오가 요청 대상을 고를 때 사용한다.
+    """
+
+    def __init__(self, prefix, users, musicmaps, center, spread_m):
+        self.prefix = prefix
+        self.users = users
+        self.musicmaps = musicmaps
+        self.center = center
+        self.spread_m = spread_m
+
+    @classmethod
+    def load(cls, prefix, center=DEFAULT_CENTER, spread_m=5000):
+        from accounts.models import User
+        from musicmaps.models import MusicMaps
+
+        users = list(User.objects.filter(pk__in=tagged_pks(User, prefix)).order_by('pk'))
+        musicmaps = sorted(tagged_pks(MusicMaps, prefix))
+        return cls(prefix, users, musicmaps, center, spread_m)
+
+
+def tagged_pks(model, prefix):
+    return [doc['id'] for doc in model.objects.mongo_find({TAG_FIELD: prefix}, {'_id': False, 'id': True})]
+
+
+def tag(model, pks, prefix):
+    model.objects.mongo_update_many({'id': {'$in': list(pks)}}, {'$set': {TAG_FIELD: prefix}})
+
+
+def random_point(rng, center, spread_m):
+    lng, lat = center
+    distance = spread_m * math.sqrt(rng.random())
+    angle = rng.random() * 2 * math.pi
+    lat += distance * math.cos(angle) / 111320.0
+    lng += distance * math.sin(angle) / (111320.0 * math.cos(math.radians(center[1])))
+    return lng, lat
+
+
+def seed(prefix='bench', users=1000, follow_density=0.02, maps=5000, tracks=200,
+         center=DEFAULT_CENTER, spread_m=5000, random_seed=0, batch_size=1000):
+    """
+    벤치마크 데이터를 만든다. 같은 인자로 다시 만들면 같은 그래프와 위치가 만들어진다.
+    bulk_create 는 post_save 를 보내지 않으므로 geohash, 검색 키, 카운터, 타임라인, 타일 집계는 여기서 직접 채운다.
+    """
+    from django.contrib.auth.hashers import make_password
+
+    from accounts.models import User
+    from musicmaps import catalog, geo, tiles, timeline
+    from musicmaps.db import reserve_ids
+    from musicmaps.models import Music, MusicMaps, TimelineEntry
+
+    rng = random.Random(random_seed)
+    password = make_password(BENCHMARK_PASSWORD)
+
+    # pk 를 미리 예약해서 만든 문서를 정확히 알고 표시를 붙인다.
+    first_user = reserve_ids(User, users) if users else 0
+    new_users = []
+    for index in range(users):
+        user = User(
+            id=first_user + index,
+            email='%s%d@benchmark.local' % (prefix, index),
+            userid='%s%d' % (prefix, index),
+            username='벤치%d' % index,
+            password=password,
+        )
+        user.update_search_keys()
+        new_users.append(user)
+    User.objects.bulk_create(new_users, batch_size=batch_size)
+    pks = [user.pk for user in new_users]
+    tag(User, pks, prefix)
+
+    # 팔로우 그래프: 유저마다 density 비율의 다른 유저를 무작위로 팔로우한다.
+    followers = defaultdict(set)
+    following = defaultdict(set)
+    degree = int(round(follow_density * (len(pks) - 1)))
+    for pk in pks:
+        for target in rng.sample(pks, min(degree + 1, len(pks))):
+            if target != pk and len(following[pk]) < degree:
+                following[pk].add(target)
+                followers[target].add(pk)
+
+    requests = [
+        UpdateOne({'id': pk}, {'$set': {
+            'followers_id': sorted(followers[pk]),
+            'following_id': sorted(following[pk]),
+            'followers_count': len(followers[pk]),
+            'following_count': len(following[pk]),
+        }})
+        for pk in pks
+    ]
+    for start in range(0, len(requests), batch_size):
+        User.objects.mongo_bulk_write(requests[start:start + batch_size], ordered=False)
+
+    track_rows = [
+        {'artists': 'Artist %d' % (index % 40), 'album': 'Album %d' % (index % 80),
+         'name': 'Track %d' % index, 'track_number': index % 12 + 1}
+        for index in range(tracks)
+    ]
+    identities = [catalog.track_identity(row['artists'], row['album'], row['name'], row['track_number']) for row in track_rows]
+    existing = set(Music.objects.filter(identity__in=identities).values_list('pk', flat=True))
+    musics = catalog.upsert_tracks(track_rows) if track_rows else []
+    tag(Music, {music.pk for music in musics} - existing, prefix)  # 이미 있던 곡은 지우지 않는다.
+
+    first_map = reserve_ids(MusicMaps, maps) if maps else 0
+    new_maps = []
+    for index in range(maps):
+        lng, lat = random_point(rng, center, spread_m)
+        musicmap = MusicMaps(
+            id=first_map + index,
+            images=[],
+            content='%s map %d' % (prefix, index),
+            open_range=rng.choice(MusicMaps.OpenRange.values),
+            comments_on=True,
+            author_id=rng.choice(pks),
+            location={'type': 'Point', 'coordinates': [lng, lat]},
+            street_address='%s street %d' % (prefix, index),
+            building_number=str(index),
+            geohash=geo.encode(lng, lat),
+        )
+        musicmap.set_playlist(rng.sample(musics, min(3, len(musics))))
+        new_maps.append(musicmap)
+    MusicMaps.objects.bulk_create(new_maps, batch_size=batch_size)
+    tag(MusicMaps, [musicmap.pk for musicmap in new_maps], prefix)
+
+    authors = {user.pk: user for user in User.objects.filter(pk__in=pks)}
+    for musicmap in MusicMaps.objects.filter(pk__in=[musicmap.pk for musicmap in new_maps]):
+        musicmap.author = authors[musicmap.author_id]
+        timeline.fan_out(musicmap)
+    TimelineEntry.objects.mongo_update_many({'owner_id': {'$in': pks}}, {'$set': {TAG_FIELD: prefix}})
+    tiles.rebuild()
+
+    return Dataset.load(prefix, center, spread_m)
+
+
+def cleanup(prefix='bench'):
+    """
+    seed 가 prefix 표시를 붙인 문서만 지운다. 지운 유저 수를 반환한다.
+    """
+    from accounts.models import User
+    from musicmaps import catalog, tiles
+    from musicmaps.models import Music, MusicMaps, TimelineEntry
+
+    TimelineEntry.objects.mongo_delete_many({TAG_FIELD: prefix})
+    if MusicMaps.objects.mongo_delete_many({TAG_FIELD: prefix}).deleted_count:
+        tiles.rebuild()
+    musics = tagged_pks(Music, prefix)
+    Music.objects.mongo_delete_many({TAG_FIELD: prefix})
+    catalog.invalidate(*musics)
+    return User.objects.mongo_delete_many({TAG_FIELD: prefix}).deleted_count
+
+
+class Scenario:
+    """
+    엔드포인트 하나에 대한 요청 생성기. request(rng, dataset, tokens) 는 (method, path, data, user) 를 반환한다.
+    """
+
+    def __init__(self, name, request, authenticated=True):
+        self.name = name
+        self.request = request
+        self.authenticated = authenticated
+
+
+def _user(rng, dataset):
+    return rng.choice(dataset.users)
+
+
+def _login(rng, dataset, tokens):
+    user = _user(rng, dataset)
+    return 'post', '/accounts/login/', {'email': user.email, 'password': BENCHMARK_PASSWORD}, None
+
+
+def _verify(rng, dataset, tokens):
+    user = _user(rng, dataset)
+    return 'post', '/accounts/verify/', {'token': tokens[user.pk]}, None
+
+
+def _search(rng, dataset, tokens):
+    target = _user(rng, dataset)
+    return 'get', '/accounts/search/?q=%s' % target.userid[:len(dataset.prefix) + 2], None, _user(rng, dataset)
+
+
+def _followers(rng, dataset, tokens):
+    return 'get', '/accounts/%s/followers/' % _user(rng, dataset).userid, None, _user(rng, dataset)
+
+
+def _following(rng, dataset, tokens):
+    return 'get', '/accounts/%s/following/' % _user(rng, dataset).userid, None, _user(rng, dataset)
+
+
+def _profile(rng, dataset, tokens):
+    return 'get', '/accounts/%s/' % _user(rng, dataset).userid, None, _user(rng, dataset)
+
+
+def _nearby(rng, dataset, tokens):
+    lng, lat = random_point(rng, dataset.center, dataset.spread_m)
+    return 'get', '/musicmaps/list/?lng=%f&lat=%f&radius=500' % (lng, lat), None, _user(rng, dataset)
+
+
+def _bbox(rng, dataset, tokens):
+    lng, lat = random_point(rng, dataset.center, dataset.spread_m)
+    bbox = (lng - 0.01, lat - 0.01, lng + 0.01, lat + 0.01)
+    return 'get', '/musicmaps/list/?bbox=%f,%f,%f,%f' % bbox, None, _user(rng, dataset)
+
+
+def _timeline(rng, dataset, tokens):
+    return 'get', '/musicmaps/timeline/', None, _user(rng, dataset)
+
+
+def _tiles(rng, dataset, tokens):
+    from musicmaps.tiles import tile_of
+
+    zoom = rng.randint(8, 14)
+    x, y = tile_of(*random_point(rng, dataset.center, dataset.spread_m), zoom)
+    return 'get', '/musicmaps/tiles/%d/%d/%d/' % (zoom, x, y), None, _user(rng, dataset)
+
+
+def _comments(rng, dataset, tokens):
+    return 'get', '/musicmaps/%d/comments/' % rng.choice(dataset.musicmaps), None, _user(rng, dataset)
+
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in (
+        Scenario('login', _login, authenticated=False),
+        Scenario('verify', _verify, authenticated=False),
+        Scenario('search', _search),
+        Scenario('followers', _followers),
+        Scenario('following', _following),
+        Scenario('profile', _profile),
+        Scenario('nearby', _nearby),
+        Scenario('bbox', _bbox),
+        Scenario('timeline', _timeline),
+        Scenario('tiles', _tiles),
+        Scenario('comments', _comments),
+    )
+}
+
+
+class Runner:
+
+    def __init__(self, dataset, concurrency=8, requests=500, warmup=20, random_seed=0, counter=None):
+        from accounts import tokens
+
+        self.dataset = dataset
+        self.concurrency = concurrency
+        self.requests = requests
+        self.warmup = warmup
+        self.random_seed = random_seed
+        self.counter = counter
+        self.tokens = {user.pk: tokens.mint_token(user) for user in dataset.users}
+        self._local = threading.local()
+
+    def client(self):
+        from django.test import Client
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+        return client
+
+    def call(self, scenario, rng):
+        method, path, data, user = scenario.request(rng, self.dataset, self.tokens)
+        headers = {}
+        if scenario.authenticated and user is not None:
+            headers['HTTP_AUTHORIZATION'] = 'JWT %s' % self.tokens[user.pk]
+
+        if self.counter is not None:
+            self.counter.reset()
+        started = time.perf_counter()
+        if method == 'post':
+            response = self.client().post(path, data=json.dumps(data), content_type='application/json', **headers)
+        else:
+            response = self.client().get(path, **headers)
+        latency = time.perf_counter() - started
+        commands = dict(self.counter.commands()) if self.counter is not None else {}
+
+        return {
+            'status': response.status_code,
+            'latency': latency,
+            'round_trips': sum(commands.values()),
+            'commands': commands,
+        }
+
+    def run(self, scenario):
+        rngs = [random.Random('%s:%s:%d' % (self.random_seed, scenario.name, index)) for index in range(self.requests)]
+
+        warmup = random.Random('%s:%s:warmup' % (self.random_seed, scenario.name))
+        for _ in range(self.warmup):
+            self.call(scenario, warmup)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            samples = list(executor.map(lambda rng: self.call(scenario, rng), rngs))
+        elapsed = time.perf_counter() - started
+
+        result = summarize(samples, elapsed)
+        result['concurrency'] = self.concurrency
+        return result
+
+
+def environment():
+    """
+    결과에 함께 남길 설정. 설정이 다른 결과끼리 비교하지 않도록 한다.
+    """
+    return {
+        'read_repository_endpoints': list(getattr(settings, 'READ_REPOSITORY_ENDPOINTS', ())),
+        'musicmaps_geo': getattr(settings, 'MUSICMAPS_GEO', {}),
+        'cache_backend': settings.CACHES['default']['BACKEND'],
+    }
+
+
+def compare(result, baseline, tolerance):
+    """
+    baseline 보다 p95 지연시간이나 평균 왕복 횟수가 tolerance 비율 이상 나빠진 시나리오 목록
+    """
+    regressions = []
+    for name, current in result['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        for metric, now, before in (
+            ('latency_ms.p95', current['latency_ms']['p95'], previous['latency_ms']['p95']),
+            ('round_trips.mean', current['round_trips']['mean'], previous['round_trips']['mean']),
+        ):
+            if now is None or not before:
+                continue
+            if now > before * (1 + tolerance):
+                regressions.append({'scenario': name, 'metric': metric, 'baseline': before, 'current': now})
+    return regressions
+
+
+# 이름 -> (renderer, parser). 첫 항목이 비교 기준이다.
+RENDERERS = {
+    'drf-json': ('rest_framework.renderers.JSONRenderer', 'rest_framework.parsers.JSONParser'),
+    'orjson': ('backend.renderers.ORJSONRenderer', 'backend.renderers.ORJSONParser'),
+    'msgpack': ('backend.renderers.MessagePackRenderer', 'backend.renderers.MessagePackParser'),
+}
+
+
+def renderer_payloads(dataset, users=200, musicmaps=500):
+    """
+    유저 목록(UserSerializerWithToken)과 지도 마커 목록(MusicMapSerializer) 응답 data
+    """
+    from accounts.serializers import UserSerializerWithToken
+    from musicmaps.models import MusicMaps
+    from musicmaps.serializers import MusicMapSerializer
+
+    maps = MusicMaps.objects.filter(pk__in=dataset.musicmaps[:musicmaps]).order_by('pk')
+    return {
+        'users': UserSerializerWithToken(dataset.users[:users], many=True).data,
+        'musicmaps': MusicMapSerializer(maps, many=True).data,
+    }
+
+
+def _timing(samples):
+    samples = sorted(samples)
+    return {
+        'mean': _ms(sum(samples) / len(samples)) if samples else None,
+        'p50': _ms(percentile(samples, 0.50)),
+        'p95': _ms(percentile(samples, 0.95)),
+    }
+
+
+def benchmark_renderers(payloads, names=None, repeats=50):
+    """
+    payload 마다 renderer 별 render/parse 시간(ms), 응답 크기, 기준(첫 renderer) 대비 render p50 배속
+    """
+    names = names or list(RENDERERS)
+    results = {}
+    for payload_name, data in payloads.items():
+        results[payload_name] = {}
+        for name in names:
+            renderer_path, parser_path = RENDERERS[name]
+            renderer, parser = import_string(renderer_path)(), import_string(parser_path)()
+
+            render_samples = []
+            parse_samples = []
+            body = b''
+            for _ in range(repeats):
+                started = time.perf_counter()
+                body = renderer.render(data, renderer.media_type, {})
+                render_samples.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                parser.parse(io.BytesIO(body), parser.media_type, {})
+                parse_samples.append(time.perf_counter() - started)
+
+            results[payload_name][name] = {
+                'bytes': len(body),
+                'render_ms': _timing(render_samples),
+                'parse_ms': _timing(parse_samples),
+            }
+
+        baseline = results[payload_name][names[0]]['render_ms']['p50']
+        for result in results[payload_name].values():
+            p50 = result['render_ms']['p50']
+            result['render_speedup'] = round(baseline / p50, 2) if baseline and p50 else None
+    return results
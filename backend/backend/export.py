@@ -0,0 +1,198 @@
+"""
+개인 데이터 내보내기 (NDJSON)
+
+유저 문서, 팔로워/팔로잉 목록, 작성한 MusicMaps (플레이리스트, 이미지 URL) 와 그 댓글을
+한 줄에 레코드 하나씩 NDJSON 으로 내보낸다. 모든 구간을 batch_size 단위의 MongoDB cursor 로
+읽으며 generator 로 흘려보내므로, 계정 크기와 관계없이 메모리에는 한 batch 만 올라간다.
+
+각 레코드의 "cursor" 를 넘기면 그 레코드 다음부터 이어서 내보낸다.
+    {"type": "user" | "follower" | "following" | "musicmap" | "comment", "cursor": string, "data": {...}}
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from accounts.models import User
+from musicmaps import catalog
+from musicmaps.models import Comment, MusicMaps, playlist_pks
+from musicmaps.serializers import image_urls
+
+from .images import derivative_urls
+
+DEFAULT_EXPORT_SETTINGS = {
+    'BATCH_SIZE': 500,  # 한번에 읽는 문서 수. 메모리 사용량은 이 값에 비례한다.
+}
+
+SECTIONS = ('user', 'followers', 'following', 'musicmaps')
+
+USER_FIELDS = ('id', 'userid', 'username', 'email', 'date_joined', 'is_active', 'followers_count', 'following_count')
+
+RELATED_FIELDS = {'_id': False, 'id': True, 'userid': True, 'username': True}
+
+MUSICMAP_FIELDS = {
+    '_id': False, 'id': True, 'content': True, 'images': True, 'location': True, 'street_address': True,
+    'building_number': True, 'open_range': True, 'comments_on': True, 'date_created': True,
+    'date_updated': True, 'memorize_count': True, 'comments_count': True, 'playlist_id': True, 'playlist_order': True,
+}
+
+COMMENT_FIELDS = {'_id': False, 'id': True, 'author_id': True, 'content': True, 'path': True, 'depth': True, 'date_created': True}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def export_settings():
+    conf = dict(DEFAULT_EXPORT_SETTINGS)
+    conf.update(getattr(settings, 'PERSONAL_EXPORT', {}))
+    return conf
+
+
+def encode_cursor(section, key=None, comment=None):
+    position = json.dumps([SECTIONS.index(section), key, comment], separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    (구간 번호, 마지막 id, 마지막 댓글 id). cursor 가 없으면 처음부터.
+    """
+    if not cursor:
+        return -1, None, None
+    try:
+        section, key, comment = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(section, int) or not 0 <= section < len(SECTIONS):
+        raise InvalidCursor(cursor)
+    return section, key, comment
+
+
+def _record(record_type, cursor, data):
+    return {'type': record_type, 'cursor': cursor, 'data': data}
+
+
+def _user(user, request):
+    data = {field: getattr(user, field) for field in USER_FIELDS}
+    data['profile_image'] = derivative_urls(user.profile_image.name, request=request) if user.profile_image else None
+    return data
+
+
+def _related(user, field, after, batch_size):
+    """
+    user 의 followers_id/following_id 배열을 서버에서 펼쳐서 id 순으로 읽는다. (배열을 앱으로 가져오지 않는다)
+    """
+    pipeline = [
+        {'$match': {'id': user.pk}},
+        {'$project': {'_id': False, 'related': '$%s' % field}},
+        {'$unwind': '$related'},
+    ]
+    if after is not None:
+        pipeline.append({'$match': {'related': {'$gt': after}}})
+    pipeline += [
+        {'$sort': {'related': 1}},
+        {'$lookup': {'from': User._meta.db_table, 'localField': 'related', 'foreignField': 'id', 'as': 'user'}},
+        {'$unwind': '$user'},
+        {'$replaceRoot': {'newRoot': '$user'}},
+        {'$project': RELATED_FIELDS},
+    ]
+    return User.objects.mongo_aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+
+
+def _batches(cursor, size):
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _musicmap(doc, musics, request):
+    data = {key: value for key, value in doc.items() if key not in ('playlist_id', 'playlist_order')}
+    data['images'] = image_urls(doc.get('images'), request)
+    data['playlist'] = []
+    for pk in playlist_pks(doc):
+        music = musics.get(pk)
+        if music is not None:
+            data['playlist'].append({
+                'id': music.pk,
+                'artists': music.artists,
+                'album': music.album,
+                'name': music.name,
+                'track_number': music.track_number,
+                'album_cover': derivative_urls(music.album_cover.name, request=request) if music.album_cover else None,
+            })
+    return data
+
+
+def _comments(musicmap_pk, after, batch_size):
+    query = {'musicmap_id': musicmap_pk}
+    if after is not None:
+        query['id'] = {'$gt': after}
+    cursor = Comment.objects.mongo_find(query, COMMENT_FIELDS).sort('id', 1).batch_size(batch_size)
+
+    for batch in _batches(cursor, batch_size):
+        authors = {
+            doc['id']: doc['userid'] for doc in User.objects.mongo_find(
+                {'id': {'$in': list({comment['author_id'] for comment in batch})}}, {'_id': False, 'id': True, 'userid': True}
+            )
+        }
+        for comment in batch:
+            segments = (comment.get('path') or '').split('/')
+            comment['parent'] = int(segments[-2]) if len(segments) > 1 else None
+            comment['author'] = authors.get(comment.pop('author_id'))
+            yield comment
+
+
+def records(user, cursor=None, batch_size=None, request=None):
+    """
+    user 의 데이터를 레코드(dict) 로 하나씩 반환한다. cursor 가 있으면 그 레코드 다음부터 시작한다.
+    이미지 URL 은 request 의 host (없으면 IMAGE_DERIVATIVES['BASE_URL']) 로 절대 URL 을 만든다.
+    """
+    batch_size = batch_size or export_settings()['BATCH_SIZE']
+    section, key, comment_key = decode_cursor(cursor)
+
+    if section < SECTIONS.index('user'):
+        yield _record('user', encode_cursor('user'), _user(user, request))
+
+    for name, field, record_type in (('followers', 'followers_id', 'follower'), ('following', 'following_id', 'following')):
+        index = SECTIONS.index(name)
+        if section > index:
+            continue
+        after = key if section == index else None
+        for doc in _related(user, field, after, batch_size):
+            yield _record(record_type, encode_cursor(name, doc['id']), doc)
+
+    index = SECTIONS.index('musicmaps')
+    resume_map = key if section == index else None
+
+    if resume_map is not None and comment_key is not None:
+        # 댓글을 내보내던 중이었으면 그 MusicMaps 의 남은 댓글부터 이어간다.
+        for comment in _comments(resume_map, comment_key, batch_size):
+            yield _record('comment', encode_cursor('musicmaps', resume_map, comment['id']), dict(comment, musicmap=resume_map))
+
+    query = {'author_id': user.pk}
+    if resume_map is not None:
+        query['id'] = {'$gt': resume_map}
+    cursor = MusicMaps.objects.mongo_find(query, MUSICMAP_FIELDS).sort('id', 1).batch_size(batch_size)
+
+    for batch in _batches(cursor, batch_size):
+        musics = catalog.resolve({pk for doc in batch for pk in playlist_pks(doc)})
+        for doc in batch:
+            yield _record('musicmap', encode_cursor('musicmaps', doc['id'], 0), _musicmap(doc, musics, request))
+            for comment in _comments(doc['id'], None, batch_size):
+                yield _record('comment', encode_cursor('musicmaps', doc['id'], comment['id']), dict(comment, musicmap=doc['id']))
+
+
+def lines(user, cursor=None, batch_size=None, request=None):
+    """
+    records 를 NDJSON 한 줄씩 반환한다. StreamingHttpResponse 와 management command 가 함께 사용한다.
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for record in records(user, cursor, batch_size, request):
+        yield encoder.encode(record) + '\n'
@@ -0,0 +1,234 @@
+"""
+이미지 업로드 파이프라인
+
+업로드된 이미지는 내용의 sha256 으로 저장해서(content-addressed) 같은 이미지를
+여러번 올려도 한번만 저장한다. 저장할 때 고정 크기 파생 이미지(thumbnail, card, full)를
+WebP, JPEG 로 만들어 두고, serializer 는 원본 대신 실제로 저장된 파생 이미지의 절대 URL 을 내려준다.
+
+리사이즈는 CPU 작업이라 요청 스레드의 GIL 을 잡지 않도록 process pool 에서 수행한다.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from rest_framework import serializers
+
+DEFAULT_DERIVATIVE_SETTINGS = {
+    'SIZES': {            # 긴 변 기준 최대 픽셀. 원본보다 크게 늘리지는 않는다.
+        'thumbnail': 160,
+        'card': 640,
+        'full': 1600,
+    },
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+    'TIMEOUT': 30,
+    'BASE_URL': None,     # request 없이 URL 을 만들 때(내보내기 등) 붙일 주소. ex) 'https://cdn.example.com'
+}
+
+ORIGINAL_PATTERN = re.compile(r'^originals/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})\.\w+$')
+
+_PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def derivative_settings():
+    conf = dict(DEFAULT_DERIVATIVE_SETTINGS)
+    conf.update(getattr(settings, 'IMAGE_DERIVATIVES', {}))
+    return conf
+
+
+def original_name(digest, ext):
+    return 'originals/%s/%s.%s' % (digest[:2], digest, ext)
+
+
+def derivative_name(digest, size, fmt):
+    return 'derivatives/%s/%s/%s.%s' % (digest[:2], digest, size, 'jpg' if fmt == 'jpeg' else fmt)
+
+
+def render_derivatives(data, sizes, formats, quality):
+    """
+    process pool 에서 실행된다. {(size, fmt): bytes} 를 반환한다.
+    """
+    from PIL import Image, ImageOps
+
+    source = Image.open(io.BytesIO(data))
+    source = ImageOps.exif_transpose(source)
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+    rendered = {}
+    for size, max_pixels in sizes.items():
+        image = source.copy()
+        image.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+        for fmt in formats:
+            target = image.convert('RGB') if fmt == 'jpeg' else image
+            buffer = io.BytesIO()
+            target.save(buffer, _PIL_FORMATS[fmt], quality=quality, optimize=True)
+            rendered[(size, fmt)] = buffer.getvalue()
+    return rendered
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=derivative_settings()['WORKERS'])
+    return _pool
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    파일 이름 대신 내용의 해시로 저장하는 storage. 이미 있는 내용이면 다시 쓰지 않는다.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # 같은 이름은 같은 내용이므로 덮어쓰지 않고 그대로 사용한다.
+        return name
+
+    def _save(self, name, content):
+        content.seek(0)
+        data = content.read()
+        digest = hashlib.sha256(data).hexdigest()
+        ext = os.path.splitext(name)[1].lstrip('.').lower() or 'bin'
+        name = original_name(digest, ext)
+
+        if not self.exists(name):
+            name = super()._save(name, ContentFile(data))
+        # 원본이 이미 있어도, 이전 업로드에서 파생 이미지를 만들다 실패했으면 빠진 것만 다시 만든다.
+        if ext in ('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff'):
+            self.save_derivatives(digest, data)
+        return name
+
+    def save_derivatives(self, digest, data):
+        conf = derivative_settings()
+        missing = missing_derivatives(digest, self)
+        if not missing:
+            return
+        sizes = {size: conf['SIZES'][size] for size, _ in missing}
+        future = get_pool().submit(render_derivatives, data, sizes, conf['FORMATS'], conf['QUALITY'])
+        for (size, fmt), rendered in future.result(timeout=conf['TIMEOUT']).items():
+            if (size, fmt) in missing:
+                super()._save(derivative_name(digest, size, fmt), ContentFile(rendered))
+
+
+class _CompleteDigests:
+    """
+    파생 이미지가 모두 저장된 digest 의 LRU 집합. content-addressed 라서 한번 모두 생긴 뒤에는 바뀌지 않으므로,
+    이 digest 들은 URL 을 만들 때 storage 를 다시 확인하지 않는다.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, digest):
+        with self._lock:
+            if digest not in self._digests:
+                return False
+            self._digests.move_to_end(digest)
+            return True
+
+    def add(self, digest):
+        with self._lock:
+            self._digests[digest] = True
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+
+    def discard(self, digest):
+        with self._lock:
+            self._digests.pop(digest, None)
+
+
+_complete = _CompleteDigests()
+
+
+def missing_derivatives(digest, storage=None):
+    """
+    아직 저장되지 않은 (size, fmt) 집합
+    """
+    storage = storage or default_storage
+    conf = derivative_settings()
+    if digest in _complete:
+        return set()
+    missing = {
+        (size, fmt) for size in conf['SIZES'] for fmt in conf['FORMATS']
+        if not storage.exists(derivative_name(digest, size, fmt))
+    }
+    if not missing:
+        _complete.add(digest)
+    return missing
+
+
+def absolute_url(url, request=None):
+    """
+    request 가 있으면 그 host 로, 없으면 IMAGE_DERIVATIVES['BASE_URL'] 로 절대 URL 을 만든다.
+    """
+    if request is not None:
+        return request.build_absolute_uri(url)
+    base_url = derivative_settings()['BASE_URL']
+    return urljoin(base_url, url) if base_url else url
+
+
+def derivative_urls(name, storage=None, request=None):
+    """
+    저장된 원본 이름으로 원본과 파생 이미지의 절대 URL 들을 만든다.
+    실제로 저장된 파생 이미지만 포함하고, content-addressed 로 저장되지 않은 예전 이미지는 원본 URL 만 반환한다.
+    """
+    if not name:
+        return None
+    storage = storage or default_storage
+
+    urls = {'original': absolute_url(storage.url(name), request)}
+    match = ORIGINAL_PATTERN.match(name)
+    if match:
+        digest = match.group('digest')
+        missing = missing_derivatives(digest, storage)
+        for size in derivative_settings()['SIZES']:
+            formats = {
+                fmt: absolute_url(storage.url(derivative_name(digest, size, fmt)), request)
+                for fmt in derivative_settings()['FORMATS'] if (size, fmt) not in missing
+            }
+            if formats:
+                urls[size] = formats
+    return urls
+
+
+class ImageReferenceField(serializers.CharField):
+    """
+    먼저 업로드한 이미지의 저장 이름("originals/..."). JSON/MessagePack 본문에서 이미지를 참조할 때 사용한다.
+    """
+    default_error_messages = {
+        'unknown': 'Unknown image. Upload the image first.',
+    }
+
+    def to_internal_value(self, data):
+        name = super().to_internal_value(data)
+        if not ORIGINAL_PATTERN.match(name) or not default_storage.exists(name):
+            self.fail('unknown')
+        return name
+
+
+class DerivativeImageField(serializers.ImageField):
+    """
+    쓰기는 ImageField 와 같고, 읽을 때는 파생 이미지 URL 들을 반환한다.
+    """
+
+    def to_representation(self, value):
+        name = getattr(value, 'name', value)
+        if not name:
+            return None
+        return derivative_urls(name, getattr(value, 'storage', None), self.context.get('request', None))
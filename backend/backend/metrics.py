@@ -0,0 +1,336 @@
+"""
+요청 성능 계측
+
+요청마다 view 전체 시간과 구간(phase)별 시간을 기록한다.
+    db        : Django DB 커서 실행 (djongo 의 SQL 변환 + MongoDB 호출)
+    mongo     : MongoDB 명령 왕복 (pymongo CommandListener, mongo_* 직접 호출 포함)
+    serialize : DRF serializer.data (view 에서 serialized() 로 감싼 구간)
+    render    : 응답 렌더링 (JSONRenderer 등)
+    jwt       : JWT 서명 (accounts.tokens.mint_token)
+구간은 서로 겹칠 수 있다. (serialize 안에서 실행된 db 등)
+
+집계는 프로세스별 histogram 으로 두고 /metrics 에서 Prometheus text 형식으로 내보낸다.
+/metrics 는 settings.METRICS['TOKEN'] 을 Authorization: Bearer 헤더로 보낸 요청에만 응답한다.
+(프록시 뒤에서는 모든 요청의 REMOTE_ADDR 이 프록시 주소라서 주소로는 막을 수 없다)
+settings.METRICS['SERVER_TIMING'] 을 켜면 응답에 Server-Timing 헤더로 요청별 구간 시간을 붙인다.
+"""
+import contextvars
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from pymongo import monitoring
+
+DEFAULT_METRICS_SETTINGS = {
+    'ENABLED': True,
+    'SERVER_TIMING': False,
+    'TOKEN': None,  # /metrics 를 읽을 때 보내는 Bearer token. None 이면 /metrics 를 열지 않는다. (404)
+    'LATENCY_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'COUNT_BUCKETS': (0, 1, 2, 3, 5, 10, 20, 50, 100),
+}
+
+PHASES = ('db', 'mongo', 'serialize', 'render', 'jwt')
+
+
+def metrics_settings():
+    conf = dict(DEFAULT_METRICS_SETTINGS)
+    conf.update(getattr(settings, 'METRICS', {}))
+    return conf
+
+
+class RequestMetrics:
+    """
+    요청 하나의 구간별 시간(초)과 횟수
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.counts = {}
+        self._depth = {}
+
+    def add(self, phase, seconds, count=1):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + count
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+# 요청별 계측. 스레드(WSGI, sync view)와 asyncio task(ASGI 라우터)마다 따로 보이도록 contextvar 에 둔다.
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def measure(view, method):
+    """
+    Django middleware 를 거치지 않는 요청(ASGI 라우터)을 계측하고 끝나면 기록한다.
+    yield 한 dict 의 'status' 를 status label 로 쓰고(None 이면 기록하지 않는다), 예외로 끝나면 500 으로 기록한다.
+    """
+    metrics = RequestMetrics()
+    result = {'status': 500}
+    if not metrics_settings()['ENABLED']:
+        yield result
+        return
+
+    token = _current.set(metrics)
+    try:
+        yield result
+    finally:
+        _current.reset(token)
+        if result['status'] is not None:
+            record(view, method, result['status'], metrics)
+
+
+@contextmanager
+def timed(phase):
+    """
+    현재 요청의 phase 구간 시간을 잰다. 같은 phase 가 중첩되면 가장 바깥 구간만 센다.
+    (중첩 serializer 의 .data 등)
+    """
+    metrics = current()
+    if metrics is None or metrics._depth.get(phase):
+        yield
+        return
+
+    metrics._depth[phase] = 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._depth[phase] = 0
+        metrics.add(phase, time.perf_counter() - started)
+
+
+def serialized(serializer):
+    """
+    serializer.data 를 serialize 구간으로 잰다. view 가 응답 데이터를 만들 때 직접 호출한다.
+    """
+    with timed('serialize'):
+        return serializer.data
+
+
+async def aserialized(serializer):
+    """
+    serialized 의 비동기 버전. 이미지 URL 을 만들 때 storage 를 확인하는 등 동기 I/O 를 하는 serializer 가 있으므로
+    이벤트 루프를 막지 않도록 스레드에서 실행한다.
+    """
+    return await sync_to_async(serialized)(serializer)
+
+
+def timed_function(phase):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    (metric 이름, label) 별 histogram 모음
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._help = {}
+
+    def observe(self, name, labels, value, buckets, help_text=''):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                self._help.setdefault(name, help_text)
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def exposition(self):
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self._histograms})
+            for name in names:
+                lines.append('# HELP %s %s' % (name, self._help.get(name, '')))
+                lines.append('# TYPE %s histogram' % name)
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{%s} %d' % (name, _labels(labels + (('le', _number(bound)),)), cumulative))
+                    lines.append('%s_sum{%s} %s' % (name, _labels(labels), repr(histogram.sum)))
+                    lines.append('%s_count{%s} %d' % (name, _labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return value if isinstance(value, str) else repr(float(value))
+
+
+def _labels(labels):
+    return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+
+
+registry = Registry()
+
+
+def record(view, method, status, metrics):
+    conf = metrics_settings()
+    labels = {'view': view, 'method': method}
+    registry.observe(
+        'http_request_duration_seconds', dict(labels, status=str(status)), metrics.elapsed(),
+        conf['LATENCY_BUCKETS'], 'Request latency by view',
+    )
+    for phase in PHASES:
+        registry.observe(
+            'http_request_phase_seconds', dict(labels, phase=phase), metrics.durations.get(phase, 0.0),
+            conf['LATENCY_BUCKETS'], 'Time spent in each phase of a request',
+        )
+    registry.observe(
+        'http_request_db_queries', labels, metrics.counts.get('db', 0),
+        conf['COUNT_BUCKETS'], 'Django DB queries per request',
+    )
+    registry.observe(
+        'http_request_mongo_commands', labels, metrics.counts.get('mongo', 0),
+        conf['COUNT_BUCKETS'], 'MongoDB commands per request',
+    )
+
+
+def server_timing(metrics):
+    entries = []
+    for phase in PHASES:
+        if phase in metrics.durations:
+            entry = '%s;dur=%.3f' % (phase, metrics.durations[phase] * 1000)
+            if phase in ('db', 'mongo'):
+                entry += ';desc="%d"' % metrics.counts[phase]
+            entries.append(entry)
+    entries.append('total;dur=%.3f' % (metrics.elapsed() * 1000))
+    return ', '.join(entries)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    MongoDB 명령 왕복을 명령을 보낸 스레드의 요청에 더한다.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._add(event)
+
+    def failed(self, event):
+        self._add(event)
+
+    def _add(self, event):
+        metrics = current()
+        if metrics is not None:
+            metrics.add('mongo', event.duration_micros / 1000000.0)
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install():
+    """
+    MongoCommandListener 를 등록한다.
+    pymongo 는 MongoClient 생성 시점에 등록된 listener 만 사용하므로 첫 DB 연결 전에 호출되어야 한다.
+    (MetricsMiddleware 가 생성될 때 호출된다)
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _installed = True
+
+    monitoring.register(MongoCommandListener())
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.conf = metrics_settings()
+        if self.conf['ENABLED']:
+            install()
+
+    def __call__(self, request):
+        if not self.conf['ENABLED']:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        # 예외가 middleware 밖으로 나가면 응답이 없으므로 500 으로 기록한다.
+        status_code = 500
+        try:
+            with connections['default'].execute_wrapper(_db_wrapper):
+                response = self.get_response(request)
+
+            status_code = response.status_code
+            if self.conf['SERVER_TIMING']:
+                response['Server-Timing'] = server_timing(metrics)
+            return response
+        finally:
+            _current.reset(token)
+            record(view_name(request), request.method, status_code, metrics)
+
+    def process_template_response(self, request, response):
+        # DRF Response 는 view 가 끝난 뒤 렌더링되므로 여기서 직접 렌더링해서 시간을 잰다.
+        with timed('render'):
+            response.render()
+        return response
+
+
+def metrics_view(request):
+    expected = metrics_settings()['TOKEN']
+    if not expected:
+        raise Http404
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), expected.encode()):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
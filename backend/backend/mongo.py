@@ -0,0 +1,48 @@
+"""
+비동기 MongoDB 연결 (motor)
+
+ASGI 로 동작하는 비동기 조회(backend/asgi_routes.py)에서 사용한다.
+DATABASES 설정의 접속 정보를 그대로 쓰고, 이벤트 루프마다 connection pool 을 가진
+client 하나를 만들어 재사용한다.
+"""
+import asyncio
+
+from django.conf import settings
+
+DEFAULT_ASYNC_MONGO_SETTINGS = {
+    'MAX_POOL_SIZE': 100,
+    'MIN_POOL_SIZE': 0,
+}
+
+_clients = {}
+
+
+def async_mongo_settings():
+    conf = dict(DEFAULT_ASYNC_MONGO_SETTINGS)
+    conf.update(getattr(settings, 'ASYNC_MONGO', {}))
+    return conf
+
+
+def get_database(alias='default'):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    db_settings = settings.DATABASES[alias]
+    loop = asyncio.get_event_loop()
+    key = (alias, id(loop))
+
+    client = _clients.get(key)
+    if client is None:
+        conf = async_mongo_settings()
+        client = AsyncIOMotorClient(
+            io_loop=loop,
+            maxPoolSize=conf['MAX_POOL_SIZE'],
+            minPoolSize=conf['MIN_POOL_SIZE'],
+            **db_settings.get('CLIENT', {})
+        )
+        _clients[key] = client
+
+    return client[db_settings['NAME']]
+
+
+def collection(model, alias='default'):
+    return get_database(alias)[model._meta.db_table]
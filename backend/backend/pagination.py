@@ -0,0 +1,164 @@
+"""
+Keyset(cursor) pagination
+
+OFFSET 방식은 뒤 페이지로 갈수록 건너뛸 문서를 모두 읽어야 하므로,
+마지막으로 받은 항목의 (정렬 필드 값, pk) 를 cursor 로 넘겨서
+다음 페이지를 인덱스 범위 조회 한번으로 가져온다.
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.encoding import force_str
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    ordering = '-id'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+        self.descending = self.ordering.startswith('-')
+        self.field_name = self.ordering.lstrip('-')
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def _is_pk(self, queryset):
+        return self.field_name in ('pk', queryset.model._meta.pk.name)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            return position['v'], position['pk']
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, value, pk):
+        position = json.dumps({'v': value, 'pk': pk}, separators=(',', ':'))
+        return force_str(base64.urlsafe_b64encode(position.encode('utf-8')))
+
+    def _position_value(self, obj):
+        value = obj[self.field_name] if isinstance(obj, dict) else getattr(obj, self.field_name)
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    def _position(self, obj):
+        pk = obj['id'] if isinstance(obj, dict) else obj.pk
+        return self._position_value(obj), pk
+
+    def _queryset_position(self, queryset, cursor, is_pk):
+        """
+        cursor 의 (정렬 필드 값, pk) 를 조회 조건에 쓸 수 있는 값으로 바꾼다. 클라이언트가 보낸 값이므로 바꿀 수 없으면 404.
+        """
+        value, pk = cursor
+        try:
+            pk = int(pk)
+            if not is_pk:
+                value = queryset.model._meta.get_field(self.field_name).to_python(value)
+                if value is None:
+                    raise ValueError(value)
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        lookup = 'lt' if self.descending else 'gt'
+        is_pk = self._is_pk(queryset)
+        cursor = self.decode_cursor(request)
+
+        if cursor is not None:
+            value, pk = self._queryset_position(queryset, cursor, is_pk)
+            if is_pk:
+                queryset = queryset.filter(**{'pk__%s' % lookup: pk})
+            else:
+                queryset = queryset.filter(
+                    Q(**{'%s__%s' % (self.field_name, lookup): value}) |
+                    Q(**{self.field_name: value, 'pk__%s' % lookup: pk})
+                )
+
+        pk_ordering = '-pk' if self.descending else 'pk'
+        ordering = (pk_ordering,) if is_pk else (self.ordering, pk_ordering)
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_position = None
+        if self.has_next:
+            self.next_position = self._position(results[-1])
+
+        return results
+
+    def paginate_documents(self, fetch, request, view=None):
+        """
+        queryset 대신 fetch(position, limit) 로 문서(dict)를 읽는 경우 (repository 조회용)
+        position 은 cursor 의 (정렬 필드 값, pk) 또는 첫 페이지면 None 이다.
+        fetch 가 None 을 반환하면(대상 없음) None 을 반환한다.
+        """
+        position = self._start_documents(request)
+        return self._finish_documents(fetch(position, self.page_size + 1))
+
+    async def apaginate_documents(self, fetch, request, view=None):
+        """
+        paginate_documents 의 비동기 버전. fetch 는 coroutine 함수이다.
+        """
+        position = self._start_documents(request)
+        return self._finish_documents(await fetch(position, self.page_size + 1))
+
+    def _start_documents(self, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        return self.decode_cursor(request)
+
+    def _finish_documents(self, results):
+        if results is None:
+            return None
+        results = list(results)
+
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_position = self._position(results[-1]) if self.has_next else None
+
+        return results
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(*self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,96 @@
+"""
+빠른 JSON / MessagePack renderer, parser
+
+기본 JSONRenderer 는 json 모듈의 Python encoder 로 응답을 만들어서, 큰 팔로워 목록이나 지도 마커 목록에서는
+렌더링이 요청 CPU 의 대부분을 차지한다. orjson 으로 같은 JSON 을 만들고,
+Accept: application/msgpack 으로 요청하면 MessagePack 으로 보낸다. (모바일 클라이언트의 파싱 비용 절감)
+
+orjson 은 datetime, UUID 를 직접 직렬화하고, ObjectId 등 나머지 타입은 encode_default 로 변환한다.
+"""
+import datetime
+
+import msgpack
+import orjson
+from bson import ObjectId
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+_encoder = encoders.JSONEncoder()
+
+
+def encode_default(obj):
+    """
+    orjson/msgpack 이 직접 직렬화하지 못하는 값. 그 외는 DRF JSONEncoder 와 같게 변환한다. (Decimal, lazy 문자열 등)
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    return _encoder.default(obj)
+
+
+def _msgpack_default(obj):
+    # msgpack 의 timestamp 확장 타입은 클라이언트마다 지원이 달라서 JSON 과 같은 ISO 8601 문자열로 보낸다.
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return _encoder.default(obj)
+    return encode_default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    options = orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        options = self.options
+        renderer_context = renderer_context or {}
+        # orjson 은 들여쓰기 2칸만 지원한다. (browsable API, "; indent=" 요청)
+        if renderer_context.get('indent') or 'indent=' in (accepted_media_type or ''):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=encode_default, option=options)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_msgpack_default, use_bin_type=True)
+
+
+class ORJSONParser(BaseParser):
+    media_type = 'application/json'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read() if stream is not None else b'')
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % exc)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read() if stream is not None else b'', raw=False)
+        except (ValueError, TypeError) as exc:  # ExtraData, FormatError, StackError 는 ValueError
+            raise ParseError('MessagePack parse error - %s' % exc)
+
+
+def renderer_for(accept):
+    """
+    Accept 헤더에 맞는 renderer. (DRF content negotiation 을 거치지 않는 ASGI 라우터용)
+    """
+    if MessagePackRenderer.media_type in (accept or ''):
+        return MessagePackRenderer()
+    return ORJSONRenderer()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 import datetime
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -67,6 +68,7 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'backend.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +78,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# 요청 계측 (backend/metrics.py). /metrics 에서 Prometheus 형식으로 읽는다.
+METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': DEBUG,  # 응답에 Server-Timing 헤더로 구간별 시간을 붙인다.
+    'TOKEN': os.environ.get('METRICS_TOKEN'),  # Prometheus 가 Authorization: Bearer 로 보내는 값
+}
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -112,6 +121,19 @@ DATABASES = {
 }
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # 여러 worker 프로세스가 함께 보는 캐시 (팔로우 집합, 유저). 여러 서버로 나누어 실행할 때는
+    # memcached/redis 등 서버간에 공유되는 backend 로 바꾼다.
+    'accounts': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'recordmusic-accounts-cache'),
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -150,19 +172,53 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# 업로드 이미지는 내용 해시로 저장(중복 제거)하고 파생 이미지를 함께 만든다. (backend/images.py)
+DEFAULT_FILE_STORAGE = 'backend.images.ContentAddressedStorage'
+
+IMAGE_DERIVATIVES = {
+    'SIZES': {
+        'thumbnail': 160,
+        'card': 640,
+        'full': 1600,
+    },
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+    'TIMEOUT': 30,
+    'BASE_URL': None,  # request 없이 이미지 URL 을 만들 때(내보내기 command 등) 앞에 붙일 주소
+}
+
 REST_USE_JWT = True
 
 REST_FRAMEWORK = {
 
+    'PAGE_SIZE': 20,
+
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'accounts.authentication.CachedJSONWebTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ],
+
+    # orjson / MessagePack (Accept: application/msgpack) (backend/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.renderers.ORJSONRenderer',
+        'backend.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'backend.renderers.ORJSONParser',
+        'backend.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 AUTH_USER_MODEL = 'accounts.User'
@@ -179,3 +235,112 @@ JWT_AUTH = {
     'JWT_REFRESH_EXPIRATION_DELTA': datetime.timedelta(days=7),
 }
 
+# 발급한 JWT 를 재사용하는 시간(초). None 이면 JWT_EXPIRATION_DELTA 의 절반, 0 이면 캐시하지 않는다.
+JWT_TOKEN_CACHE_TIMEOUT = None
+
+# 공개 범위 판정에 쓰는 팔로워/팔로잉 집합 캐시 시간(초). 팔로우/언팔로우 시 무효화된다.
+FOLLOW_SETS_CACHE_TIMEOUT = 300
+# 공유 캐시(ACCOUNTS_USER_CACHE['SHARED_BACKEND'])가 없을 때의 캐시 시간(초).
+# 다른 worker 의 무효화가 전달되지 않으므로, 팔로우 변경이 이 시간만큼 늦게 반영될 수 있다.
+FOLLOW_SETS_LOCAL_CACHE_TIMEOUT = 5
+
+# 프로필/팔로워/팔로잉 응답 캐시 시간(초). 유저 version 이 바뀌면 새 key 를 쓰므로,
+# 목록에 포함된 다른 유저의 프로필 변경만 이 시간만큼 늦게 반영된다.
+ACCOUNTS_RESPONSE_CACHE_TIMEOUT = 60
+# 유저 version (ETag) 을 공유 캐시(ACCOUNTS_USER_CACHE['SHARED_BACKEND'])에 두는 시간(초)
+ACCOUNTS_VERSION_CACHE_TIMEOUT = 60 * 60 * 24
+
+# 개인 데이터 내보내기 (backend/export.py)
+PERSONAL_EXPORT = {
+    'BATCH_SIZE': 500,
+}
+
+# djongo 대신 pymongo repository 로 읽을 엔드포인트 (accounts/repository.py, musicmaps/repository.py)
+# 'profile', 'followers', 'following', 'search', 'nearby'
+READ_REPOSITORY_ENDPOINTS = []
+
+# ASGI(uvicorn)로 실행할 때 motor 로 비동기 처리할 GET 엔드포인트 (backend/asgi_routes.py)
+# 'profile', 'followers', 'following', 'search', 'nearby'
+ASYNC_READ_ENDPOINTS = []
+
+ASYNC_MONGO = {
+    'MAX_POOL_SIZE': 100,
+    'MIN_POOL_SIZE': 0,
+}
+
+# JWT 인증시 유저 조회 캐시 (accounts/cache.py)
+ACCOUNTS_USER_CACHE = {
+    'TTL': 10,
+    'MAX_ENTRIES': 10000,
+    'SHARED_BACKEND': 'accounts',  # 여러 프로세스가 공유할 CACHES alias
+    'SHARED_TTL': 60,
+}
+
+MUSICMAPS_GEO = {
+    # 'mongo' : location 의 2dsphere 인덱스 사용 (python manage.py ensure_indexes)
+    # 'grid'  : 프로세스 내부 geohash grid 사용 (테스트, mongomock 환경)
+    'BACKEND': 'mongo',
+    'GEOHASH_PRECISION': 9,
+    'MAX_COVER_CELLS': 64,
+    'MAX_RESULTS': 500,
+}
+
+MUSICMAPS_TIMELINE = {
+    'FANOUT_LIMIT': 10000,  # 팔로워가 이보다 많은 작성자는 조회 시점에 합친다 (fan-out-on-read)
+    'MAX_LENGTH': 800,
+    'BACKFILL': 50,
+    'BATCH_SIZE': 1000,
+}
+
+# 지도 타일 클러스터 집계 (musicmaps/tiles.py)
+MUSICMAPS_TILES = {
+    'MIN_ZOOM': 0,
+    'MAX_ZOOM': 16,
+    'GRID_BITS': 3,  # 타일 하나를 8 x 8 칸으로 묶는다.
+    'PRIVATE_LIMIT': 5000,  # 로그인한 경우 타일 하나에 더할 비공개 MusicMaps 최대 수
+}
+
+# MusicMaps 전문 검색 (musicmaps/search.py)
+# text 인덱스를 쓸 수 없는 환경에서는 'BACKEND': 'local' (프로세스 내부 역색인)
+MUSICMAPS_SEARCH = {
+    'BACKEND': 'mongo',
+    'WEIGHTS': {'content': 1, 'address': 2, 'tracks': 3},
+    'SYNC_INTERVAL': 1.0,  # local 역색인이 다른 worker 의 쓰기를 확인하는 주기(초)
+}
+
+# 지역별 인기 곡/장소 (musicmaps/trending.py)
+MUSICMAPS_TRENDING = {
+    'WINDOW': 7 * 24 * 3600,  # 최근 일주일
+    'BUCKET': 3600,           # 1시간 단위로 세고 만료한다.
+    'REGION_PRECISION': 4,
+    'TOP_K': 20,
+    'SNAPSHOT_INTERVAL': 30,
+}
+
+# 팔로우 추천 배치 작업 (musicmaps/suggestions.py, python manage.py compute_suggestions)
+MUSICMAPS_SUGGESTIONS = {
+    'TOP_K': 20,
+    'MUTUAL_WEIGHT': 1.0,       # 함께 아는 친구 한 명당 점수
+    'COLOCATION_WEIGHT': 0.5,   # MusicMaps 를 남긴 지역이 겹칠 때 지역 하나당 점수
+    'COLOCATION_CANDIDATES': 200,  # 지역마다 같은 지역 후보로 넣는 가장 활발한 유저 수
+}
+
+# memorize 쓰기 버퍼 (musicmaps/memorize.py)
+MUSICMAPS_MEMORIZE = {
+    'BUFFERED': True,
+    'FLUSH_INTERVAL': 0.2,  # 초
+    'FLUSH_SIZE': 500,
+    'RECOVER_AFTER': 60,     # 이보다 오래 반영되지 않은 의도(종료된 프로세스의 것)는 다른 프로세스가 반영한다. (초)
+    'RECOVER_INTERVAL': 30,
+}
+
+MUSICMAPS_CATALOG = {
+    'CACHE_SIZE': 10000,  # 프로세스 내부 LRU 캐시에 둘 곡 수
+    'CACHE_TTL': 3600,
+}
+
+MUSICMAPS_THREADS = {
+    'MAX_DEPTH': 8,
+    'MAX_NODES': 500,
+}
+
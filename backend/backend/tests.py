@@ -0,0 +1,242 @@
+import asyncio
+import datetime
+import decimal
+import io
+import json
+import shutil
+import tempfile
+
+import msgpack
+from bson import ObjectId
+from django.core.files.base import ContentFile
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from accounts import tokens
+from accounts.models import User
+from musicmaps.models import MusicMaps
+
+from . import images, metrics, renderers
+from .asgi_routes import AsyncReadRouter
+
+
+def png(size=(100, 50), color='red'):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_DERIVATIVES={'SIZES': {'thumbnail': 40, 'card': 200}, 'FORMATS': ('webp', 'jpeg')})
+class ImageTest(SimpleTestCase):
+    """
+    내용 해시로 저장하는 storage 와 파생 이미지 URL
+    """
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = images.ContentAddressedStorage(location=self.location, base_url='/media/')
+        images._complete = images._CompleteDigests()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+        images._complete = images._CompleteDigests()
+
+    def test_content_addressed(self):
+        name = self.storage.save('a.png', ContentFile(png()))
+        self.assertRegex(name, images.ORIGINAL_PATTERN)
+        self.assertEqual(self.storage.save('other.png', ContentFile(png())), name)
+        self.assertNotEqual(self.storage.save('a.png', ContentFile(png(color='blue'))), name)
+
+    def test_derivatives(self):
+        from PIL import Image
+
+        name = self.storage.save('a.png', ContentFile(png()))
+        digest = images.ORIGINAL_PATTERN.match(name).group('digest')
+        self.assertEqual(images.missing_derivatives(digest, self.storage), set())
+
+        with self.storage.open(images.derivative_name(digest, 'thumbnail', 'webp')) as f:
+            self.assertEqual(Image.open(f).size, (40, 20))
+        with self.storage.open(images.derivative_name(digest, 'card', 'jpeg')) as f:
+            self.assertEqual(Image.open(f).size, (100, 50))  # 원본보다 크게 늘리지 않는다.
+
+    def test_urls(self):
+        name = self.storage.save('a.png', ContentFile(png()))
+        digest = images.ORIGINAL_PATTERN.match(name).group('digest')
+        self.storage.delete(images.derivative_name(digest, 'card', 'webp'))
+        images._complete = images._CompleteDigests()
+
+        request = APIRequestFactory().get('/', HTTP_HOST='testserver')
+        urls = images.derivative_urls(name, self.storage, request)
+        self.assertEqual(urls['original'], 'http://testserver/media/' + name)
+        self.assertEqual(set(urls['thumbnail']), {'webp', 'jpeg'})
+        self.assertEqual(set(urls['card']), {'jpeg'})  # 저장된 파생 이미지만 내려준다.
+
+        with self.settings(IMAGE_DERIVATIVES={'SIZES': {}, 'BASE_URL': 'https://cdn.example.com'}):
+            self.assertEqual(images.derivative_urls(name, self.storage), {'original': 'https://cdn.example.com/media/' + name})
+
+        # 빠진 파생 이미지는 같은 이미지를 다시 올릴 때 채워진다.
+        self.storage.save('again.png', ContentFile(png()))
+        self.assertEqual(images.missing_derivatives(digest, self.storage), set())
+
+    def test_legacy_name(self):
+        self.assertEqual(images.derivative_urls('profile/a.png', self.storage), {'original': '/media/profile/a.png'})
+        self.assertIsNone(images.derivative_urls('', self.storage))
+
+
+@override_settings(ASYNC_READ_ENDPOINTS=['profile', 'followers', 'following', 'search', 'nearby'])
+class AsyncRouterTest(TestCase):
+    """
+    ASGI 라우터가 처리하는 비동기 조회. 처리하지 않는 요청은 Django(application)로 넘긴다.
+    """
+
+    def setUp(self):
+        MusicMaps.objects.ensure_indexes()
+        self.user = User.objects.create_user(email='kim@test.com', userid='minsu', password='pw', username='김민수')
+        self.token = tokens.get_token(self.user)
+        self.forwarded = []
+
+    async def application(self, scope, receive, send):
+        self.forwarded.append(scope['path'])
+
+    def get(self, path, query='', token=None, **headers):
+        headers = [(name.replace('_', '-').encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+        if token is not False:
+            headers.append((b'authorization', ('JWT %s' % (token or self.token)).encode('latin-1')))
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode('latin-1'), 'headers': headers}
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(AsyncReadRouter(self.application)(scope, None, send))
+        if not sent:
+            return None
+        return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+    def test_profile(self):
+        status, headers, body = self.get('/accounts/minsu/')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['userid'], 'minsu')
+        self.assertEqual(headers[b'vary'], b'Accept')
+
+        status, _, body = self.get('/accounts/minsu/', if_none_match=headers[b'etag'].decode('latin-1'))
+        self.assertEqual((status, body), (304, b''))
+        self.assertEqual(self.get('/accounts/nobody/')[0], 404)
+
+    def test_authentication(self):
+        self.assertEqual(self.get('/accounts/minsu/', token='bad')[0], 401)
+        # JWT 가 아닌 요청, 등록되지 않은 경로는 Django 가 처리한다.
+        self.assertIsNone(self.get('/accounts/minsu/', token=False))
+        self.assertIsNone(self.get('/accounts/minsu/follow/'))
+        self.assertEqual(self.forwarded, ['/accounts/minsu/', '/accounts/minsu/follow/'])
+
+    def test_api_exception(self):
+        status, _, body = self.get('/accounts/minsu/followers/', 'cursor=broken')
+        self.assertEqual(status, 404)
+        self.assertEqual(json.loads(body), {'detail': 'Invalid cursor'})
+
+    def test_search_and_nearby(self):
+        status, _, body = self.get('/accounts/search/', 'q=min')
+        self.assertEqual([user['userid'] for user in json.loads(body)['results']], ['minsu'])
+        self.assertEqual(self.get('/accounts/search/')[0], 400)
+
+        MusicMaps.objects.create(
+            images=[], content='map', open_range=MusicMaps.OpenRange.PUBLIC, comments_on=True, author=self.user,
+            street_address='서울', building_number='1', location={'type': 'Point', 'coordinates': [127.0, 37.5]},
+        )
+        status, _, body = self.get('/musicmaps/list/', 'lng=127.0&lat=37.5&radius=100')
+        self.assertEqual(status, 200)
+        self.assertEqual([doc['content'] for doc in json.loads(body)], ['map'])
+        self.assertEqual(self.get('/musicmaps/list/', 'lng=500&lat=37.5&radius=100')[0], 400)
+
+
+class MetricsViewTest(SimpleTestCase):
+    """
+    /metrics 는 METRICS['TOKEN'] 을 Bearer 로 보낸 요청에만 응답한다.
+    """
+
+    def get(self, **headers):
+        return metrics.metrics_view(RequestFactory().get('/metrics', **headers))
+
+    @override_settings(METRICS={'TOKEN': None})
+    def test_disabled(self):
+        with self.assertRaises(Http404):
+            self.get(HTTP_AUTHORIZATION='Bearer ')
+
+    @override_settings(METRICS={'TOKEN': 'secret'})
+    def test_token(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Basic secret').status_code, 403)
+
+        with metrics.measure('test_view', 'GET') as measured:
+            measured['status'] = 200
+        response = self.get(HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('view="test_view"', response.content.decode())
+
+
+class EchoView(APIView):
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def post(self, request):
+        return Response({'data': request.data, 'date': datetime.datetime(2020, 5, 1, 12, 30)})
+
+
+class RendererTest(SimpleTestCase):
+    """
+    orjson / MessagePack renderer, parser 와 Accept 로 고르는 응답 형식
+    """
+
+    def test_orjson_renderer(self):
+        renderer = renderers.ORJSONRenderer()
+        data = {'id': ObjectId('5ea0c0ffee0000000000cafe'), 'price': decimal.Decimal('1.5'), 1: [None, True]}
+        self.assertEqual(json.loads(renderer.render(data)), {'id': '5ea0c0ffee0000000000cafe', 'price': 1.5, '1': [None, True]})
+        self.assertEqual(renderer.render(None), b'')
+        self.assertIn(b'\n  ', renderer.render({'a': 1}, 'application/json; indent=4'))
+
+    def test_msgpack_renderer(self):
+        renderer = renderers.MessagePackRenderer()
+        data = {'date': datetime.datetime(2020, 5, 1, 12, 30), 'id': ObjectId('5ea0c0ffee0000000000cafe'), 'name': '밤편지'}
+        self.assertEqual(
+            msgpack.unpackb(renderer.render(data), raw=False),
+            {'date': '2020-05-01T12:30:00', 'id': '5ea0c0ffee0000000000cafe', 'name': '밤편지'},
+        )
+        self.assertEqual(renderer.render(None), b'')
+
+    def test_parsers(self):
+        self.assertEqual(renderers.ORJSONParser().parse(io.BytesIO('{"name": "밤편지"}'.encode())), {'name': '밤편지'})
+        self.assertEqual(renderers.MessagePackParser().parse(io.BytesIO(msgpack.packb({'a': [1]}))), {'a': [1]})
+        for parser, body in ((renderers.ORJSONParser(), b'{"a":'), (renderers.MessagePackParser(), b'\x01\x02')):
+            with self.assertRaises(ParseError):
+                parser.parse(io.BytesIO(body))
+
+    def test_renderer_for(self):
+        self.assertIsInstance(renderers.renderer_for('application/msgpack'), renderers.MessagePackRenderer)
+        self.assertIsInstance(renderers.renderer_for('application/json'), renderers.ORJSONRenderer)
+        self.assertIsInstance(renderers.renderer_for(None), renderers.ORJSONRenderer)
+
+    def test_negotiation(self):
+        factory = APIRequestFactory()
+        body = msgpack.packb({'name': '밤편지'})
+        request = factory.post('/', body, content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        response = EchoView.as_view()(request).render()
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content, raw=False), {'data': {'name': '밤편지'}, 'date': '2020-05-01T12:30:00'})
+
+        request = factory.post('/', '{"name": "밤편지"}', content_type='application/json')
+        response = EchoView.as_view()(request).render()
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), {'data': {'name': '밤편지'}, 'date': '2020-05-01T12:30:00'})
+
+        request = factory.post('/', b'{"name":', content_type='application/json')
+        self.assertEqual(EchoView.as_view()(request).status_code, 400)
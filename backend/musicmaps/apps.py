@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MusicmapsConfig(AppConfig):
     name = 'musicmaps'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,45 @@
+"""
+주변 MusicMaps 조회의 비동기 버전 (backend/asgi_routes.py 에서 호출)
+
+인증(viewer 와 팔로우 집합 조회) 뒤에 공개 범위 조건을 합친 위치 검색을 하고,
+플레이리스트를 한번에 붙인다. 공개 범위로 거르기 전에 limit 으로 자르면 결과가 모자라므로
+두 조회를 동시에 실행하지 않는다. 2dsphere 인덱스가 필요하다.
+"""
+from backend import mongo
+from backend.asgi_routes import authenticate
+from backend.metrics import aserialized
+
+from . import geo
+from .models import Music, MusicMaps
+from .repository import AsyncMusicMapsRepository
+from .serializers import MusicMapDocumentSerializer
+from .views import _float_params
+from .visibility import Visibility
+
+
+async def nearby(request):
+    if 'bbox' in request.query_params or geo.geo_settings()['BACKEND'] != 'mongo':
+        return None  # Django view 가 처리한다.
+
+    params = _float_params(request.query_params, 'lng', 'lat', 'radius')
+    if params is None:
+        await authenticate(request)
+        return 400, None
+    lng, lat, radius = params
+    try:
+        geo.validate_point(lng, lat)
+        geo.validate_radius(radius)
+    except geo.InvalidQuery as error:
+        await authenticate(request)
+        return 400, {'detail': str(error)}
+
+    limit = request.query_params.get('limit')
+    limit = int(limit) if limit and limit.isdigit() else None
+
+    repository = AsyncMusicMapsRepository(mongo.collection(MusicMaps), mongo.collection(Music))
+
+    viewer = await authenticate(request)
+    visibility = Visibility.from_sets(viewer['id'], viewer.get('followers_id'), viewer.get('following_id'))
+    docs = await repository.nearby(lng, lat, radius, limit, visibility)
+
+    return 200, await aserialized(MusicMapDocumentSerializer(docs, many=True, context={'request': request}))
@@ -0,0 +1,133 @@
+"""
+Music 카탈로그
+
+같은 곡(artists, album, name, track_number)은 정규화한 identity 로 하나의 Music 문서만
+만들고 여러 MusicMaps 의 플레이리스트가 함께 참조한다. 자주 나오는 곡은 프로세스 내부
+LRU 캐시에 두어 플레이리스트를 직렬화할 때 DB 를 읽지 않는다.
+"""
+import hashlib
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from accounts.cache import LocalTTLCache
+
+from .models import Music
+
+DEFAULT_CATALOG_SETTINGS = {
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 3600,
+}
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def catalog_settings():
+    conf = dict(DEFAULT_CATALOG_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_CATALOG', {}))
+    return conf
+
+
+def _normalize(value):
+    value = unicodedata.normalize('NFKC', str(value if value is not None else ''))
+    return _WHITESPACE.sub(' ', value).strip().casefold()
+
+
+def track_identity(artists, album, name, track_number):
+    key = '\x1f'.join(_normalize(value) for value in (artists, album, name, track_number))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        conf = catalog_settings()
+        _cache = LocalTTLCache(conf['CACHE_TTL'], conf['CACHE_SIZE'])
+    return _cache
+
+
+def _canonical(identities):
+    """
+    identity -> Music. identity unique 인덱스 이전에 만들어진 중복이 남아 있으면 pk 가 가장 작은 것을 쓴다.
+    """
+    found = {}
+    for music in Music.objects.filter(identity__in=list(identities)).order_by('-pk'):
+        found[music.identity] = music
+    return found
+
+
+def upsert_tracks(tracks):
+    """
+    트랙 정보(dict: artists, album, name, track_number, album_cover) 목록을 카탈로그에 반영하고
+    같은 순서의 Music 목록을 반환한다. 없는 곡만 bulk_create 한번으로 만든다.
+    """
+    identities = [
+        track_identity(track['artists'], track['album'], track['name'], track['track_number'])
+        for track in tracks
+    ]
+    found = _canonical(set(identities))
+
+    missing = {}
+    for identity, track in zip(identities, tracks):
+        if identity not in found and identity not in missing:
+            missing[identity] = Music(
+                identity=identity,
+                artists=track['artists'],
+                album=track['album'],
+                name=track['name'],
+                track_number=track['track_number'],
+                album_cover=track.get('album_cover') or '',
+            )
+
+    if missing:
+        try:
+            Music.objects.bulk_create(missing.values())
+        except DatabaseError:
+            # 다른 요청이 같은 곡을 먼저 만들었다. (identity unique 인덱스) 아직 없는 곡만 하나씩 만든다.
+            for identity, music in missing.items():
+                if not Music.objects.filter(identity=identity).exists():
+                    try:
+                        music.pk = None
+                        music.save(force_insert=True)
+                    except DatabaseError:
+                        pass
+        found.update(_canonical(missing.keys()))
+
+    cache = get_cache()
+    for music in found.values():
+        cache.set(music.pk, music)
+
+    return [found[identity] for identity in identities]
+
+
+def resolve(pks):
+    """
+    pk -> Music. 캐시에 없는 곡만 in_bulk 한번으로 읽는다.
+    """
+    cache = get_cache()
+    resolved = {}
+    misses = []
+    for pk in pks:
+        music = cache.get(pk)
+        if music is None:
+            misses.append(pk)
+        else:
+            resolved[pk] = music
+
+    if misses:
+        for pk, music in Music.objects.in_bulk(misses).items():
+            cache.set(pk, music)
+            resolved[pk] = music
+
+    return resolved
+
+
+def invalidate(*pks):
+    cache = get_cache()
+    for pk in pks:
+        cache.delete(pk)
@@ -0,0 +1,29 @@
+"""
+djongo 를 거치지 않는 MongoDB 접근
+
+집계 컬렉션(tiles, trending, search 상태)과 bulk_import 는 pymongo 로 직접 쓴다.
+"""
+from django.db import connection
+from pymongo import ReturnDocument
+
+
+def database():
+    """
+    djongo 연결의 pymongo Database
+    """
+    connection.ensure_connection()
+    return connection.connection
+
+
+def reserve_ids(model, count):
+    """
+    djongo 의 auto increment 값(__schema__ 의 auto.seq)을 count 만큼 올리고 첫 pk 를 반환한다.
+    """
+    doc = database()['__schema__'].find_one_and_update(
+        {'name': model._meta.db_table},
+        {'$inc': {'auto.seq': count}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is None:
+        raise RuntimeError('No __schema__ entry for %s. Run migrate first.' % model._meta.db_table)
+    return doc['auto']['seq'] - count + 1
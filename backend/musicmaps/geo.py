@@ -0,0 +1,440 @@
+"""
+MusicMaps 위치 검색
+
+반경(radius) 검색과 bounding box 검색을 제공한다.
+MongoDB 에서는 location 필드의 2dsphere 인덱스를 사용하고,
+테스트나 mongomock 환경처럼 geo 연산자를 쓸 수 없는 경우에는
+프로세스 내부의 geohash grid 를 사용한다.
+"""
+import bisect
+import math
+import threading
+
+from django.conf import settings
+
+EARTH_RADIUS_M = 6371008.8
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_BASE32_INDEX = {c: i for i, c in enumerate(_BASE32)}
+
+DEFAULT_GEO_SETTINGS = {
+    'BACKEND': 'mongo',          # 'mongo' 또는 'grid'
+    'GEOHASH_PRECISION': 9,      # 저장되는 geohash 길이 (약 5m x 5m)
+    'MAX_COVER_CELLS': 64,       # grid 검색시 한번에 스캔할 최대 셀 수
+    'MAX_RESULTS': 500,
+    'MAX_RADIUS': 100000,        # 반경 검색 최대 반경(m)
+}
+
+
+class InvalidQuery(ValueError):
+    """
+    잘못된 좌표, 반경, bbox. view 는 400 으로 응답한다.
+    """
+
+
+def geo_settings():
+    conf = dict(DEFAULT_GEO_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_GEO', {}))
+    return conf
+
+
+def encode(lng, lat, precision=9):
+    """
+    경도, 위도를 geohash 문자열로 변환한다.
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def decode_bounds(geohash):
+    """
+    geohash 셀의 (west, south, east, north) 경계를 반환한다.
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        value = _BASE32_INDEX[char]
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+
+    return lng_range[0], lat_range[0], lng_range[1], lat_range[1]
+
+
+def decode(geohash):
+    west, south, east, north = decode_bounds(geohash)
+    return (west + east) / 2, (south + north) / 2
+
+
+def cell_size(precision):
+    """
+    주어진 precision 에서 셀 하나의 (경도 폭, 위도 높이) 를 도 단위로 반환한다.
+    """
+    total_bits = precision * 5
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 360.0 / (1 << lng_bits), 180.0 / (1 << lat_bits)
+
+
+def haversine(lng1, lat1, lng2, lat2):
+    """
+    두 좌표 사이의 거리(m)
+    """
+    lng1, lat1, lng2, lat2 = map(math.radians, (lng1, lat1, lng2, lat2))
+    d_lat = lat2 - lat1
+    d_lng = lng2 - lng1
+    a = math.sin(d_lat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(d_lng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lng, lat, radius_m):
+    """
+    중심점과 반경을 감싸는 bounding box (west, south, east, north)
+    """
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    cos_lat = max(math.cos(math.radians(lat)), 1e-12)
+    d_lng = min(180.0, math.degrees(radius_m / (EARTH_RADIUS_M * cos_lat)))
+    return (
+        max(-180.0, lng - d_lng),
+        max(-90.0, lat - d_lat),
+        min(180.0, lng + d_lng),
+        min(90.0, lat + d_lat),
+    )
+
+
+def covering_cells(bbox, max_cells=64, max_precision=9):
+    """
+    bbox 를 덮는 geohash 셀 목록을 반환한다.
+    셀 수가 max_cells 를 넘지 않는 가장 세밀한 precision 을 선택한다.
+    """
+    west, south, east, north = bbox
+    cells = ['']
+
+    for precision in range(1, max_precision + 1):
+        width, height = cell_size(precision)
+        cols = int(math.floor(east / width) - math.floor(west / width)) + 1
+        rows = int(math.floor(north / height) - math.floor(south / height)) + 1
+        if cols * rows > max_cells:
+            break
+
+        found = set()
+        for row in range(rows):
+            cell_lat = min(89.999999, (math.floor(south / height) + row) * height + height / 2)
+            for col in range(cols):
+                cell_lng = min(179.999999, (math.floor(west / width) + col) * width + width / 2)
+                found.add(encode(cell_lng, cell_lat, precision))
+        cells = sorted(found)
+
+    return cells
+
+
+def point_of(location):
+    """
+    MusicMaps.location (GeoJSON Point) 에서 (경도, 위도) 를 꺼낸다.
+    """
+    if not location:
+        return None
+    coordinates = location.get('coordinates') if isinstance(location, dict) else getattr(location, 'coordinates', None)
+    if not coordinates or len(coordinates) < 2:
+        return None
+    return float(coordinates[0]), float(coordinates[1])
+
+
+def validate_point(lng, lat):
+    if not (math.isfinite(lng) and math.isfinite(lat) and -180.0 <= lng <= 180.0 and -90.0 <= lat <= 90.0):
+        raise InvalidQuery('coordinates must be lng in [-180, 180] and lat in [-90, 90]')
+
+
+def validate_radius(radius_m):
+    if not (math.isfinite(radius_m) and 0 < radius_m <= geo_settings()['MAX_RADIUS']):
+        raise InvalidQuery('radius must be in (0, %d]' % geo_settings()['MAX_RADIUS'])
+
+
+def validate_bbox(bbox):
+    west, south, east, north = bbox
+    validate_point(west, south)
+    validate_point(east, north)
+    if west > east or south > north:
+        raise InvalidQuery('bbox must be "west,south,east,north"')  # 날짜 변경선을 넘는 bbox 는 지원하지 않는다.
+
+
+def parse_bbox(value):
+    """
+    "west,south,east,north" 문자열을 검사해서 tuple 로 반환한다.
+    """
+    try:
+        bbox = tuple(float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise InvalidQuery('bbox must be "west,south,east,north"')
+    if len(bbox) != 4:
+        raise InvalidQuery('bbox must be "west,south,east,north"')
+    validate_bbox(bbox)
+    return bbox
+
+
+def in_bbox(lng, lat, bbox):
+    west, south, east, north = bbox
+    return west <= lng <= east and south <= lat <= north
+
+
+class GeoHashGrid:
+    """
+    geohash 로 정렬된 리스트를 이용한 프로세스 내부 위치 인덱스.
+
+    (geohash, pk) 를 정렬 상태로 유지하고, 검색시에는 bbox 를 덮는 셀들의
+    prefix 범위만 이분 탐색으로 스캔한다.
+    """
+
+    def __init__(self, precision=9):
+        self.precision = precision
+        self._entries = []
+        self._points = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def add(self, pk, lng, lat):
+        with self._lock:
+            self.remove(pk)
+            geohash = encode(lng, lat, self.precision)
+            bisect.insort(self._entries, (geohash, pk))
+            self._points[pk] = (lng, lat, geohash)
+
+    def remove(self, pk):
+        with self._lock:
+            point = self._points.pop(pk, None)
+            if point is None:
+                return
+            index = bisect.bisect_left(self._entries, (point[2], pk))
+            if index < len(self._entries) and self._entries[index] == (point[2], pk):
+                del self._entries[index]
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._points = {}
+
+    def _scan(self, bbox, max_cells):
+        with self._lock:
+            for prefix in covering_cells(bbox, max_cells, self.precision):
+                index = bisect.bisect_left(self._entries, (prefix,))
+                while index < len(self._entries) and self._entries[index][0].startswith(prefix):
+                    pk = self._entries[index][1]
+                    lng, lat, _ = self._points[pk]
+                    yield pk, lng, lat
+                    index += 1
+
+    def within(self, bbox, limit=None, max_cells=64):
+        result = []
+        for pk, lng, lat in self._scan(bbox, max_cells):
+            if in_bbox(lng, lat, bbox):
+                result.append(pk)
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+    def near(self, lng, lat, radius_m, limit=None, max_cells=64):
+        found = []
+        for pk, p_lng, p_lat in self._scan(radius_bbox(lng, lat, radius_m), max_cells):
+            distance = haversine(lng, lat, p_lng, p_lat)
+            if distance <= radius_m:
+                found.append((distance, pk))
+        found.sort()
+        if limit is not None:
+            found = found[:limit]
+        return [pk for _, pk in found]
+
+
+_grid = None
+_grid_lock = threading.Lock()
+
+
+def get_grid():
+    """
+    grid 는 처음 사용할 때 DB 의 좌표로 채우고, 이후에는 signal 로 갱신한다.
+    """
+    global _grid
+    if _grid is None:
+        with _grid_lock:
+            if _grid is None:
+                from .models import MusicMaps
+
+                grid = GeoHashGrid(geo_settings()['GEOHASH_PRECISION'])
+                for pk, location in MusicMaps.objects.values_list('pk', 'location').iterator():
+                    point = point_of(location)
+                    if point is not None:
+                        grid.add(pk, *point)
+                _grid = grid
+    return _grid
+
+
+def update_grid(musicmap):
+    if _grid is None:
+        return
+    point = point_of(musicmap.location)
+    if point is None:
+        _grid.remove(musicmap.pk)
+    else:
+        _grid.add(musicmap.pk, *point)
+
+
+def remove_from_grid(pk):
+    if _grid is not None:
+        _grid.remove(pk)
+
+
+def _geometry(lng, lat):
+    return {'type': 'Point', 'coordinates': [lng, lat]}
+
+
+def bbox_polygon(bbox):
+    west, south, east, north = bbox
+    return {
+        'type': 'Polygon',
+        'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+    }
+
+
+def covering_polygon_bbox(bbox):
+    """
+    2dsphere 의 polygon 변은 측지선(great circle)이라 위도선보다 극 쪽으로 휜다.
+    적도 쪽 변을 휘는 만큼 옮겨서, polygon 이 위도/경도 사각형(bbox)을 모두 덮도록 한다.
+    """
+    west, south, east, north = bbox
+    half = math.radians(east - west) / 2
+
+    def widen(lat):
+        return math.degrees(math.atan(math.tan(math.radians(lat)) * math.cos(half)))
+
+    return west, widen(south) if south > 0 else south, east, widen(north) if north < 0 else north
+
+
+def bbox_query(bbox):
+    """
+    grid 검색과 같은 평면 사각형 조건. 좌표 범위 조건으로 정확히 거르고,
+    사각형을 덮는 polygon 의 $geoWithin 으로 2dsphere 인덱스를 사용한다.
+    (반구보다 넓거나 geo 연산자를 쓸 수 없는 grid backend 에서는 범위 조건만)
+    """
+    west, south, east, north = bbox
+    query = {
+        'location.coordinates.0': {'$gte': west, '$lte': east},
+        'location.coordinates.1': {'$gte': south, '$lte': north},
+    }
+    if east - west < 180 and geo_settings()['BACKEND'] == 'mongo':
+        query['location'] = {'$geoWithin': {'$geometry': bbox_polygon(covering_polygon_bbox(bbox))}}
+    return query
+
+
+def near_query(lng, lat, radius_m, condition=None):
+    """
+    중심점에서 radius_m 이내를 가까운 순서로 찾는 조건. $nearSphere 는 $and/$or 안에 넣을 수 없으므로
+    condition(공개 범위 등)은 최상위에 합친다.
+    """
+    query = {'location': {'$nearSphere': {'$geometry': _geometry(lng, lat), '$maxDistance': radius_m}}}
+    if condition:
+        query.update(condition)
+    return query
+
+
+def maps_near(lng, lat, radius_m, limit=None, visibility=None):
+    """
+    중심점에서 radius_m 이내의 MusicMaps pk 를 가까운 순서로 반환한다.
+    visibility 가 있으면 볼 수 있는 MusicMaps 만 limit 개 반환한다. (limit 으로 자르기 전에 거른다)
+    """
+    validate_point(lng, lat)
+    validate_radius(radius_m)
+    conf = geo_settings()
+    limit = min(limit or conf['MAX_RESULTS'], conf['MAX_RESULTS'])
+
+    if conf['BACKEND'] == 'grid':
+        if visibility is None:
+            return get_grid().near(lng, lat, radius_m, limit, conf['MAX_COVER_CELLS'])
+        return _visible_prefix(get_grid().near(lng, lat, radius_m, None, conf['MAX_COVER_CELLS']), visibility, limit)
+
+    from .models import MusicMaps
+
+    condition = visibility.mongo_filter() if visibility is not None else None
+    cursor = MusicMaps.objects.mongo_find(near_query(lng, lat, radius_m, condition), {'id': True}).limit(limit)
+    return [doc['id'] for doc in cursor]
+
+
+def _visible_prefix(pks, visibility, limit):
+    # grid 에는 공개 범위가 없으므로 거리순으로 limit 개씩 DB 에서 판정해서 limit 개가 차면 멈춘다.
+    visible = []
+    for start in range(0, len(pks), limit):
+        visible.extend(visibility.visible_pks(pks[start:start + limit]))
+        if len(visible) >= limit:
+            break
+    return visible[:limit]
+
+
+def maps_within(bbox, limit=None):
+    """
+    bbox (west, south, east, north) 안에 있는 MusicMaps pk 를 반환한다.
+    """
+    validate_bbox(bbox)
+    conf = geo_settings()
+    limit = min(limit or conf['MAX_RESULTS'], conf['MAX_RESULTS'])
+
+    if conf['BACKEND'] == 'grid':
+        return get_grid().within(bbox, limit, conf['MAX_COVER_CELLS'])
+
+    from .models import MusicMaps
+
+    cursor = MusicMaps.objects.mongo_find(bbox_query(bbox), {'id': True}).limit(limit)
+    return [doc['id'] for doc in cursor]
+
+
+def maps_within_page(bbox, condition=None, position=None, limit=20):
+    """
+    bbox 안의 MusicMaps 를 date_updated, id 역순으로 limit 개 반환한다. [{'id', 'date_updated'}]
+    condition 은 함께 걸 조회 조건(공개 범위 등), position 은 마지막으로 받은 (date_updated, pk) 이다.
+    cursor 조건과 정렬을 bbox 조회 안에서 처리하므로 MAX_RESULTS 와 관계없이 끝까지 넘길 수 있다.
+    """
+    validate_bbox(bbox)
+    from .models import MusicMaps
+
+    conditions = [bbox_query(bbox)]
+    if condition:
+        conditions.append(condition)
+    if position is not None:
+        date_updated, pk = position
+        conditions.append({'$or': [
+            {'date_updated': {'$lt': date_updated}},
+            {'date_updated': date_updated, 'id': {'$lt': pk}},
+        ]})
+
+    cursor = MusicMaps.objects.mongo_find(
+        {'$and': conditions}, {'_id': False, 'id': True, 'date_updated': True}
+    ).sort([('date_updated', -1), ('id', -1)]).limit(limit)
+    return list(cursor)
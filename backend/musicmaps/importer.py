@@ -0,0 +1,500 @@
+"""
+대량 가져오기 (python manage.py bulk_import)
+
+ORM 으로 옮기면 문서마다 save() 한번, ArrayReferenceField 관계마다 쓰기가 한번 더 필요하다.
+대신 NDJSON/CSV 를 generator 로 한 줄씩 읽어 CHUNK 단위로 묶고, 묶음마다
+검증 -> 참조(userid, 곡) 일괄 조회 -> insert_many / bulk_write 한번으로 쓴다.
+메모리에는 한 묶음만 올라간다.
+
+signal 을 거치지 않으므로 signal 이 하던 일(타임라인 fan-out/backfill, 타일/인기 집계, 팔로우 카운터)은
+묶음을 쓴 뒤 그 묶음의 문서로만 한다. (after_write) 검색 term 은 문서를 만들 때 함께 넣는다.
+
+묶음을 쓰기 전에 __schema__ 의 auto.seq 에서 묶음 크기만큼 pk 를 미리 받아 checkpoint 에 기록하고,
+쓰기가 끝나면 읽은 위치를 기록한다. 중간에 멈춘 뒤 다시 실행하면 마지막 묶음을 같은 pk 로 다시 쓰므로
+이미 들어간 문서는 pk 중복으로 건너뛰고 나머지만 들어간다. after_write 도중에 멈췄다면 그 묶음의 집계가
+일부만 더해졌을 수 있으므로, 그때만 끝날 때(finish) 집계 전체를 다시 계산한다.
+"""
+import csv
+import json
+import os
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from djongo import models
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from accounts.models import User
+
+from . import catalog, geo, search
+from .db import reserve_ids
+from .models import Music, MusicMaps
+
+DUPLICATE_KEY = 11000
+
+
+class MalformedRow(ValueError):
+    """
+    읽을 수 없는 행. read_rows 는 예외를 발생시키지 않고 행 대신 반환한다.
+    """
+
+
+def read_rows(path, fmt=None):
+    """
+    (줄 번호, dict 또는 MalformedRow) 를 하나씩 반환한다. fmt 가 없으면 확장자로 판단한다.
+    """
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+    with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8') as file:
+        if fmt == 'csv':
+            for number, row in enumerate(csv.DictReader(file), start=2):
+                yield number, row
+        else:
+            for number, line in enumerate(file, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    yield number, MalformedRow('invalid JSON: %s' % error)
+                    continue
+                yield number, row if isinstance(row, dict) else MalformedRow('row must be a JSON object')
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def to_document(instance):
+    """
+    모델 인스턴스를 djongo 가 저장하는 문서 모양으로 바꾼다.
+    """
+    doc = {}
+    for field in instance._meta.concrete_fields:
+        if isinstance(field, models.ArrayReferenceField):
+            doc[field.attname] = sorted(getattr(instance, field.attname, None) or ())
+        else:
+            doc[field.column] = field.get_db_prep_save(field.pre_save(instance, True), connection)
+    return doc
+
+
+def _json(value):
+    # CSV 에서는 목록을 JSON 문자열로 받는다.
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _error_messages(error):
+    return error.message_dict if hasattr(error, 'error_dict') else {'row': error.messages}
+
+
+def _validate_tracks(playlist):
+    """
+    카탈로그에 만들기 전에 플레이리스트 곡 정보를 검사한다.
+    """
+    if not isinstance(playlist, list):
+        raise ValidationError({'playlist': ['playlist must be a list']})
+    for track in playlist:
+        if not isinstance(track, dict):
+            raise ValidationError({'playlist': ['track must be an object']})
+        Music(
+            artists=track.get('artists'),
+            album=track.get('album'),
+            name=track.get('name'),
+            track_number=track.get('track_number'),
+        ).full_clean(exclude=('album_cover', 'identity'), validate_unique=False)
+
+
+class Checkpoint:
+
+    def __init__(self, path):
+        self.path = path
+        self.position = 0     # 쓰기가 끝난 행 수
+        self.reserved = None  # 쓰는 중인 묶음의 {'position', 'first_id', 'written'}
+        self.rebuild = False  # after_write 도중에 멈춘 적이 있어서 finish 에서 집계를 다시 계산해야 하는지
+        self.stats = defaultdict(int)
+        if path and os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            self.position = state['position']
+            self.reserved = state.get('reserved')
+            self.rebuild = state.get('rebuild', False)
+            self.stats.update(state.get('stats', {}))
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'position': self.position, 'reserved': self.reserved, 'rebuild': self.rebuild, 'stats': self.stats}, file)
+        os.replace(tmp, self.path)
+
+
+class Importer:
+    """
+    종류별 가져오기. prepare() 는 묶음의 행마다 (줄 번호, 문서 또는 None, 오류) 를 반환하고 write() 가 문서를 쓴다.
+    after_write() 는 쓴 묶음의 문서(이미 들어가 있던 문서 포함)로 signal 이 하던 일을 한다.
+    """
+    model = None
+    reserve = True  # 묶음마다 pk 를 미리 받는지
+
+    def prepare(self, rows, first_id):
+        raise NotImplementedError
+
+    def write(self, docs):
+        """
+        (inserted, skipped) 를 반환한다.
+        """
+        try:
+            result = self.model.objects.mongo_insert_many(docs, ordered=False)
+            return len(result.inserted_ids), 0
+        except BulkWriteError as error:
+            errors = error.details['writeErrors']
+            if any(item['code'] != DUPLICATE_KEY for item in errors):
+                raise
+            return error.details['nInserted'], len(errors)
+
+    def validated(self, instance, exclude=()):
+        # unique 와 참조 존재 여부는 묶음 단위로 이미 확인했으므로 행마다 조회하지 않는다.
+        instance.full_clean(exclude=exclude, validate_unique=False)
+        return to_document(instance)
+
+    def after_write(self, docs, replay=False):
+        """
+        replay 면 멈췄던 after_write 를 다시 하는 것이라 일부가 이미 반영되어 있을 수 있다.
+        같은 묶음을 두번 더하면 안 되는 집계는 건너뛰고 True 를 반환해서 finish(rebuild=True) 에 맡긴다.
+        """
+        return False
+
+    def finish(self, rebuild=False):
+        pass
+
+
+class UserImporter(Importer):
+    """
+    email, userid, username, password(Django 해시, 없으면 로그인 불가), date_joined, is_active, profile_image
+    팔로우 관계는 follows 로 따로 가져온다.
+    """
+    model = User
+
+    def prepare(self, rows, first_id):
+        existing = set()
+        for doc in User.objects.mongo_find(
+            {'$or': [
+                {'userid': {'$in': [row.get('userid') for _, row in rows]}},
+                {'email': {'$in': [row.get('email') for _, row in rows]}},
+            ]},
+            {'_id': False, 'id': True, 'userid': True, 'email': True},
+        ):
+            # 다시 실행할 때 같은 pk 로 이미 들어간 행은 pk 중복으로 건너뛰도록 둔다.
+            if not first_id <= doc['id'] < first_id + len(rows):
+                existing.update((doc['userid'], doc['email']))
+
+        results = []
+        seen = set()
+        for offset, (number, row) in enumerate(rows):
+            keys = (row.get('userid'), row.get('email'))
+            if existing.intersection(keys) or seen.intersection(keys):
+                results.append((number, None, {'userid': ['already exists']}))
+                continue
+            seen.update(keys)
+
+            user = User(
+                id=first_id + offset,
+                email=row.get('email'),
+                userid=row.get('userid'),
+                username=row.get('username') or '',
+                password=row.get('password') or '!',
+                is_active=row.get('is_active', True) not in (False, 'false', 'False', '0', 0),
+                profile_image=row.get('profile_image') or None,
+            )
+            if row.get('date_joined'):
+                user.date_joined = row['date_joined']
+            user.update_search_keys()
+            try:
+                results.append((number, self.validated(user, exclude=('followers', 'following')), None))
+            except ValidationError as error:
+                results.append((number, None, _error_messages(error)))
+        return results
+
+
+class MusicImporter(Importer):
+    """
+    artists, album, name, track_number, album_cover. 카탈로그(identity)에 이미 있는 곡은 건너뛴다.
+    """
+    model = Music
+
+    def prepare(self, rows, first_id):
+        identities = [
+            catalog.track_identity(row.get('artists'), row.get('album'), row.get('name'), row.get('track_number'))
+            for _, row in rows
+        ]
+        existing = {
+            doc['identity'] for doc in Music.objects.mongo_find(
+                {'identity': {'$in': identities}, 'id': {'$not': {'$gte': first_id, '$lt': first_id + len(rows)}}},
+                {'_id': False, 'identity': True},
+            )
+        }
+
+        results = []
+        for offset, ((number, row), identity) in enumerate(zip(rows, identities)):
+            if identity in existing:
+                results.append((number, None, {'identity': ['already exists']}))
+                continue
+            existing.add(identity)
+
+            music = Music(
+                id=first_id + offset,
+                identity=identity,
+                artists=row.get('artists'),
+                album=row.get('album'),
+                name=row.get('name'),
+                track_number=row.get('track_number'),
+                album_cover=row.get('album_cover') or '',
+            )
+            try:
+                results.append((number, self.validated(music, exclude=('album_cover',)), None))
+            except ValidationError as error:
+                results.append((number, None, _error_messages(error)))
+        return results
+
+
+class MapImporter(Importer):
+    """
+    author(userid), content, coordinates([경도, 위도]) 또는 lng/lat, street_address, building_number,
+    open_range, comments_on, date_created, images([이미지 경로]), playlist([{artists, album, name, track_number}])
+    플레이리스트 곡은 카탈로그에 없으면 함께 만든다.
+    """
+    model = MusicMaps
+
+    def prepare(self, rows, first_id):
+        authors = {
+            doc['userid']: doc['id'] for doc in User.objects.mongo_find(
+                {'userid': {'$in': list({row.get('author') for _, row in rows})}},
+                {'_id': False, 'id': True, 'userid': True},
+            )
+        }
+
+        results = {}
+        valid = []
+        for offset, (number, row) in enumerate(rows):
+            author_id = authors.get(row.get('author'))
+            if author_id is None:
+                results[offset] = (number, None, {'author': ['unknown userid']})
+                continue
+
+            try:
+                playlist = _json(row.get('playlist')) or []
+                _validate_tracks(playlist)
+            except ValueError:
+                results[offset] = (number, None, {'playlist': ['invalid playlist']})
+                continue
+            except ValidationError as error:
+                results[offset] = (number, None, {'playlist': _error_messages(error)})
+                continue
+
+            try:
+                coordinates = _json(row['coordinates']) if row.get('coordinates') else [row.get('lng'), row.get('lat')]
+                lng, lat = float(coordinates[0]), float(coordinates[1])
+                images = _json(row.get('images')) or []
+            except (TypeError, ValueError, IndexError):
+                results[offset] = (number, None, {'coordinates': ['invalid coordinates or images']})
+                continue
+
+            musicmap = MusicMaps(
+                id=first_id + offset,
+                images=[{'image': image} for image in images],
+                content=row.get('content') or '',
+                open_range=row.get('open_range'),
+                comments_on=row.get('comments_on', True) not in (False, 'false', 'False', '0', 0),
+                author_id=author_id,
+                location={'type': 'Point', 'coordinates': [lng, lat]},
+                street_address=row.get('street_address') or '',
+                building_number=row.get('building_number') or '',
+                geohash=geo.encode(lng, lat, geo.geo_settings()['GEOHASH_PRECISION']),
+            )
+            if row.get('date_created'):
+                musicmap.date_created = musicmap.date_updated = row['date_created']
+            try:
+                if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+                    raise ValidationError({'coordinates': ['coordinates must be [lng, lat]']})
+                musicmap.full_clean(exclude=(
+                    'author', 'images', 'location', 'memorize_users', 'comments', 'playlist'
+                ), validate_unique=False)
+            except ValidationError as error:
+                results[offset] = (number, None, _error_messages(error))
+                continue
+            valid.append((offset, number, musicmap, playlist))
+
+        # 검증을 통과한 행의 곡만 카탈로그에 만든다. (버려지는 행의 곡이 참조 없는 Music 으로 남지 않도록)
+        tracks = [track for _, _, _, playlist in valid for track in playlist]
+        musics = iter(catalog.upsert_tracks(tracks) if tracks else ())
+        conf = search.search_settings()
+        for offset, number, musicmap, playlist in valid:
+            playlist = [next(musics) for _ in playlist]
+            musicmap.set_playlist(playlist)
+            # MusicMaps.save() 를 거치지 않으므로 검색 term 도 여기서 만든다.
+            for field, terms in search.search_fields(
+                musicmap.content, musicmap.street_address, musicmap.building_number, playlist, conf
+            ).items():
+                setattr(musicmap, field, terms)
+            results[offset] = (number, to_document(musicmap), None)
+        return [results[offset] for offset in sorted(results)]
+
+    def after_write(self, docs, replay=False):
+        from . import tiles, timeline, trending
+
+        search.invalidate()  # 다른 프로세스의 local 역색인이 새 문서를 읽도록
+        timeline.fan_out_documents(docs)  # 지우고 다시 넣으므로 replay 해도 같다.
+        if replay:
+            return True
+        tiles.apply(*((tiles.contribution(doc), 1) for doc in docs))
+        trending.store(docs)
+        return False
+
+    def finish(self, rebuild=False):
+        from . import tiles, trending
+
+        if rebuild:
+            tiles.rebuild()
+            trending.rebuild()
+
+
+class FollowImporter(Importer):
+    """
+    follower(userid), following(userid). $addToSet 이라 다시 실행해도 관계가 중복되지 않는다.
+    """
+    model = User
+    reserve = False
+
+    def prepare(self, rows, first_id):
+        userids = {row.get(key) for _, row in rows for key in ('follower', 'following')}
+        pks = {
+            doc['userid']: doc['id'] for doc in User.objects.mongo_find(
+                {'userid': {'$in': list(userids)}}, {'_id': False, 'id': True, 'userid': True}
+            )
+        }
+
+        results = []
+        for number, row in rows:
+            follower, following = pks.get(row.get('follower')), pks.get(row.get('following'))
+            if follower is None or following is None:
+                results.append((number, None, {'userid': ['unknown userid']}))
+            elif follower == following:
+                results.append((number, None, {'following': ['cannot follow yourself']}))
+            else:
+                results.append((number, (follower, following), None))
+        return results
+
+    def write(self, edges):
+        following = defaultdict(list)
+        followers = defaultdict(list)
+        for follower, target in edges:
+            following[follower].append(target)
+            followers[target].append(follower)
+
+        operations = [
+            UpdateOne({'id': pk}, {'$addToSet': {'following_id': {'$each': targets}}})
+            for pk, targets in following.items()
+        ] + [
+            UpdateOne({'id': pk}, {'$addToSet': {'followers_id': {'$each': sources}}})
+            for pk, sources in followers.items()
+        ]
+        User.objects.mongo_bulk_write(operations, ordered=False)
+        # signal 을 거치지 않았으므로 유저 캐시, 팔로우 집합 캐시를 지우고 응답 version 을 올린다.
+        User.objects.invalidate_cached({'id': {'$in': list(following) + list(followers)}}, follow_sets=True)
+        return len(edges), 0
+
+    def after_write(self, edges, replay=False):
+        from . import timeline
+
+        pks = {pk for edge in edges for pk in edge}
+        # 카운터를 다시 계산하고, 바뀐 카운터가 보이도록 캐시를 다시 지운다. (rebuild_counters -> invalidate_cached)
+        User.objects.rebuild_counters({'id': {'$in': list(pks)}})
+
+        # signals.follow_timeline 과 같이 새로 볼 수 있게 된 MusicMaps 를 채워넣는다. (이미 있는 항목은 건너뛴다)
+        users = User.objects.in_bulk(pks)
+        targets = defaultdict(list)
+        for follower, target in edges:
+            targets[follower].append(users[target])
+        for follower, authors in targets.items():
+            timeline.backfill(users[follower], authors)
+            for author in authors:
+                if author.is_following(users[follower]):
+                    timeline.backfill(author, [users[follower]])
+        return False
+
+
+IMPORTERS = {
+    'users': UserImporter,
+    'music': MusicImporter,
+    'maps': MapImporter,
+    'follows': FollowImporter,
+}
+
+
+def run(importer, rows, checkpoint, chunk_size=1000, on_error=None):
+    """
+    rows 를 chunk_size 씩 가져온다. 묶음이 끝날 때마다 checkpoint 를 저장하고 누적 통계를 반환(yield)한다.
+    """
+    stats = checkpoint.stats
+    rows = (row for index, row in enumerate(rows) if index >= checkpoint.position)
+
+    for chunk in chunked(rows, chunk_size):
+        reserved = checkpoint.reserved
+        if reserved is None or reserved['position'] != checkpoint.position:
+            reserved = checkpoint.reserved = {'position': checkpoint.position, 'first_id': None, 'written': False}
+            if importer.reserve:
+                reserved['first_id'] = reserve_ids(importer.model, len(chunk))
+            checkpoint.save()
+        # 멈췄던 묶음은 같은 pk 로 다시 쓴다.
+
+        counts = defaultdict(int)  # 묶음이 끝나야 stats 에 더한다. (다시 쓸 때 두번 세지 않도록)
+        valid = []
+        for number, row in chunk:
+            if isinstance(row, MalformedRow):
+                counts['invalid'] += 1
+                if on_error is not None:
+                    on_error(number, {'row': [str(row)]})
+            else:
+                valid.append((number, row))
+
+        docs = []
+        for number, doc, errors in importer.prepare(valid, reserved['first_id']) if valid else ():
+            if doc is None:
+                counts['invalid'] += 1
+                if on_error is not None:
+                    on_error(number, errors)
+            else:
+                docs.append(doc)
+
+        if docs:
+            replay = reserved['written']
+            if not replay:
+                reserved['inserted'], reserved['skipped'] = importer.write(docs)
+                reserved['written'] = True
+                checkpoint.save()
+            counts['inserted'] += reserved['inserted']
+            counts['skipped'] += reserved['skipped']
+            if importer.after_write(docs, replay):
+                checkpoint.rebuild = True
+
+        counts['read'] += len(chunk)
+        for key, value in counts.items():
+            stats[key] += value
+        checkpoint.position += len(chunk)
+        checkpoint.reserved = None
+        checkpoint.save()
+        yield stats
+
+    importer.finish(checkpoint.rebuild)
+    if checkpoint.rebuild:
+        checkpoint.rebuild = False
+        checkpoint.save()
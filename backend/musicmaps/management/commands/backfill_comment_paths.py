@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from musicmaps.models import Comment, MusicMaps
+
+
+class Command(BaseCommand):
+    help = 'musicmap/path/depth 가 없는 기존 댓글을 $graphLookup 으로 찾아 materialized path 를 채운다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        comment_collection = Comment._meta.db_table
+        width = Comment.PATH_WIDTH
+
+        pipeline = [
+            {'$match': {'comments_id.0': {'$exists': True}}},
+            {'$project': {'id': True, 'comments_id': True}},
+            {'$graphLookup': {
+                'from': comment_collection,
+                'startWith': '$comments_id',
+                'connectFromField': 'comments_id',
+                'connectToField': 'id',
+                'as': 'thread',
+            }},
+        ]
+
+        updated = 0
+        for musicmap in MusicMaps.objects.mongo_aggregate(pipeline, allowDiskUse=True, batchSize=options['batch_size']):
+            nodes = {node['id']: node for node in musicmap['thread']}
+            paths = {}
+
+            stack = [(pk, '', 0) for pk in musicmap['comments_id']]
+            while stack:
+                pk, parent_path, depth = stack.pop()
+                if pk not in nodes or pk in paths:
+                    continue
+                path = '%s/%s' % (parent_path, str(pk).zfill(width)) if parent_path else str(pk).zfill(width)
+                paths[pk] = (path, depth)
+                stack.extend((child, path, depth + 1) for child in nodes[pk].get('comments_id') or ())
+
+            operations = [
+                UpdateOne({'id': pk}, {'$set': {'musicmap_id': musicmap['id'], 'path': path, 'depth': depth}})
+                for pk, (path, depth) in paths.items()
+            ]
+            if operations:
+                updated += Comment.objects.mongo_bulk_write(operations, ordered=False).modified_count
+
+        self.stdout.write(self.style.SUCCESS('%d comments updated.' % updated))
@@ -0,0 +1,119 @@
+import datetime
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from backend import benchmark
+
+
+class Command(BaseCommand):
+    help = '벤치마크 데이터를 만들고 accounts/musicmaps 엔드포인트의 지연시간, 처리량, DB 왕복 횟수를 JSON 으로 출력한다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='실행할 시나리오 (기본: 전체) %s' % ', '.join(benchmark.SCENARIOS))
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follow-density', type=float, default=0.02, help='유저마다 팔로우할 다른 유저의 비율')
+        parser.add_argument('--maps', type=int, default=5000)
+        parser.add_argument('--tracks', type=int, default=200)
+        parser.add_argument('--spread', type=int, default=5000, help='MusicMaps 를 흩어 놓을 반경(m)')
+        parser.add_argument('--requests', type=int, default=500, help='시나리오별 요청 수')
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=0, help='난수 seed. 같은 값이면 같은 데이터와 요청을 만든다.')
+        parser.add_argument('--prefix', default='bench', help='벤치마크 데이터 표시(userid 접두사)')
+        parser.add_argument('--reuse', action='store_true', help='이미 만든 벤치마크 데이터를 그대로 사용')
+        parser.add_argument('--keep', action='store_true', help='끝난 뒤 벤치마크 데이터베이스를 지우지 않음 (--reuse 로 다시 사용)')
+        parser.add_argument('--database-name', help='벤치마크 전용 데이터베이스 이름 (기본: <NAME>_benchmark)')
+        parser.add_argument('--mongomock', action='store_true', help='MongoDB 대신 mongomock 사용 (왕복 횟수 측정 안됨)')
+        parser.add_argument('--output', help='결과 JSON 파일 경로 (기본: stdout)')
+        parser.add_argument('--baseline', help='비교할 이전 결과 JSON. 나빠진 지표가 있으면 실패한다.')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='baseline 대비 허용 비율')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(benchmark.SCENARIOS)
+        unknown = [name for name in names if name not in benchmark.SCENARIOS]
+        if unknown:
+            raise CommandError('Unknown scenarios: %s' % ', '.join(unknown))
+
+        if options['mongomock']:
+            benchmark.use_mongomock()
+            counter = None
+        else:
+            counter = benchmark.install_counter()
+
+        keepdb = options['keep'] or options['reuse']
+        old_name = benchmark.setup_database(options['database_name'], keepdb=keepdb)
+        try:
+            self.run_benchmark(names, options, counter)
+        finally:
+            benchmark.teardown_database(old_name, keepdb=keepdb)
+
+    def run_benchmark(self, names, options, counter):
+        prefix = options['prefix']
+        if options['reuse']:
+            dataset = benchmark.Dataset.load(prefix, spread_m=options['spread'])
+            if not dataset.users:
+                raise CommandError('No benchmark users with prefix "%s".' % prefix)
+        else:
+            benchmark.cleanup(prefix)
+            self.stderr.write('Seeding %d users, %d maps...' % (options['users'], options['maps']))
+            dataset = benchmark.seed(
+                prefix=prefix,
+                users=options['users'],
+                follow_density=options['follow_density'],
+                maps=options['maps'],
+                tracks=options['tracks'],
+                spread_m=options['spread'],
+                random_seed=options['seed'],
+            )
+
+        setup_test_environment()
+        try:
+            runner = benchmark.Runner(
+                dataset,
+                concurrency=options['concurrency'],
+                requests=options['requests'],
+                warmup=options['warmup'],
+                random_seed=options['seed'],
+                counter=counter,
+            )
+            scenarios = {}
+            for name in names:
+                self.stderr.write('Running %s...' % name)
+                scenarios[name] = runner.run(benchmark.SCENARIOS[name])
+        finally:
+            teardown_test_environment()
+
+        result = {
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': 'mongomock' if options['mongomock'] else 'mongodb',
+            'dataset': {
+                'users': len(dataset.users),
+                'follow_density': options['follow_density'],
+                'maps': len(dataset.musicmaps),
+                'seed': options['seed'],
+            },
+            'settings': benchmark.environment(),
+            'scenarios': scenarios,
+        }
+
+        regressions = []
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = benchmark.compare(result, json.load(baseline), options['tolerance'])
+            result['regressions'] = regressions
+
+        output = json.dumps(result, indent=2, ensure_ascii=False, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if regressions:
+            raise CommandError('%d regressions against %s' % (len(regressions), options['baseline']))
@@ -0,0 +1,75 @@
+import datetime
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend import benchmark
+
+
+class Command(BaseCommand):
+    help = 'UserSerializerWithToken, MusicMapSerializer 응답을 renderer/parser 별로 직렬화하는 시간과 크기를 JSON 으로 출력한다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('renderers', nargs='*', help='비교할 renderer (기본: 전체, 첫 항목이 기준) %s' % ', '.join(benchmark.RENDERERS))
+        parser.add_argument('--users', type=int, default=200, help='유저 목록 payload 의 유저 수')
+        parser.add_argument('--maps', type=int, default=500, help='MusicMaps 목록 payload 의 MusicMaps 수')
+        parser.add_argument('--repeats', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='bench', help='벤치마크 데이터 표시(userid 접두사)')
+        parser.add_argument('--reuse', action='store_true', help='이미 만든 벤치마크 데이터를 그대로 사용')
+        parser.add_argument('--keep', action='store_true', help='끝난 뒤 벤치마크 데이터베이스를 지우지 않음')
+        parser.add_argument('--database-name', help='벤치마크 전용 데이터베이스 이름 (기본: <NAME>_benchmark)')
+        parser.add_argument('--mongomock', action='store_true', help='MongoDB 대신 mongomock 사용')
+        parser.add_argument('--output', help='결과 JSON 파일 경로 (기본: stdout)')
+
+    def handle(self, *args, **options):
+        names = options['renderers'] or list(benchmark.RENDERERS)
+        unknown = [name for name in names if name not in benchmark.RENDERERS]
+        if unknown:
+            raise CommandError('Unknown renderers: %s' % ', '.join(unknown))
+
+        if options['mongomock']:
+            benchmark.use_mongomock()
+
+        keepdb = options['keep'] or options['reuse']
+        old_name = benchmark.setup_database(options['database_name'], keepdb=keepdb)
+        try:
+            self.run_benchmark(names, options)
+        finally:
+            benchmark.teardown_database(old_name, keepdb=keepdb)
+
+    def run_benchmark(self, names, options):
+        prefix = options['prefix']
+        if options['reuse']:
+            dataset = benchmark.Dataset.load(prefix)
+            if not dataset.users:
+                raise CommandError('No benchmark users with prefix "%s".' % prefix)
+        else:
+            benchmark.cleanup(prefix)
+            self.stderr.write('Seeding %d users, %d maps...' % (options['users'], options['maps']))
+            dataset = benchmark.seed(
+                prefix=prefix,
+                users=options['users'],
+                follow_density=0,
+                maps=options['maps'],
+                random_seed=options['seed'],
+            )
+
+        payloads = benchmark.renderer_payloads(dataset, options['users'], options['maps'])
+        results = benchmark.benchmark_renderers(payloads, names, options['repeats'])
+
+        result = {
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'payloads': {name: len(data) for name, data in payloads.items()},
+            'repeats': options['repeats'],
+            'results': results,
+        }
+
+        output = json.dumps(result, indent=2, ensure_ascii=False, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,52 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from musicmaps import importer
+
+
+class Command(BaseCommand):
+    help = 'NDJSON/CSV 파일의 users, music, maps, follows 를 묶음 단위로 가져온다. 멈춘 곳부터 다시 실행할 수 있다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(importer.IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('ndjson', 'csv'), help='기본: 확장자로 판단')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--checkpoint', help='checkpoint 파일 (기본: <path>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='checkpoint 를 무시하고 처음부터 가져온다.')
+        parser.add_argument('--errors', help='검증에 실패한 행을 NDJSON 으로 남길 파일')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        checkpoint_path = options['checkpoint'] or path + '.checkpoint'
+        if options['restart']:
+            checkpoint = importer.Checkpoint(None)
+            checkpoint.path = checkpoint_path
+        else:
+            checkpoint = importer.Checkpoint(checkpoint_path)
+            if checkpoint.position:
+                self.stderr.write('Resuming %s from row %d' % (path, checkpoint.position))
+
+        errors = open(options['errors'], 'a') if options['errors'] else None
+
+        def on_error(number, messages):
+            if errors is not None:
+                errors.write(json.dumps({'line': number, 'errors': messages}, ensure_ascii=False) + '\n')
+
+        try:
+            rows = importer.read_rows(path, options['format'])
+            for stats in importer.run(
+                importer.IMPORTERS[options['kind']](), rows, checkpoint, options['chunk_size'], on_error
+            ):
+                self.stderr.write('\r%(read)d read, %(inserted)d inserted, %(skipped)d skipped, %(invalid)d invalid' % stats, ending='')
+                sys.stderr.flush()
+        except (OSError, ValueError, RuntimeError) as error:
+            raise CommandError(error)
+        finally:
+            if errors is not None:
+                errors.close()
+
+        self.stderr.write('')
+        self.stdout.write(self.style.SUCCESS('Imported %s: %s' % (options['kind'], json.dumps(checkpoint.stats, sort_keys=True))))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from musicmaps import suggestions
+
+
+class Command(BaseCommand):
+    help = '팔로우 그래프와 MusicMaps 지역으로 유저별 팔로우 추천을 계산한다. (numpy, scipy 필요)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help='stale 로 표시되었거나 계산되지 않은 유저만 다시 계산')
+
+    def handle(self, *args, **options):
+        try:
+            import numpy  # noqa: F401
+            import scipy  # noqa: F401
+        except ImportError:
+            raise CommandError('compute_suggestions requires numpy and scipy.')
+
+        count = suggestions.refresh(incremental=options['incremental'])
+        self.stdout.write(self.style.SUCCESS('Suggestions computed for %d users.' % count))
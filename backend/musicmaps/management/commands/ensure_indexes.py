@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from musicmaps.models import MusicMaps, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'djongo 가 만들지 못하는 MongoDB 인덱스(2dsphere 등)를 생성한다.'
+
+    def handle(self, *args, **options):
+        MusicMaps.objects.ensure_indexes()
+        TimelineEntry.objects.ensure_indexes()
+        self.stdout.write(self.style.SUCCESS('MusicMaps indexes ensured.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from musicmaps.models import MusicMaps
+
+
+class Command(BaseCommand):
+    help = '팔로워/팔로잉/memorize/댓글 카운터를 배열 길이로부터 일괄 재계산한다. (한쪽에만 남은 팔로우 관계도 고친다)'
+
+    def handle(self, *args, **options):
+        result = User.objects.rebuild_counters()
+        self.stdout.write('users: %d updated' % result.modified_count)
+
+        result = MusicMaps.objects.rebuild_counters()
+        self.stdout.write('musicmaps: %d updated' % result.modified_count)
+
+        self.stdout.write(self.style.SUCCESS('Counters rebuilt.'))
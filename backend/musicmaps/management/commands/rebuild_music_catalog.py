@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateMany, UpdateOne
+
+from musicmaps import catalog
+from musicmaps.models import Music, MusicMaps
+
+
+class Command(BaseCommand):
+    help = '기존 Music 의 identity 를 계산하고 중복 곡을 하나로 합친다. (플레이리스트 참조도 함께 바꾼다)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        cursor = Music.objects.mongo_find({}, {'id': True, 'artists': True, 'album': True, 'name': True, 'track_number': True})
+
+        canonical = {}  # identity -> 가장 작은 pk
+        duplicates = {}  # 중복 pk -> canonical pk
+        for doc in cursor.sort('id', 1).batch_size(batch_size):
+            identity = catalog.track_identity(doc.get('artists'), doc.get('album'), doc.get('name'), doc.get('track_number'))
+            if identity in canonical:
+                duplicates[doc['id']] = canonical[identity]
+            else:
+                canonical[identity] = doc['id']
+
+        remapped = 0
+        items = list(duplicates.items())
+        for start in range(0, len(items), batch_size):
+            requests = []
+            for duplicate, target in items[start:start + batch_size]:
+                # 중복 pk 를 canonical pk 로 바꾼다. ($addToSet 후 $pull, 한 문서에 같은 경로를 동시에 쓸 수 없으므로 두번)
+                requests.append(UpdateMany({'playlist_id': duplicate}, {'$addToSet': {'playlist_id': target}}))
+                requests.append(UpdateMany({'playlist_id': duplicate}, {'$pull': {'playlist_id': duplicate}}))
+                # 순서 목록은 같은 자리의 값만 바꾼다.
+                requests.append(UpdateMany(
+                    {'playlist_order': duplicate},
+                    {'$set': {'playlist_order.$[track]': target}},
+                    array_filters=[{'track': duplicate}],
+                ))
+            remapped += MusicMaps.objects.mongo_bulk_write(requests, ordered=True).modified_count
+
+        if duplicates:
+            Music.objects.mongo_delete_many({'id': {'$in': list(duplicates)}})
+            catalog.invalidate(*duplicates)
+
+        # identity 는 중복 곡을 지운 뒤에 쓴다. (identity unique 인덱스)
+        items = list(canonical.items())
+        for start in range(0, len(items), batch_size):
+            Music.objects.mongo_bulk_write([
+                UpdateOne({'id': pk}, {'$set': {'identity': identity}}) for identity, pk in items[start:start + batch_size]
+            ], ordered=False)
+
+        self.stdout.write('%d tracks, %d duplicates removed, %d playlist updates' % (
+            len(canonical), len(duplicates), remapped
+        ))
+        self.stdout.write(self.style.SUCCESS('Music catalog rebuilt.'))
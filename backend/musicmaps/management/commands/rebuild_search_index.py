@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from musicmaps import search
+
+
+class Command(BaseCommand):
+    help = '모든 MusicMaps 의 검색 term 을 다시 만든다. (text 인덱스는 ensure_indexes 로 생성)'
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS('Search terms rebuilt for %d MusicMaps.' % count))
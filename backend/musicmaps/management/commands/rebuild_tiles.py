@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from musicmaps import tiles
+
+
+class Command(BaseCommand):
+    help = '모든 MusicMaps 로 지도 타일 클러스터 집계를 다시 만든다.'
+
+    def handle(self, *args, **options):
+        count = tiles.rebuild()
+        self.stdout.write(self.style.SUCCESS('%d tile clusters rebuilt.' % count))
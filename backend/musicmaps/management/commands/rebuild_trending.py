@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from musicmaps import trending
+
+
+class Command(BaseCommand):
+    help = '최근 WINDOW 동안의 전체 공개 MusicMaps 로 지역별 인기 곡/장소 개수를 다시 만든다.'
+
+    def handle(self, *args, **options):
+        count = trending.rebuild()
+        self.stdout.write(self.style.SUCCESS('%d trending buckets rebuilt.' % count))
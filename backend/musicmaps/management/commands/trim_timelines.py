@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from musicmaps import timeline
+from musicmaps.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'MUSICMAPS_TIMELINE["MAX_LENGTH"] 보다 긴 타임라인의 오래된 항목을 지운다.'
+
+    def handle(self, *args, **options):
+        max_length = timeline.timeline_settings()['MAX_LENGTH']
+        owners = TimelineEntry.objects.mongo_aggregate([
+            {'$group': {'_id': '$owner_id', 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': max_length}}},
+        ], allowDiskUse=True)
+
+        trimmed = 0
+        for owner in owners:
+            timeline.trim(owner['_id'])
+            trimmed += 1
+
+        self.stdout.write(self.style.SUCCESS('%d timelines trimmed.' % trimmed))
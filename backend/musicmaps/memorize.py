@@ -0,0 +1,227 @@
+"""
+MusicMaps memorize(좋아요) 쓰기 버퍼
+
+탭할 때마다 memorize_users 배열에 바로 쓰면 인기 있는 MusicMaps 문서 하나에 쓰기가 몰린다.
+대신 (MusicMaps, 유저) 별 마지막 의도(memorize/unmemorize)를 MemorizeIntent 문서 하나에 upsert 하고 응답한다.
+(유저마다 다른 문서라서 한 곳에 쓰기가 몰리지 않는다)
+프로세스는 의도의 key 만 버퍼에 모아두고, FLUSH_INTERVAL 마다 또는 FLUSH_SIZE 개가 쌓이면
+저장된 의도를 읽어 MusicMaps 마다 update 하나로 반영한 뒤 지운다.
+
+- 같은 유저가 여러번 탭해도 마지막 상태만 반영된다. (멱등)
+- update 는 배열의 합집합/차집합과 그 길이로 memorize_count 를 다시 계산하므로,
+  여러 프로세스의 flush 가 섞이거나 같은 의도를 다시 반영해도 카운터가 틀어지지 않는다.
+- 의도는 반영한 뒤 token 이 그대로일 때만 지우므로, 그 사이 다른 요청이 바꾼 의도는 남아서 다시 반영된다.
+- 응답한 의도는 모두 DB 에 있으므로 flush 가 실패하거나 프로세스가 강제 종료되어도 잃지 않는다.
+  RECOVER_AFTER 초 넘게 남아있는 의도(종료된 프로세스의 것)는 다른 프로세스가 RECOVER_INTERVAL 마다 반영한다.
+"""
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import DeleteOne, UpdateOne
+
+from .models import MemorizeIntent, MusicMaps
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORIZE_SETTINGS = {
+    'BUFFERED': True,        # False 면 요청마다 바로 쓴다.
+    'FLUSH_INTERVAL': 0.2,   # 초
+    'FLUSH_SIZE': 500,       # 이만큼 쌓이면 주기를 기다리지 않고 flush
+    'RECOVER_AFTER': 60,     # 이보다 오래 남아있는 의도는 종료된 프로세스의 것으로 보고 반영한다. (초)
+    'RECOVER_INTERVAL': 30,  # 초
+}
+
+INTENT_FIELDS = {'_id': False, 'key': True, 'musicmap': True, 'user': True, 'memorized': True, 'token': True}
+
+
+def memorize_settings():
+    conf = dict(DEFAULT_MEMORIZE_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_MEMORIZE', {}))
+    return conf
+
+
+def _operation(musicmap_pk, adds, removes):
+    return UpdateOne({'id': musicmap_pk}, [
+        {'$set': {'memorize_users_id': {'$setDifference': [
+            {'$setUnion': [{'$ifNull': ['$memorize_users_id', []]}, sorted(adds)]},
+            sorted(removes),
+        ]}}},
+        {'$set': {'memorize_count': {'$size': '$memorize_users_id'}}},
+    ])
+
+
+def apply(intents):
+    """
+    {(musicmap pk, user pk): memorized} 를 MusicMaps 마다 update 하나로 반영한다.
+    """
+    changes = {}
+    for (musicmap_pk, user_pk), memorized in intents.items():
+        adds, removes = changes.setdefault(musicmap_pk, (set(), set()))
+        (adds if memorized else removes).add(user_pk)
+
+    operations = [_operation(musicmap_pk, adds, removes) for musicmap_pk, (adds, removes) in changes.items()]
+    if operations:
+        MusicMaps.objects.mongo_bulk_write(operations, ordered=False)
+
+
+def intent_key(musicmap_pk, user_pk):
+    return '%s/%s' % (musicmap_pk, user_pk)
+
+
+def save_intent(musicmap_pk, user_pk, memorized):
+    """
+    의도를 MemorizeIntent 에 저장한다. 응답하기 전에 호출되어야 한다.
+    """
+    key = intent_key(musicmap_pk, user_pk)
+    MemorizeIntent.objects.mongo_update_one({'key': key}, {'$set': {
+        'musicmap': musicmap_pk,
+        'user': user_pk,
+        'memorized': memorized,
+        'token': uuid.uuid4().hex,
+        'date_updated': timezone.now(),
+    }}, upsert=True)
+    return key
+
+
+def apply_intents(query):
+    """
+    query 에 맞는 저장된 의도를 반영하고, 반영하는 동안 바뀌지 않은 의도를 지운다.
+    """
+    docs = list(MemorizeIntent.objects.mongo_find(query, INTENT_FIELDS))
+    if not docs:
+        return 0
+    apply({(doc['musicmap'], doc['user']): doc['memorized'] for doc in docs})
+    MemorizeIntent.objects.mongo_bulk_write(
+        [DeleteOne({'key': doc['key'], 'token': doc['token']}) for doc in docs], ordered=False
+    )
+    return len(docs)
+
+
+def recover(age=None, batch_size=None):
+    """
+    age 초 넘게 남아있는 의도를 반영한다. (종료된 프로세스가 반영하지 못한 의도)
+    """
+    conf = memorize_settings()
+    age = conf['RECOVER_AFTER'] if age is None else age
+    batch_size = batch_size or conf['FLUSH_SIZE']
+    before = timezone.now() - datetime.timedelta(seconds=age)
+
+    count = 0
+    while True:
+        keys = [doc['key'] for doc in MemorizeIntent.objects.mongo_find(
+            {'date_updated': {'$lt': before}}, {'_id': False, 'key': True}
+        ).sort('date_updated', 1).limit(batch_size)]
+        if not keys:
+            return count
+        applied = apply_intents({'key': {'$in': keys}, 'date_updated': {'$lt': before}})
+        count += applied
+        if not applied:
+            return count
+
+
+class MemorizeBuffer:
+    """
+    이 프로세스가 저장한 의도의 key 모음. 의도 자체는 MemorizeIntent 에 있다.
+    """
+
+    def __init__(self, interval, size, recover_interval):
+        self.interval = interval
+        self.size = size
+        self.recover_interval = recover_interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._recovered = 0.0
+
+    def record(self, key):
+        with self._lock:
+            self._pending.add(key)
+            full = len(self._pending) >= self.size
+        self._ensure_worker()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                keys, self._pending = self._pending, set()
+            if not keys:
+                return 0
+
+            try:
+                return apply_intents({'key': {'$in': sorted(keys)}})
+            except Exception:
+                logger.exception('memorize flush failed, retrying %d intents', len(keys))
+                with self._lock:
+                    self._pending |= keys
+                raise
+
+    def _ensure_worker(self):
+        # fork 된 worker 프로세스에서는 스레드를 새로 띄운다.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='memorize-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass  # 되돌린 key 는 다음 주기에 다시 반영한다.
+
+            if time.monotonic() - self._recovered >= self.recover_interval:
+                self._recovered = time.monotonic()
+                try:
+                    recover()
+                except Exception:
+                    logger.exception('memorize recovery failed')
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                conf = memorize_settings()
+                _buffer = MemorizeBuffer(conf['FLUSH_INTERVAL'], conf['FLUSH_SIZE'], conf['RECOVER_INTERVAL'])
+                atexit.register(_drain)
+    return _buffer
+
+
+def _drain():
+    try:
+        _buffer.flush()
+    except Exception:
+        logger.exception('memorize buffer could not be drained at exit')
+
+
+def set_memorized(musicmap_pk, user_pk, memorized):
+    """
+    BUFFERED 면 의도를 저장만 하고 반영은 버퍼의 flush 에 맡긴다. 반환된 뒤에는 의도가 DB 에 있다.
+    """
+    if memorize_settings()['BUFFERED']:
+        get_buffer().record(save_intent(musicmap_pk, user_pk, memorized))
+    else:
+        apply({(musicmap_pk, user_pk): memorized})
+
@@ -1,6 +1,7 @@
 from django.utils import timezone
 from djongo import models
-from accounts.models import User
+from accounts.models import AtomicFieldsMixin, User
+from . import geo, search
 
 
 class Image(models.Model):
@@ -18,8 +19,9 @@ class IntegerValue(models.Model):
 
 
 class Location(models.Model):
-    type = models.CharField(max_length=100)
-    coordinates = models.ArrayField(IntegerValue)
+    # GeoJSON Point. 2dsphere 인덱스를 사용하기 위해 coordinates 는 [경도, 위도] 순서로 저장한다.
+    type = models.CharField(max_length=100, default='Point')
+    coordinates = models.JSONField()
 
     class Meta:
         abstract = True
@@ -31,6 +33,13 @@ class Music(models.Model):
     album_cover = models.ImageField()
     name = models.CharField(max_length=100)
     album = models.CharField(max_length=100)
+    identity = models.CharField(  # 정규화한 (artists, album, name, track_number) 의 해시 (musicmaps/catalog.py)
+        max_length=40,
+        blank=True,
+        db_index=True
+    )
+
+    objects = models.DjongoManager()
 
 
 class Comment(models.Model):
@@ -43,9 +52,72 @@ class Comment(models.Model):
         to="self",
         on_delete=models.CASCADE
     )
+    musicmap = models.ForeignKey(  # 댓글 스레드 전체를 한번에 읽기 위한 참조
+        'MusicMaps',
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='thread_comments'
+    )
+    path = models.CharField(  # materialized path. 조상 pk 를 0 으로 채워 '/' 로 이은 값
+        max_length=255,
+        blank=True,
+        db_index=True
+    )
+    depth = models.IntegerField(
+        default=0
+    )
+    date_created = models.DateTimeField(
+        default=timezone.now
+    )
+
+    objects = models.DjongoManager()
+
+    PATH_WIDTH = 10
+
+    def make_path(self, parent=None):
+        segment = str(self.pk).zfill(self.PATH_WIDTH)
+        return '%s/%s' % (parent.path, segment) if parent is not None else segment
+
+
+class MusicMapsManager(models.DjongoManager):
+
+    def ensure_indexes(self):
+        """
+        djongo 가 인덱스를 지원하지 않으므로 pymongo 로 직접 생성한다.
+        """
+        self.mongo_create_index([('location', '2dsphere')], name='location_2dsphere')
+        self.mongo_create_index([('geohash', 1)], name='geohash')
+        # 같은 곡은 Music 문서 하나만 둔다. (identity 를 계산하지 않은 예전 문서는 rebuild_music_catalog 로 채운다)
+        Music.objects.mongo_create_index(
+            [('identity', 1)], name='identity', unique=True,
+            partialFilterExpression={'identity': {'$gt': ''}},
+        )
+        self.mongo_create_index([('location', '2dsphere'), ('date_updated', -1), ('id', -1)], name='location_date_updated')
+        Comment.objects.mongo_create_index([('musicmap_id', 1), ('depth', 1), ('path', 1)], name='thread')
+        TileCluster.objects.mongo_create_index([('zoom', 1), ('x', 1), ('y', 1), ('open_range', 1)], name='tile')
+        TrendingBucket.objects.mongo_create_index([('bucket', 1)], name='bucket')
+        MemorizeIntent.objects.mongo_create_index([('date_updated', 1)], name='date_updated')
+        self.mongo_create_index(
+            [('search_%s' % field, 'text') for field in search.FIELDS],
+            name='search_text',
+            default_language='none',  # term 을 이미 나누어 저장하므로 형태소 분석/불용어 처리를 하지 않는다.
+            weights={'search_%s' % field: weight for field, weight in search.search_settings()['WEIGHTS'].items()},
+        )
+
+    def increment_counters(self, pk, **deltas):
+        self.mongo_update_one({'id': pk}, {'$inc': deltas})
 
+    def rebuild_counters(self):
+        """
+        memorize_users, comments 배열의 길이로 카운터를 다시 계산한다.
+        """
+        return self.mongo_update_many({}, [{'$set': {
+            'memorize_count': {'$size': {'$ifNull': ['$memorize_users_id', []]}},
+            'comments_count': {'$size': {'$ifNull': ['$comments_id', []]}},
+        }}])
 
-class MusicMaps(models.Model):
+
+class MusicMaps(AtomicFieldsMixin, models.Model):
     class OpenRange(models.IntegerChoices):
         PUBLIC = 0, 'Public'
         FOLLOW = 1, 'Follow'
@@ -85,26 +157,204 @@ class MusicMaps(models.Model):
         to=Comment,
         on_delete=models.CASCADE
     )
-    playlist = models.ArrayReferenceField(
+    playlist = models.ArrayReferenceField(  # 참조(집합). 순서와 중복은 playlist_order 에 둔다.
         to=Music,
         on_delete=models.CASCADE
     )
+    playlist_order = models.JSONField(  # 플레이리스트 곡 pk 를 게시한 순서 그대로 (중복 포함)
+        default=list,
+        blank=True,
+    )
     street_address = models.CharField(max_length=200)
     building_number = models.CharField(max_length=30)
+    memorize_count = models.IntegerField(  # memorize_users 배열 길이의 비정규화 카운터
+        default=0,
+    )
+    comments_count = models.IntegerField(
+        default=0,
+    )
+    geohash = models.CharField(  # location 의 geohash. 지역 단위 조회와 grid 검색에 사용
+        max_length=12,
+        blank=True,
+        db_index=True,
+    )
+    search_content = models.TextField(  # 검색 term (musicmaps/search.py)
+        blank=True,
+        default='',
+    )
+    search_address = models.TextField(
+        blank=True,
+        default='',
+    )
+    search_tracks = models.TextField(
+        blank=True,
+        default='',
+    )
+
+    objects = MusicMapsManager()
+
+    ATOMIC_FIELDS = ('memorize_users', 'comments', 'memorize_count', 'comments_count')  # memorize.py, add_comment
 
     class Meta:
         ordering = ("date_updated",)
 
-    @property
-    def memorize_count(self):
-        return self.memorize_users.all().count()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 저장할 때 DB 를 다시 읽지 않고 바뀐 값을 알 수 있도록 읽은 시점의 값을 둔다. (검색 term, tiles.previous)
+        if not instance.get_deferred_fields():
+            instance._loaded_values = instance.tracked_values()
+        return instance
+
+    def tracked_values(self):
+        """
+        저장할 때 바뀌었는지 비교하는 값. 문서와 같은 모양이라 tiles.contribution 등에 그대로 넘길 수 있다.
+        """
+        point = geo.point_of(self.location)
+        return {
+            'content': self.content,
+            'street_address': self.street_address,
+            'building_number': self.building_number,
+            'location': {'type': 'Point', 'coordinates': list(point)} if point else None,
+            'open_range': self.open_range,
+            'playlist_id': set(self.playlist_id or ()),
+            'playlist_order': list(self.playlist_order or ()),
+        }
+
+    def save(self, *args, **kwargs):
+        point = geo.point_of(self.location)
+        self.geohash = geo.encode(*point, geo.geo_settings()['GEOHASH_PRECISION']) if point else ''
+
+        # 검색 term 은 곡 정보를 읽어야 하므로(catalog.resolve) 내용, 주소, 플레이리스트가 바뀐 경우에만 만든다.
+        current = self.tracked_values()
+        loaded = getattr(self, '_loaded_values', None)
+        self._search_changed = loaded is None or any(
+            loaded[field] != current[field]
+            for field in ('content', 'street_address', 'building_number', 'playlist_id', 'playlist_order')
+        )
+        if self._search_changed:
+            for field, terms in search.fields_of(self).items():
+                setattr(self, field, terms)
+
+        super().save(*args, **kwargs)
+        if kwargs.get('update_fields') is None:
+            self._loaded_values = current
+
+    def add_comment(self, comment):
+        self.comments.add(comment)
+        MusicMaps.objects.increment_counters(self.pk, comments_count=1)
+
+    def set_playlist(self, musics):
+        self.playlist_order = [music.pk for music in musics]
+        self.playlist_id = set(self.playlist_order)
 
-    @property
-    def comments_count(self):
-        return self.comments.all().count()
 
+def playlist_pks(musicmap):
+    """
+    MusicMaps (인스턴스 또는 문서) 의 플레이리스트 곡 pk 목록. 저장한 순서 그대로이고 중복을 포함한다.
+    playlist_order 가 없는 예전 문서는 참조 배열을 pk 순서로 반환한다.
+    """
+    if isinstance(musicmap, dict):
+        order, pks = musicmap.get('playlist_order'), musicmap.get('playlist_id')
+    else:
+        order, pks = musicmap.playlist_order, musicmap.playlist_id
+    return list(order) if order else sorted(pks or ())
+
+
+class TimelineEntryManager(models.DjongoManager):
+
+    def ensure_indexes(self):
+        self.mongo_create_index(
+            [('owner_id', 1), ('date_created', -1), ('id', -1)],
+            name='owner_date_created',
+        )
+        self.mongo_create_index([('owner_id', 1), ('author_id', 1)], name='owner_author')
+
+
+class TimelineEntry(models.Model):
+    """
+    팔로우한 유저의 MusicMaps 를 작성 시점에 미리 펼쳐둔 홈 타임라인 (fan-out-on-write)
+    """
+    owner = models.ForeignKey(  # 타임라인 주인
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    musicmap = models.ForeignKey(
+        MusicMaps,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    open_range = models.IntegerField(
+        choices=MusicMaps.OpenRange.choices
+    )
+    date_created = models.DateTimeField()
+
+    objects = TimelineEntryManager()
+
+    class Meta:
+        ordering = ('-date_created',)
+
+
+class MemorizeIntent(models.Model):
+    """
+    아직 MusicMaps 에 반영되지 않은 memorize 의도 (musicmaps/memorize.py)
+    응답하기 전에 저장되고, MusicMaps 에 반영된 뒤 지워진다.
+    """
+    key = models.CharField(  # "musicmap/user"
+        max_length=32,
+        primary_key=True
+    )
+    musicmap = models.IntegerField()
+    user = models.IntegerField()
+    memorized = models.BooleanField()
+    token = models.CharField(max_length=32)  # 저장할 때마다 새로 만든다. 반영한 의도와 같을 때만 지운다.
+    date_updated = models.DateTimeField()
+
+    objects = models.DjongoManager()
+
+
+class TileCluster(models.Model):
+    """
+    지도 타일(z/x/y) 안의 MusicMaps 클러스터 집계 (musicmaps/tiles.py)
+    MusicMaps 가 생성/삭제될 때 $inc 로 갱신된다.
+    """
+    key = models.CharField(  # "z/x/y/cell/open_range"
+        max_length=64,
+        primary_key=True
+    )
+    zoom = models.IntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    cell = models.IntegerField()  # 타일을 GRID x GRID 로 나눈 칸 번호
+    open_range = models.IntegerField(
+        choices=MusicMaps.OpenRange.choices
+    )
+    count = models.IntegerField(default=0)
+    sum_lng = models.FloatField(default=0)
+    sum_lat = models.FloatField(default=0)
+    tracks = models.JSONField(default=dict)  # Music pk -> 클러스터 안에서 플레이리스트에 담긴 횟수
+
+    objects = models.DjongoManager()
+
+
+class TrendingBucket(models.Model):
+    """
+    지역(geohash prefix) x 시간 bucket 별로 새로 게시된 전체 공개 MusicMaps 의 곡/장소 수 (musicmaps/trending.py)
+    프로세스마다 모아둔 증가분을 $inc 로 더한다.
+    """
+    key = models.CharField(  # "region/bucket"
+        max_length=32,
+        primary_key=True
+    )
+    region = models.CharField(max_length=12)  # geohash prefix, 전체는 "*"
+    bucket = models.IntegerField()  # unix time // BUCKET
+    tracks = models.JSONField(default=dict)  # Music pk -> 플레이리스트에 담긴 횟수
+    places = models.JSONField(default=dict)  # geohash (PLACE_PRECISION) -> MusicMaps 수
 
-    #     indexes = [
-    #         TwoDSphereIndex(fields=['location'])
-    #     ] optimization for search by location
-    # if service going to be heavy Use this code and
+    objects = models.DjongoManager()
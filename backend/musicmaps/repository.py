@@ -0,0 +1,110 @@
+"""
+musicmaps 읽기 repository
+
+주변 MusicMaps 조회를 djongo 를 거치지 않고 pymongo 로 실행한다.
+위치 검색, projection, 공개 범위 판정에 필요한 필드를 한번에 읽고,
+플레이리스트는 조회된 모든 MusicMaps 의 곡을 $in 한번으로 가져와 붙인다.
+
+settings.READ_REPOSITORY_ENDPOINTS 에 'nearby' 를 넣으면 MusicMapsList 가 사용한다.
+"""
+from accounts.repository import enabled  # noqa: F401
+
+from . import geo
+from .models import Music, MusicMaps, playlist_pks
+
+MAP_PROJECTION = {
+    '_id': False,
+    'id': True,
+    'images': True,
+    'content': True,
+    'location': True,
+    'street_address': True,
+    'building_number': True,
+    'open_range': True,
+    'date_updated': True,
+    'playlist_id': True,
+    'playlist_order': True,
+    'author_id': True,
+}
+
+MUSIC_PROJECTION = {
+    '_id': False,
+    'id': True,
+    'track_number': True,
+    'artists': True,
+    'album_cover': True,
+    'name': True,
+    'album': True,
+}
+
+
+def near_query(lng, lat, radius_m, visibility=None):
+    return geo.near_query(lng, lat, radius_m, visibility.mongo_filter() if visibility is not None else None)
+
+
+def playlist_ids(docs):
+    music_ids = set()
+    for doc in docs:
+        music_ids.update(playlist_pks(doc))
+    return list(music_ids)
+
+
+def attach_playlists(docs, musics):
+    musics = {music['id']: music for music in musics}
+    for doc in docs:
+        doc['playlist'] = [musics[pk] for pk in playlist_pks(doc) if pk in musics]
+    return docs
+
+
+class MusicMapsRepository:
+
+    def __init__(self, manager=None, music_manager=None):
+        self.manager = manager or MusicMaps.objects
+        self.music_manager = music_manager or Music.objects
+
+    def nearby(self, lng, lat, radius_m, limit=None, visibility=None):
+        conf = geo.geo_settings()
+        limit = min(limit or conf['MAX_RESULTS'], conf['MAX_RESULTS'])
+
+        if conf['BACKEND'] == 'grid':
+            pks = geo.maps_near(lng, lat, radius_m, limit, visibility)
+            found = {doc['id']: doc for doc in self.manager.mongo_find({'id': {'$in': pks}}, MAP_PROJECTION)}
+            docs = [found[pk] for pk in pks if pk in found]
+        else:
+            # 공개 범위 조건을 위치 검색에 합쳐서 limit 개를 채운다.
+            docs = list(self.manager.mongo_find(near_query(lng, lat, radius_m, visibility), MAP_PROJECTION).limit(limit))
+
+        return self.attach_playlists(docs)
+
+    def attach_playlists(self, docs):
+        music_ids = playlist_ids(docs)
+        musics = self.music_manager.mongo_find({'id': {'$in': music_ids}}, MUSIC_PROJECTION) if music_ids else []
+        return attach_playlists(docs, musics)
+
+
+class AsyncMusicMapsRepository:
+    """
+    MusicMapsRepository.nearby 의 motor(비동기 드라이버) 버전. 2dsphere 인덱스가 필요하다.
+    """
+
+    def __init__(self, collection, music_collection):
+        self.collection = collection
+        self.music_collection = music_collection
+
+    async def near(self, lng, lat, radius_m, limit=None, visibility=None):
+        conf = geo.geo_settings()
+        limit = min(limit or conf['MAX_RESULTS'], conf['MAX_RESULTS'])
+
+        cursor = self.collection.find(near_query(lng, lat, radius_m, visibility), MAP_PROJECTION).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def attach_playlists(self, docs):
+        music_ids = playlist_ids(docs)
+        musics = []
+        if music_ids:
+            musics = await self.music_collection.find({'id': {'$in': music_ids}}, MUSIC_PROJECTION).to_list(length=None)
+        return attach_playlists(docs, musics)
+
+    async def nearby(self, lng, lat, radius_m, limit=None, visibility=None):
+        docs = await self.near(lng, lat, radius_m, limit, visibility)
+        return await self.attach_playlists(docs)
@@ -0,0 +1,413 @@
+"""
+MusicMaps 전문 검색
+
+MusicMaps 의 내용(content), 주소(street_address, building_number), 플레이리스트 곡(name, artists, album)을
+검색어 단위(term)로 나누어 search_content, search_address, search_tracks 에 공백으로 이어 저장한다.
+한글은 형태소 분석 없이 음절 n-gram (문서: 1-gram + 2-gram, 검색어: 2-gram) 으로,
+영문/숫자는 단어의 앞부분(edge n-gram) 으로 나누므로 "서울역" 이 "서울역사" 에, "beat" 가 "beatles" 에 걸린다.
+
+MongoDB 에서는 세 필드에 가중치를 준 text 인덱스(default_language 'none')로 검색하고 textScore 순으로 정렬한다.
+text 인덱스를 쓸 수 없는 환경(mongomock 등)에서는 프로세스 내부 역색인(BM25)을 사용한다.
+term 은 MusicMaps.save() 에서 내용, 주소, 플레이리스트가 바뀐 경우에만 만들고, 역색인은 signal 로 갱신한다.
+
+프로세스 내부 역색인은 다른 프로세스의 쓰기를 모르므로, 쓰기마다 DB 의 공유 version 을 올리고
+그 version 번호로 바뀐 문서의 (pk, term) delta 를 남긴다. 각 프로세스는 SYNC_INTERVAL 마다 version 을 확인해서
+밀린 delta 만 역색인에 반영하고, delta 가 너무 많이 밀렸거나 빠졌을 때, 전체 재색인(rebuild, bulk import) 이후에만
+역색인을 다시 읽는다.
+"""
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+from pymongo import ReturnDocument, UpdateOne
+
+from .db import database
+
+DEFAULT_SEARCH_SETTINGS = {
+    'BACKEND': 'mongo',      # 'mongo' (text 인덱스) 또는 'local' (프로세스 내부 역색인)
+    'WEIGHTS': {             # 필드별 가중치
+        'content': 1,
+        'address': 2,
+        'tracks': 3,
+    },
+    'MIN_PREFIX': 2,         # 영문/숫자 단어를 나눌 때 가장 짧은 앞부분 길이
+    'MAX_PREFIX': 15,        # 이보다 긴 단어는 이 길이까지만 나눈다.
+    'MAX_QUERY_TERMS': 16,
+    'BATCH_SIZE': 1000,
+    'SYNC_INTERVAL': 1.0,    # local 역색인이 다른 프로세스의 쓰기를 확인하는 주기(초)
+    'MAX_DELTAS': 1000,      # 이보다 많이 밀리면 delta 를 반영하지 않고 역색인을 다시 읽는다. (이보다 오래된 delta 는 지운다)
+}
+
+FIELDS = ('content', 'address', 'tracks')
+
+STATE_COLLECTION = 'musicmaps_search_state'
+DELTA_COLLECTION = 'musicmaps_search_deltas'
+
+_RUN = re.compile(r'[가-힣]+|[^\W_가-힣]+')
+
+# BM25 파라미터 (local 역색인)
+K1 = 1.2
+B = 0.75
+
+
+def search_settings():
+    conf = dict(DEFAULT_SEARCH_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_SEARCH', {}))
+    return conf
+
+
+def _runs(text):
+    """
+    한글 음절 묶음과 그 외 단어 문자 묶음으로 나눈다. ("홍대입구역 2번출구" -> ["홍대입구역", "2", "번출구"])
+    """
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return _RUN.findall(text)
+
+
+def _is_hangul(run):
+    return '가' <= run[0] <= '힣'
+
+
+def document_terms(text, conf=None):
+    conf = conf or search_settings()
+    terms = []
+    for run in _runs(text):
+        if _is_hangul(run):
+            terms.extend(run)
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif len(run) < conf['MIN_PREFIX']:
+            terms.append(run)
+        else:
+            terms.extend(run[:end] for end in range(conf['MIN_PREFIX'], min(len(run), conf['MAX_PREFIX']) + 1))
+    return terms
+
+
+def query_terms(text, conf=None):
+    """
+    검색어의 term 목록 (중복 제거, 순서 유지)
+    """
+    conf = conf or search_settings()
+    terms = []
+    for run in _runs(text):
+        if _is_hangul(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif _is_hangul(run) or len(run) < conf['MIN_PREFIX']:
+            terms.append(run)
+        else:
+            terms.append(run[:conf['MAX_PREFIX']])
+    return list(dict.fromkeys(terms))[:conf['MAX_QUERY_TERMS']]
+
+
+def search_fields(content, street_address, building_number, musics, conf=None):
+    """
+    MusicMaps 에 저장할 {'search_content', 'search_address', 'search_tracks'}
+    """
+    conf = conf or search_settings()
+    tracks = ' '.join('%s %s %s' % (music.name, music.artists, music.album) for music in musics)
+    texts = {
+        'content': content,
+        'address': '%s %s' % (street_address or '', building_number or ''),
+        'tracks': tracks,
+    }
+    return {'search_%s' % field: ' '.join(document_terms(texts[field], conf)) for field in FIELDS}
+
+
+def fields_of(musicmap):
+    from . import catalog
+
+    from .models import playlist_pks
+
+    pks = playlist_pks(musicmap)
+    musics = catalog.resolve(set(pks))
+    return search_fields(musicmap.content, musicmap.street_address, musicmap.building_number, [musics[pk] for pk in pks if pk in musics])
+
+
+class InvertedIndex:
+    """
+    term -> {pk: 가중 빈도} 역색인. 점수는 BM25 (필드 가중치를 빈도에 곱한다).
+    """
+
+    def __init__(self, weights, version=0):
+        self.weights = weights
+        self.version = version  # 마지막으로 반영한 공유 version
+        self.missing = None  # 지난 확인에서 빠져 있던 delta 의 version
+        self.checked = time.monotonic()
+        self._postings = defaultdict(dict)
+        self._terms = {}
+        self._lengths = {}
+        self._total_length = 0.0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._terms)
+
+    def add(self, pk, fields):
+        """
+        fields : search_fields() 의 결과 (또는 같은 키를 가진 문서)
+        """
+        frequencies = defaultdict(float)
+        for field in FIELDS:
+            weight = self.weights.get(field, 1)
+            for term in (fields.get('search_%s' % field) or '').split():
+                frequencies[term] += weight
+
+        with self._lock:
+            self.remove(pk)
+            for term, frequency in frequencies.items():
+                self._postings[term][pk] = frequency
+            self._terms[pk] = tuple(frequencies)
+            self._lengths[pk] = sum(frequencies.values())
+            self._total_length += self._lengths[pk]
+
+    def remove(self, pk):
+        with self._lock:
+            terms = self._terms.pop(pk, None)
+            if terms is None:
+                return
+            for term in terms:
+                postings = self._postings[term]
+                postings.pop(pk, None)
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._lengths.pop(pk)
+
+    def clear(self):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._terms = {}
+            self._lengths = {}
+            self._total_length = 0.0
+
+    def search(self, terms):
+        """
+        [(score, pk)] 점수 내림차순 (같으면 pk 내림차순)
+        """
+        with self._lock:
+            count = len(self._terms)
+            if not count:
+                return []
+            average = self._total_length / count or 1.0
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for pk, frequency in postings.items():
+                    norm = K1 * (1 - B + B * self._lengths[pk] / average)
+                    scores[pk] += idf * frequency * (K1 + 1) / (frequency + norm)
+        return sorted(((score, pk) for pk, score in scores.items()), reverse=True)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _state():
+    return database()[STATE_COLLECTION]
+
+
+def _deltas():
+    return database()[DELTA_COLLECTION]
+
+
+def shared_version():
+    doc = _state().find_one({'_id': 'local'})
+    return doc['version'] if doc else 0
+
+
+def _publish(delta, index=None):
+    """
+    공유 version 을 올리고 그 번호로 delta 를 남긴다. (local backend 에서만)
+    index 는 방금 이 프로세스에서 delta 를 반영한 역색인이다.
+    """
+    conf = search_settings()
+    if conf['BACKEND'] != 'local':
+        return
+    doc = _state().find_one_and_update(
+        {'_id': 'local'}, {'$inc': {'version': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    version = doc['version']
+    _deltas().insert_one(dict(delta, _id=version))
+    if version % 100 == 0:
+        # MAX_DELTAS 보다 오래된 delta 는 어차피 쓰지 않는다. (그만큼 밀린 프로세스는 다시 읽는다)
+        _deltas().delete_many({'_id': {'$lte': version - conf['MAX_DELTAS']}})
+    if index is not None and version == index.version + 1:
+        index.version = version  # 그 사이 다른 프로세스의 쓰기가 없었으므로 반영할 delta 가 없다.
+
+
+def invalidate():
+    """
+    다른 프로세스가 역색인을 다시 읽도록 한다. (rebuild, bulk import 처럼 문서마다 delta 를 남기지 않은 쓰기)
+    """
+    _publish({'reload': True})
+
+
+def _load(conf, version):
+    from .models import MusicMaps
+
+    index = InvertedIndex(conf['WEIGHTS'], version)
+    projection = dict({'_id': False, 'id': True}, **{'search_%s' % field: True for field in FIELDS})
+    for doc in MusicMaps.objects.mongo_find({}, projection).batch_size(conf['BATCH_SIZE']):
+        index.add(doc['id'], doc)
+    return index
+
+
+def _apply_deltas(index, version, conf):
+    """
+    index.version 다음부터 version 까지의 delta 를 순서대로 반영한다. 다시 읽어야 하면 False.
+    """
+    if version - index.version > conf['MAX_DELTAS']:
+        return False
+    for delta in _deltas().find({'_id': {'$gt': index.version, '$lte': version}}).sort('_id', 1):
+        if delta['_id'] != index.version + 1:
+            break
+        if delta.get('reload'):
+            return False
+        if delta.get('fields') is None:
+            index.remove(delta['pk'])
+        else:
+            index.add(delta['pk'], delta['fields'])
+        index.version = delta['_id']
+
+    if index.version < version:
+        # version 을 받고 아직 delta 를 남기지 못한 쓰기일 수 있으므로 한 번은 기다린다.
+        # 다음 확인에도 없으면 (남기기 전에 죽은 프로세스, 지워진 delta) 다시 읽는다.
+        if index.missing == index.version + 1:
+            return False
+        index.missing = index.version + 1
+    return True
+
+
+def get_index():
+    """
+    역색인은 처음 사용할 때 DB 에 저장된 term 으로 채우고, 이 프로세스의 쓰기는 signal 로 갱신한다.
+    SYNC_INTERVAL 마다 공유 version 을 확인해서 다른 프로세스의 쓰기를 delta 로 반영한다.
+    """
+    global _index
+    conf = search_settings()
+    index = _index
+    if index is not None and time.monotonic() - index.checked < conf['SYNC_INTERVAL']:
+        return index
+
+    with _index_lock:
+        index = _index
+        version = shared_version()  # 문서를 읽기 전에 확인해야 읽는 동안의 쓰기를 다음에 알아챈다.
+        if index is not None and (index.version == version or _apply_deltas(index, version, conf)):
+            index.checked = time.monotonic()
+            return index
+        _index = index = _load(conf, version)
+    return index
+
+
+def update_index(musicmap):
+    fields = {'search_%s' % field: getattr(musicmap, 'search_%s' % field) for field in FIELDS}
+    if _index is not None:
+        _index.add(musicmap.pk, fields)
+    _publish({'pk': musicmap.pk, 'fields': fields}, _index)
+
+
+def remove_from_index(pk):
+    if _index is not None:
+        _index.remove(pk)
+    _publish({'pk': pk, 'fields': None}, _index)
+
+
+def parse_position(position):
+    """
+    cursor 의 (score, pk) 를 검사한다. 클라이언트가 보낸 값이므로 숫자가 아니면 ValueError.
+    """
+    score, pk = position
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not math.isfinite(score):
+        raise ValueError('score must be a number')
+    if isinstance(pk, bool) or not isinstance(pk, int):
+        raise ValueError('pk must be an integer')
+    return float(score), pk
+
+
+def _search_mongo(terms, visibility, position, limit):
+    from .models import MusicMaps
+
+    pipeline = [
+        {'$match': {'$text': {'$search': ' '.join(terms)}, **visibility.mongo_filter()}},
+        {'$project': {'_id': False, 'id': True, 'score': {'$meta': 'textScore'}}},
+    ]
+    if position is not None:
+        score, pk = position
+        pipeline.append({'$match': {'$or': [{'score': {'$lt': score}}, {'score': score, 'id': {'$lt': pk}}]}})
+    pipeline += [
+        {'$sort': {'score': -1, 'id': -1}},
+        {'$limit': limit},
+    ]
+    return list(MusicMaps.objects.mongo_aggregate(pipeline))
+
+
+def _search_local(terms, visibility, position, limit):
+    ranked = get_index().search(terms)
+    if position is not None:
+        ranked = [(score, pk) for score, pk in ranked if (score, pk) < tuple(position)]
+
+    results = []
+    # 공개 범위는 (author, open_range) projection 으로 limit 개씩 나누어 판정한다.
+    for start in range(0, len(ranked), limit):
+        chunk = ranked[start:start + limit]
+        visible = set(visibility.visible_pks([pk for _, pk in chunk]))
+        results.extend({'id': pk, 'score': score} for score, pk in chunk if pk in visible)
+        if len(results) >= limit:
+            break
+    return results[:limit]
+
+
+def search(terms, visibility, position=None, limit=20):
+    """
+    관련도순 검색 결과 [{'id', 'score'}]. position 은 마지막으로 받은 (score, pk) 이다.
+    """
+    if not terms:
+        return []
+    if search_settings()['BACKEND'] == 'local':
+        return _search_local(terms, visibility, position, limit)
+    return _search_mongo(terms, visibility, position, limit)
+
+
+def _rebuild_batch(docs, conf):
+    from . import catalog
+    from .models import MusicMaps, playlist_pks
+
+    musics = catalog.resolve({pk for doc in docs for pk in playlist_pks(doc)})
+    operations = []
+    for doc in docs:
+        playlist = [musics[pk] for pk in playlist_pks(doc) if pk in musics]
+        fields = search_fields(doc.get('content'), doc.get('street_address'), doc.get('building_number'), playlist, conf)
+        operations.append(UpdateOne({'id': doc['id']}, {'$set': fields}))
+    MusicMaps.objects.mongo_bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def rebuild():
+    """
+    모든 MusicMaps 의 term 을 다시 만든다. (bulk_import 등 save() 를 거치지 않은 쓰기, 곡 정보 수정 이후)
+    """
+    global _index
+    from .models import MusicMaps
+
+    conf = search_settings()
+    projection = {'_id': False, 'id': True, 'content': True, 'street_address': True, 'building_number': True, 'playlist_id': True, 'playlist_order': True}
+    cursor = MusicMaps.objects.mongo_find({}, projection).batch_size(conf['BATCH_SIZE'])
+
+    count = 0
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= conf['BATCH_SIZE']:
+            count += _rebuild_batch(batch, conf)
+            batch = []
+    if batch:
+        count += _rebuild_batch(batch, conf)
+
+    _index = None
+    invalidate()
+    return count
@@ -1,15 +1,171 @@
 from rest_framework import serializers
 from rest_framework_jwt.settings import api_settings
 from django.conf import settings
-from . import models
+from django.core.files.storage import default_storage
+from backend.images import DerivativeImageField, ImageReferenceField, derivative_urls
+from . import catalog, models
+
+
+def image_urls(images, request=None):
+    urls = []
+    for image in images or ():
+        name = image.get('image') if isinstance(image, dict) else getattr(image, 'image', image)
+        derivatives = derivative_urls(getattr(name, 'name', name), request=request)
+        if derivatives is not None:
+            urls.append(derivatives)
+    return urls
+
+
+class MusicSerializer(serializers.ModelSerializer):
+    album_cover = DerivativeImageField(read_only=True)
+
+    class Meta:
+        model = models.Music
+        fields = (
+            'id',
+            'track_number',
+            'artists',
+            'album_cover',
+            'name',
+            'album'
+        )
+
+
+class MusicMapListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        # 목록 전체의 플레이리스트 곡을 한번에 카탈로그 캐시로 읽어둔다.
+        data = list(data.all() if hasattr(data, 'all') else data)
+        pks = set()
+        for musicmap in data:
+            pks.update(models.playlist_pks(musicmap))
+        catalog.resolve(pks)
+        return super().to_representation(data)
 
 
 class MusicMapSerializer(serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
+    playlist = serializers.SerializerMethodField()
+
     class Meta:
         model = models.MusicMaps
+        list_serializer_class = MusicMapListSerializer
         fields = (
-            '_id',
+            'id',
             'images',
+            'content',
+            'location',
+            'street_address',
+            'building_number',
+            'open_range',
+            'date_updated',
             'playlist',
             'author'
         )
+
+    def get_images(self, obj):
+        return image_urls(obj.images, self.context.get('request'))
+
+    def get_playlist(self, obj):
+        pks = models.playlist_pks(obj)
+        musics = catalog.resolve(set(pks))
+        return MusicSerializer([musics[pk] for pk in pks if pk in musics], many=True, context=self.context).data
+
+
+class TrackSerializer(serializers.Serializer):
+    artists = serializers.CharField(max_length=100)
+    album = serializers.CharField(max_length=100)
+    name = serializers.CharField(max_length=100)
+    track_number = serializers.IntegerField(min_value=0)
+    album_cover = ImageReferenceField(required=False)
+
+
+class ImageUploadSerializer(serializers.Serializer):
+    image = serializers.ImageField()
+
+    def create(self, validated_data):
+        image = validated_data['image']
+        return default_storage.save(image.name, image)
+
+
+class MusicMapCreateSerializer(serializers.Serializer):
+    """
+    이미지는 ImageUploadSerializer 로 먼저 올리고 저장 이름으로 참조하므로 JSON/MessagePack 본문으로 보낼 수 있다.
+    플레이리스트는 보낸 순서대로(중복 포함) 저장된다.
+    """
+    images = serializers.ListField(child=ImageReferenceField(), required=False, default=list)
+    content = serializers.CharField()
+    coordinates = serializers.ListField(child=serializers.FloatField(), min_length=2, max_length=2)
+    street_address = serializers.CharField(max_length=200)
+    building_number = serializers.CharField(max_length=30)
+    open_range = serializers.ChoiceField(choices=models.MusicMaps.OpenRange.choices)
+    comments_on = serializers.BooleanField(default=True)
+    playlist = TrackSerializer(many=True)
+
+    def validate_coordinates(self, value):
+        lng, lat = value
+        if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+            raise serializers.ValidationError('coordinates must be [lng, lat]')
+        return value
+
+    def create(self, validated_data):
+        tracks = catalog.upsert_tracks(validated_data['playlist'])
+        images = [{'image': name} for name in validated_data['images']]
+
+        musicmap = models.MusicMaps(
+            images=images,
+            content=validated_data['content'],
+            location={'type': 'Point', 'coordinates': validated_data['coordinates']},
+            street_address=validated_data['street_address'],
+            building_number=validated_data['building_number'],
+            open_range=validated_data['open_range'],
+            comments_on=validated_data['comments_on'],
+            author=validated_data['author'],
+        )
+        # 플레이리스트를 저장 전에 채워서 insert 한번으로 만든다.
+        musicmap.set_playlist(tracks)
+        musicmap.save()
+        return musicmap
+
+
+class MusicMapDocumentSerializer(serializers.Serializer):
+    """
+    repository 가 반환하는 MusicMaps 문서(dict)용. MusicMapSerializer 와 같은 모양으로 내려준다.
+    """
+    id = serializers.IntegerField()
+    images = serializers.SerializerMethodField()
+    content = serializers.CharField()
+    location = serializers.JSONField()
+    street_address = serializers.CharField()
+    building_number = serializers.CharField()
+    open_range = serializers.IntegerField()
+    date_updated = serializers.DateTimeField()
+    playlist = MusicSerializer(many=True, read_only=True)
+    author = serializers.IntegerField(source='author_id')
+
+    def get_images(self, obj):
+        return image_urls(obj.get('images'), self.context.get('request'))
+
+
+class CommentCreateSerializer(serializers.Serializer):
+    content = serializers.CharField()
+    parent = serializers.IntegerField(required=False, allow_null=True)
+
+
+class CommentThreadSerializer(serializers.ModelSerializer):
+    author = serializers.CharField(source='author_userid', read_only=True)
+    replies = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.Comment
+        fields = (
+            'id',
+            'author',
+            'content',
+            'depth',
+            'date_created',
+            'replies'
+        )
+
+    def get_replies(self, obj):
+        return CommentThreadSerializer(getattr(obj, 'replies', []), many=True, context=self.context).data
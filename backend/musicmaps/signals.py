@@ -0,0 +1,66 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from accounts.models import User
+from accounts.signals import user_followed, user_unfollowed
+
+from . import geo, search, tiles, timeline, trending
+from .models import MusicMaps
+
+
+@receiver(pre_save, sender=MusicMaps)
+def musicmap_saving(sender, instance, update_fields=None, **kwargs):
+    # 수정인 경우 타일 집계에서 뺄 이전 위치/공개 범위/플레이리스트 (DB 에서 읽은 인스턴스는 읽은 시점의 값)
+    instance._tile_previous = tiles.previous(instance) if instance.pk is not None else None
+    if instance.pk is None or (update_fields is not None and 'open_range' not in update_fields):
+        instance._previous_open_range = instance.open_range
+    else:
+        instance._previous_open_range = _previous_open_range(instance)
+
+
+def _previous_open_range(instance):
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is not None:
+        return loaded['open_range']
+    doc = MusicMaps.objects.mongo_find_one({'id': instance.pk}, {'_id': False, 'open_range': True})
+    return doc['open_range'] if doc else None
+
+
+@receiver(post_save, sender=MusicMaps)
+def musicmap_saved(sender, instance, created, **kwargs):
+    geo.update_grid(instance)
+    if getattr(instance, '_search_changed', True):
+        search.update_index(instance)
+    if created:
+        tiles.add(instance)
+        timeline.fan_out(instance)
+        trending.add(instance)
+    else:
+        tiles.update(getattr(instance, '_tile_previous', None), instance)
+        # 공개 범위가 바뀌면 타임라인 항목도 새 범위로 다시 펼친다. (PUBLIC -> PRIVATE 등)
+        if getattr(instance, '_previous_open_range', instance.open_range) != instance.open_range:
+            timeline.refresh(instance)
+
+
+@receiver(post_delete, sender=MusicMaps)
+def musicmap_deleted(sender, instance, **kwargs):
+    geo.remove_from_grid(instance.pk)
+    search.remove_from_index(instance.pk)
+    tiles.remove(instance)
+    timeline.remove(instance.pk)
+    trending.remove(instance)
+
+
+@receiver(user_followed, sender=User)
+def follow_timeline(sender, user, targets, **kwargs):
+    timeline.backfill(user, targets)
+    for target in targets:
+        if target.is_following(user):  # 맞팔로우가 되면 FOLLOW_BACK 항목이 보이게 된다.
+            timeline.backfill(target, [user])
+
+
+@receiver(user_unfollowed, sender=User)
+def unfollow_timeline(sender, user, targets, **kwargs):
+    for target in targets:
+        timeline.revoke(user, target)
+        timeline.revoke(target, user)
@@ -0,0 +1,231 @@
+"""
+팔로우 추천 배치 작업 (python manage.py compute_suggestions)
+
+팔로우 그래프를 CSR 희소 행렬 A (팔로우하는 유저 x 팔로우 대상) 로 읽어서
+A @ A 로 "내가 팔로우하는 유저들이 팔로우하는 유저" 와 그 경로 수(함께 아는 친구 수)를 구한다.
+여기에 MusicMaps 를 남긴 지역(geohash prefix)이 겹치는 수를 더해 점수를 매기고
+유저별 상위 TOP_K 를 FollowSuggestion 에 저장한다. 탐색(ExploreUsers)은 이 결과를 읽기만 한다.
+
+행렬 곱은 BLOCK_SIZE 명씩 나누어 계산하므로 메모리는 블록 크기에 비례한다.
+--incremental 로 실행하면 팔로우 관계가 바뀌어 stale 로 표시된 유저와 아직 계산되지 않은 유저만 다시 계산한다.
+numpy, scipy 는 이 배치 작업에서만 사용한다.
+"""
+from array import array
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from accounts.models import FollowSuggestion, User
+
+from .models import MusicMaps
+
+DEFAULT_SUGGESTION_SETTINGS = {
+    'TOP_K': 20,
+    'BLOCK_SIZE': 2048,
+    'MUTUAL_WEIGHT': 1.0,          # 함께 아는 친구 한 명당 점수
+    'COLOCATION_WEIGHT': 0.5,      # 겹치는 지역 하나당 점수
+    'COLOCATION_PRECISION': 5,     # 지역 단위 geohash 길이 (약 5km)
+    'COLOCATION_CANDIDATES': 200,  # 지역마다 후보로 넣는 유저 수 (그 지역에 MusicMaps 를 가장 많이 남긴 순서)
+    'BATCH_SIZE': 1000,
+}
+
+
+def suggestion_settings():
+    conf = dict(DEFAULT_SUGGESTION_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_SUGGESTIONS', {}))
+    return conf
+
+
+class Graph:
+    """
+    pks : 정렬된 활성 유저 pk 배열 (행렬의 행/열 번호 -> pk)
+    follows : 팔로우 CSR 행렬 (n x n)
+    regions : 유저 x 지역 CSR 행렬 (MusicMaps 를 남긴 지역이면 1)
+    active : regions 에서 지역마다 가장 활발한 COLOCATION_CANDIDATES 명만 남긴 행렬 (같은 지역 후보)
+    """
+
+    def __init__(self, pks, follows, regions, active):
+        self.pks = pks
+        self.follows = follows
+        self.regions = regions
+        self.active = active
+
+
+def load_graph(conf):
+    import numpy as np
+    from scipy import sparse
+
+    pks = array('q')
+    sources = array('q')
+    targets = array('q')
+    cursor = User.objects.mongo_find(
+        {'is_active': {'$ne': False}}, {'_id': False, 'id': True, 'following_id': True}
+    ).sort('id', 1).batch_size(conf['BATCH_SIZE'])
+    for index, doc in enumerate(cursor):
+        pks.append(doc['id'])
+        following = doc.get('following_id') or ()
+        sources.extend([index] * len(following))
+        targets.extend(following)
+
+    pks = np.frombuffer(pks, dtype=np.int64) if pks else np.zeros(0, dtype=np.int64)
+    n = len(pks)
+
+    def indices(values):
+        # pk -> 행 번호. 비활성/삭제된 유저는 -1
+        values = np.frombuffer(values, dtype=np.int64) if values else np.zeros(0, dtype=np.int64)
+        position = np.searchsorted(pks, values)
+        position = np.minimum(position, max(n - 1, 0))
+        found = (pks[position] == values) if n else np.zeros(len(values), dtype=bool)
+        return np.where(found, position, -1)
+
+    sources = np.frombuffer(sources, dtype=np.int64) if sources else np.zeros(0, dtype=np.int64)
+    columns = indices(targets)
+    valid = columns >= 0
+    follows = sparse.csr_matrix(
+        (np.ones(valid.sum(), dtype=np.float32), (sources[valid], columns[valid])), shape=(n, n)
+    )
+    follows.sum_duplicates()
+    follows.data[:] = 1
+
+    authors = array('q')
+    cells = {}
+    region_columns = array('q')
+    precision = conf['COLOCATION_PRECISION']
+    cursor = MusicMaps.objects.mongo_find(
+        {'geohash': {'$nin': ['', None]}}, {'_id': False, 'author_id': True, 'geohash': True}
+    ).batch_size(conf['BATCH_SIZE'])
+    for doc in cursor:
+        authors.append(doc['author_id'])
+        region_columns.append(cells.setdefault(doc['geohash'][:precision], len(cells)))
+
+    rows = indices(authors)
+    region_columns = np.frombuffer(region_columns, dtype=np.int64) if region_columns else np.zeros(0, dtype=np.int64)
+    valid = rows >= 0
+    regions = sparse.csr_matrix(
+        (np.ones(valid.sum(), dtype=np.float32), (rows[valid], region_columns[valid])), shape=(n, max(len(cells), 1))
+    )
+    regions.sum_duplicates()
+
+    # 사람이 많은 지역은 같은 지역 후보가 지역의 유저 수만큼 늘어나므로, MusicMaps 수 상위 유저만 후보로 둔다.
+    counts = regions.tocoo()
+    keep = _top_k(counts.col, counts.data, conf['COLOCATION_CANDIDATES'])
+    active = sparse.csr_matrix(
+        (np.ones(len(keep), dtype=np.float32), (counts.row[keep], counts.col[keep])), shape=regions.shape
+    )
+    regions.data[:] = 1
+
+    return Graph(pks, follows, regions, active)
+
+
+def _candidates(graph, block, conf):
+    """
+    block 행 번호의 후보 (행, 열, 함께 아는 친구 수, 겹치는 지역 수)
+    """
+    import numpy as np
+
+    follows = graph.follows[block]
+    friends_of_friends = (follows @ graph.follows).tocoo()
+    rows, columns, mutual = friends_of_friends.row, friends_of_friends.col, friends_of_friends.data
+
+    # 후보가 TOP_K 보다 적은 유저(팔로우가 거의 없는 신규 유저 등)는 같은 지역의 유저도 후보로 넣는다.
+    counts = np.bincount(rows, minlength=len(block))
+    cold = np.flatnonzero(counts < conf['TOP_K'])
+    if len(cold):
+        nearby = (graph.regions[block[cold]] @ graph.active.T).tocoo()
+        n = len(graph.pks)
+        keys = np.concatenate([rows.astype(np.int64) * n + columns, cold[nearby.row].astype(np.int64) * n + nearby.col])
+        weights = np.concatenate([mutual, np.zeros(len(nearby.row), dtype=mutual.dtype)])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        mutual = np.bincount(inverse, weights=weights, minlength=len(keys))
+        rows, columns = keys // n, keys % n
+
+    # 자기 자신과 이미 팔로우한 유저는 뺀다.
+    keep = columns != block[rows]
+    if len(rows):
+        keep &= np.asarray(follows[rows, columns]).ravel() == 0
+    rows, columns, mutual = rows[keep], columns[keep], mutual[keep]
+
+    shared = np.zeros(len(rows), dtype=np.float32)
+    if len(rows):
+        shared = np.asarray(graph.regions[block[rows]].multiply(graph.regions[columns]).sum(axis=1)).ravel()
+    return rows, columns, mutual, shared
+
+
+def _top_k(rows, scores, k):
+    """
+    행(또는 열 등 묶음 번호)별 점수 상위 k 개의 위치 (행, 점수 내림차순 정렬)
+    """
+    import numpy as np
+
+    order = np.lexsort((-scores, rows))
+    sorted_rows = rows[order]
+    starts = np.searchsorted(sorted_rows, sorted_rows, side='left')
+    rank = np.arange(len(order)) - starts
+    return order[rank < k]
+
+
+def compute(graph, rows=None, conf=None):
+    """
+    rows(행 번호 배열, 기본 전체) 유저의 추천을 블록 단위로 계산한다.
+    {owner pk: [(pk, score)]} 를 블록마다 반환(yield)한다.
+    """
+    import numpy as np
+
+    conf = conf or suggestion_settings()
+    rows = np.arange(len(graph.pks)) if rows is None else np.asarray(rows, dtype=np.int64)
+
+    for start in range(0, len(rows), conf['BLOCK_SIZE']):
+        block = rows[start:start + conf['BLOCK_SIZE']]
+        candidate_rows, columns, mutual, shared = _candidates(graph, block, conf)
+        scores = conf['MUTUAL_WEIGHT'] * mutual + conf['COLOCATION_WEIGHT'] * shared
+        positive = scores > 0
+        candidate_rows, columns, scores = candidate_rows[positive], columns[positive], scores[positive]
+
+        results = {int(graph.pks[row]): [] for row in block}
+        for position in _top_k(candidate_rows, scores, conf['TOP_K']):
+            owner = int(graph.pks[block[candidate_rows[position]]])
+            results[owner].append((int(graph.pks[columns[position]]), round(float(scores[position]), 3)))
+        yield results
+
+
+def store(results):
+    now = timezone.now()
+    operations = [
+        UpdateOne(
+            {'owner_id': owner},
+            {'$set': {
+                'user_ids': [pk for pk, _ in suggestions],
+                'scores': [score for _, score in suggestions],
+                'stale': False,
+                'date_computed': now,
+            }},
+            upsert=True,
+        )
+        for owner, suggestions in results.items()
+    ]
+    if operations:
+        FollowSuggestion.objects.mongo_bulk_write(operations, ordered=False)
+
+
+def refresh(incremental=False, conf=None):
+    """
+    추천을 다시 계산해서 저장한다. 계산한 유저 수를 반환한다.
+    """
+    import numpy as np
+
+    conf = conf or suggestion_settings()
+    graph = load_graph(conf)
+
+    rows = None
+    if incremental:
+        fresh = {
+            doc['owner_id'] for doc in FollowSuggestion.objects.mongo_find({'stale': False}, {'owner_id': True})
+        }
+        rows = np.array([index for index, pk in enumerate(graph.pks) if int(pk) not in fresh], dtype=np.int64)
+
+    count = 0
+    for results in compute(graph, rows, conf):
+        store(results)
+        count += len(results)
+    return count
@@ -1,3 +1,845 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts import cache
+from accounts.models import FollowSuggestion, User
+from accounts.signals import user_followed, user_unfollowed
+from backend.pagination import KeysetPagination
+
+from . import catalog, geo, importer, memorize, search, suggestions, threads, tiles, timeline, trending, views
+from .models import MemorizeIntent, Music, MusicMaps, TimelineEntry
+from .repository import MusicMapsRepository
+from .serializers import MusicMapCreateSerializer, MusicMapDocumentSerializer, MusicMapSerializer
+from .visibility import Visibility
+
+OpenRange = MusicMaps.OpenRange
+
+
+def create_user(userid):
+    return User.objects.create_user(email='%s@test.com' % userid, userid=userid, password='pw', username=userid)
+
+
+def create_map(author, content, open_range=OpenRange.PUBLIC, lng=127.0, lat=37.5, **fields):
+    fields.setdefault('street_address', '서울')
+    fields.setdefault('building_number', '1')
+    fields.setdefault('comments_on', True)
+    return MusicMaps.objects.create(
+        images=[],
+        content=content,
+        open_range=open_range,
+        author=author,
+        location={'type': 'Point', 'coordinates': [lng, lat]},
+        **fields
+    )
+
+
+class MusicMapsRepositoryParityTest(TestCase):
+    """
+    repository(pymongo) 주변 조회가 ORM 조회와 같은 응답을 만드는지 확인한다.
+    """
+
+    def setUp(self):
+        MusicMaps.objects.ensure_indexes()
+        self.author = User.objects.create_user(email='a@test.com', userid='author', password='pw', username='작성자')
+        self.music = Music.objects.create(track_number=1, artists='IU', name='밤편지', album='Palette', album_cover='')
+        for i in range(3):
+            musicmap = MusicMaps.objects.create(
+                images=[],
+                content='map %d' % i,
+                open_range=MusicMaps.OpenRange.PUBLIC,
+                comments_on=True,
+                author=self.author,
+                location={'type': 'Point', 'coordinates': [127.0 + i * 0.001, 37.5]},
+                street_address='서울',
+                building_number=str(i),
+            )
+            musicmap.playlist.add(self.music)
+
+    def test_nearby(self):
+        docs = MusicMapsRepository().nearby(127.0, 37.5, 1000)
+        repo = MusicMapDocumentSerializer(docs, many=True).data
+
+        musicmaps = MusicMaps.objects.in_bulk([doc['id'] for doc in docs])
+        orm = MusicMapSerializer([musicmaps[doc['id']] for doc in docs], many=True).data
+
+        self.assertEqual(len(repo), 3)
+        self.assertEqual([dict(item) for item in orm], [dict(item) for item in repo])
+
+
+class GeoTest(TestCase):
+
+    def setUp(self):
+        geo._grid = None
+        self.author = create_user('author')
+        # 위도 37.5 에서 경도 0.001 도는 약 88m
+        self.maps = [create_map(self.author, 'map %d' % i, lng=127.0 + i * 0.001).pk for i in range(4)]
+
+    def tearDown(self):
+        geo._grid = None
+
+    def test_geohash(self):
+        lng, lat = 127.0276, 37.4979
+        geohash = geo.encode(lng, lat, 9)
+        west, south, east, north = geo.decode_bounds(geohash)
+        self.assertTrue(west <= lng <= east and south <= lat <= north)
+        self.assertTrue(geohash.startswith(geo.encode(lng, lat, 5)))
+        self.assertEqual(MusicMaps.objects.get(pk=self.maps[0]).geohash, geo.encode(127.0, 37.5, 9))
+
+    def test_invalid_query(self):
+        for args in ((200, 0, 100), (0, 100, 100), (127.0, 37.5, -1)):
+            with self.assertRaises(geo.InvalidQuery):
+                geo.maps_near(*args)
+        with self.assertRaises(geo.InvalidQuery):
+            geo.parse_bbox('1,2,3')
+
+    @override_settings(MUSICMAPS_GEO={'BACKEND': 'grid'})
+    def test_grid_near(self):
+        self.assertEqual(geo.maps_near(127.0, 37.5, 150), self.maps[:2])
+        self.assertEqual(geo.maps_near(127.003, 37.5, 100), [self.maps[3], self.maps[2]])
+        self.assertEqual(geo.maps_near(127.0, 37.5, 1000, limit=3), self.maps[:3])
+
+    @override_settings(MUSICMAPS_GEO={'BACKEND': 'grid'})
+    def test_grid_within(self):
+        bbox = (126.9995, 37.499, 127.0015, 37.501)
+        self.assertEqual(sorted(geo.maps_within(bbox)), self.maps[:2])
+
+        # 저장/삭제는 signal 로 grid 에 반영된다.
+        musicmap = MusicMaps.objects.get(pk=self.maps[3])
+        musicmap.location = {'type': 'Point', 'coordinates': [127.001, 37.5005]}
+        musicmap.save()
+        MusicMaps.objects.get(pk=self.maps[0]).delete()
+        self.assertEqual(sorted(geo.maps_within(bbox)), [self.maps[1], self.maps[3]])
+
+    @override_settings(MUSICMAPS_GEO={'BACKEND': 'grid'})
+    def test_within_page(self):
+        bbox = (126.99, 37.49, 127.01, 37.51)
+        first = geo.maps_within_page(bbox, limit=3)
+        last = first[-1]
+        rest = geo.maps_within_page(bbox, position=(last['date_updated'], last['id']), limit=3)
+
+        expected = list(
+            MusicMaps.objects.filter(pk__in=self.maps).order_by('-date_updated', '-pk').values_list('pk', flat=True)
+        )
+        self.assertEqual(len(first), 3)
+        self.assertEqual([doc['id'] for doc in first + rest], expected)
+
+
+class CounterTest(TestCase):
+
+    def test_rebuild_counters(self):
+        author = create_user('author')
+        musicmap = create_map(author, 'map')
+        MusicMaps.objects.mongo_update_one(
+            {'id': musicmap.pk}, {'$set': {'memorize_users_id': [author.pk], 'memorize_count': 5, 'comments_count': 3}}
+        )
+        MusicMaps.objects.rebuild_counters()
+        doc = MusicMaps.objects.mongo_find_one({'id': musicmap.pk}, {'memorize_count': True, 'comments_count': True})
+        self.assertEqual((doc['memorize_count'], doc['comments_count']), (1, 0))
+
+        # 읽어둔 인스턴스를 저장해도 카운터를 덮어쓰지 않는다.
+        musicmap.content = 'edited'
+        musicmap.save()
+        self.assertEqual(MusicMaps.objects.get(pk=musicmap.pk).memorize_count, 1)
+
+
+class TimelineTest(TestCase):
+    """
+    작성 시점의 fan-out, 팔로우할 때의 backfill, 언팔로우할 때의 revoke
+    """
+
+    def setUp(self):
+        TimelineEntry.objects.ensure_indexes()
+        self.author = create_user('author')
+        self.follower = create_user('follower')
+        self.mutual = create_user('mutual')
+        User.objects.follow(self.follower, [self.author])
+        User.objects.follow(self.mutual, [self.author])
+        User.objects.follow(self.author, [self.mutual])
+
+        author = User.objects.get(pk=self.author.pk)
+        start = timezone.now() - datetime.timedelta(hours=1)
+        for index, open_range in enumerate((OpenRange.PUBLIC, OpenRange.FOLLOW, OpenRange.FOLLOW_BACK, OpenRange.PRIVATE)):
+            create_map(author, open_range.label, open_range, date_created=start + datetime.timedelta(minutes=index))
+
+    def contents(self, user):
+        return [musicmap.content for musicmap in timeline.read(User.objects.get(pk=user.pk), limit=100)]
+
+    def test_fan_out(self):
+        self.assertEqual(self.contents(self.author), ['Private', 'Follow Back', 'Follow', 'Public'])
+        self.assertEqual(self.contents(self.mutual), ['Follow Back', 'Follow', 'Public'])
+        self.assertEqual(self.contents(self.follower), ['Follow', 'Public'])
+
+    def test_read_before(self):
+        author = User.objects.get(pk=self.author.pk)
+        first = timeline.read(author, limit=2)
+        rest = timeline.read(author, before=(first[-1].date_created, first[-1].pk), limit=100)
+        self.assertEqual([musicmap.content for musicmap in first + rest], self.contents(self.author))
+
+    def test_backfill_and_revoke(self):
+        viewer = create_user('viewer')
+        author = User.objects.get(pk=self.author.pk)
+        followed = User.objects.follow(viewer, [author])
+        user_followed.send(sender=User, user=viewer, targets=followed)
+        self.assertEqual(self.contents(viewer), ['Follow', 'Public'])
+
+        # 같은 signal 이 다시 와도 항목이 늘지 않는다.
+        user_followed.send(sender=User, user=viewer, targets=followed)
+        self.assertEqual(self.contents(viewer), ['Follow', 'Public'])
+
+        unfollowed = User.objects.unfollow(viewer, [author])
+        user_unfollowed.send(sender=User, user=viewer, targets=unfollowed)
+        self.assertEqual(self.contents(viewer), ['Public'])
+
+
+    def test_open_range_change(self):
+        musicmap = MusicMaps.objects.get(content='Public')
+        musicmap.open_range = OpenRange.PRIVATE
+        musicmap.save()
+        self.assertEqual(self.contents(self.follower), ['Follow'])
+        self.assertEqual(self.contents(self.mutual), ['Follow Back', 'Follow'])
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(musicmap_id=musicmap.pk).values_list('owner_id', 'open_range')),
+            {(self.author.pk, OpenRange.PRIVATE)},
+        )
+
+        musicmap = MusicMaps.objects.get(content='Private')
+        musicmap.open_range = OpenRange.FOLLOW
+        musicmap.save()
+        self.assertEqual(self.contents(self.follower), ['Private', 'Follow'])
+
+    def test_read_checks_current_open_range(self):
+        # signal 을 거치지 않고 바뀐 공개 범위도 조회할 때 걸러진다.
+        MusicMaps.objects.mongo_update_one({'content': 'Follow'}, {'$set': {'open_range': OpenRange.PRIVATE}})
+        self.assertEqual(self.contents(self.follower), ['Public'])
+        self.assertEqual(self.contents(self.author), ['Private', 'Follow Back', 'Follow', 'Public'])
+
+        follower = User.objects.get(pk=self.follower.pk)
+        first = timeline.read(follower, limit=1)
+        self.assertEqual([musicmap.content for musicmap in first], ['Public'])
+
+    def test_fan_out_reads_author_from_db(self):
+        stale = User.objects.get(pk=self.author.pk)
+        viewer = create_user('viewer')
+        User.objects.follow(viewer, [self.author])
+        create_map(stale, 'New', OpenRange.FOLLOW)
+        self.assertEqual(self.contents(viewer), ['New'])
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPagination()
+        for position in (('2020-01-01T00:00:00', 'x'), ('not a date', 1), (None, 1), (['list'], 1)):
+            request = APIRequestFactory().get('/', {'cursor': paginator.encode_cursor(*position)})
+            force_authenticate(request, user=User.objects.get(pk=self.author.pk))
+            response = views.Timeline.as_view()(request)
+            self.assertEqual(response.status_code, 404, position)
+
+
+class VisibilityTest(TestCase):
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        self.maps = {
+            open_range: create_map(self.author, open_range.label, open_range).pk
+            for open_range in (OpenRange.PUBLIC, OpenRange.FOLLOW, OpenRange.FOLLOW_BACK, OpenRange.PRIVATE)
+        }
+
+    def visible(self, visibility):
+        return {pk for open_range, pk in self.maps.items() if visibility.is_visible(self.author.pk, open_range)}
+
+    def assertVisible(self, viewer, open_ranges):
+        visibility = Visibility(User.objects.get(pk=viewer.pk))
+        expected = {self.maps[open_range] for open_range in open_ranges}
+        self.assertEqual(self.visible(visibility), expected)
+        self.assertEqual(set(visibility.visible_pks(list(self.maps.values()))), expected)
+        # MongoDB 조건도 is_visible 과 같아야 한다.
+        docs = MusicMaps.objects.mongo_find({'$and': [{'id': {'$in': list(self.maps.values())}}, visibility.mongo_filter()]})
+        self.assertEqual({doc['id'] for doc in docs}, expected)
+
+    def test_anonymous(self):
+        self.assertEqual(self.visible(Visibility(None)), {self.maps[OpenRange.PUBLIC]})
+
+    def test_relations(self):
+        self.assertVisible(self.viewer, [OpenRange.PUBLIC])
+        User.objects.follow(self.viewer, [self.author])
+        self.assertVisible(self.viewer, [OpenRange.PUBLIC, OpenRange.FOLLOW])
+        User.objects.follow(self.author, [self.viewer])
+        self.assertVisible(self.viewer, [OpenRange.PUBLIC, OpenRange.FOLLOW, OpenRange.FOLLOW_BACK])
+        self.assertVisible(self.author, list(self.maps))
+
+    def test_follow_sets_invalidated(self):
+        # 팔로우/언팔로우하면 캐시된 팔로우 집합을 지우므로 바로 다음 판정에 반영된다.
+        self.assertEqual(cache.get_follow_sets(self.viewer.pk), (set(), set()))
+        User.objects.follow(self.viewer, [self.author])
+        self.assertEqual(cache.get_follow_sets(self.viewer.pk)[1], {self.author.pk})
+        self.assertEqual(cache.get_follow_sets(self.author.pk)[0], {self.viewer.pk})
+        User.objects.unfollow(self.viewer, [self.author])
+        self.assertEqual(cache.get_follow_sets(self.author.pk), (set(), set()))
+
+    def nearby_contents(self, viewer, limit):
+        visibility = Visibility(User.objects.get(pk=viewer.pk))
+        pks = geo.maps_near(127.0, 37.5, 1000, limit, visibility)
+        repo = MusicMapsRepository().nearby(127.0, 37.5, 1000, limit, visibility)
+        self.assertEqual([doc['id'] for doc in repo], pks)
+        return [MusicMaps.objects.get(pk=pk).content for pk in pks]
+
+    def assertNearbyFillsLimit(self):
+        # 가장 가까운 MusicMaps 들이 볼 수 없는 것이어도 limit 개를 채운다.
+        MusicMaps.objects.filter(pk__in=list(self.maps.values())).delete()
+        for i in range(3):
+            create_map(self.author, 'private %d' % i, OpenRange.PRIVATE, lng=127.0 + i * 0.0001)
+            create_map(self.author, 'public %d' % i, OpenRange.PUBLIC, lng=127.001 + i * 0.0001)
+        self.assertEqual(self.nearby_contents(self.viewer, 2), ['public 0', 'public 1'])
+        self.assertEqual(self.nearby_contents(self.author, 2), ['private 0', 'private 1'])
+
+    def test_nearby_fills_limit(self):
+        MusicMaps.objects.ensure_indexes()
+        self.assertNearbyFillsLimit()
+
+    @override_settings(MUSICMAPS_GEO={'BACKEND': 'grid'})
+    def test_grid_nearby_fills_limit(self):
+        geo._grid = None
+        try:
+            self.assertNearbyFillsLimit()
+        finally:
+            geo._grid = None
+
+
+class ThreadTest(TestCase):
+    """
+    materialized path 댓글 스레드와 MusicMapComments API
+    """
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.musicmap = create_map(self.author, 'map')
+        self.root = threads.add_comment(self.musicmap, self.author, 'root')
+        self.reply = threads.add_comment(self.musicmap, self.author, 'reply', self.root)
+        self.nested = threads.add_comment(self.musicmap, self.author, 'nested', self.reply)
+        self.other = threads.add_comment(self.musicmap, self.author, 'other')
+
+    def post(self, pk, data, user=None):
+        request = APIRequestFactory().post('/', data, format='json')
+        force_authenticate(request, user=user or User.objects.get(pk=self.author.pk))
+        return views.MusicMapComments.as_view()(request, pk=pk)
+
+    def test_path(self):
+        self.assertEqual(self.nested.depth, 2)
+        self.assertEqual(self.nested.path.split('/'), [self.root.make_path(), self.reply.make_path(), self.nested.make_path()])
+        self.assertEqual(set(MusicMaps.objects.get(pk=self.musicmap.pk).comments_id), {self.root.pk, self.other.pk})
+
+    def test_load_thread(self):
+        roots = threads.load_thread(self.musicmap)
+        self.assertEqual([comment.content for comment in roots], ['root', 'other'])
+        self.assertEqual([comment.content for comment in roots[0].replies], ['reply'])
+        self.assertEqual([comment.content for comment in roots[0].replies[0].replies], ['nested'])
+        self.assertEqual(roots[0].author_userid, 'author')
+
+        roots = threads.load_thread(self.musicmap, max_depth=1)
+        self.assertEqual(roots[0].replies[0].replies, [])
+        self.assertEqual(len(threads.load_thread(self.musicmap, max_nodes=2)), 2)  # 얕은 댓글부터 읽는다.
+
+    def test_post(self):
+        response = self.post(self.musicmap.pk, {'content': 'hi', 'parent': self.nested.pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['depth'], 3)
+        self.assertEqual(response.data['author'], 'author')
+
+    def test_post_invalid(self):
+        other_map = create_map(self.author, 'other map')
+        other_comment = threads.add_comment(other_map, self.author, 'elsewhere')
+        for data in ({}, {'content': ''}, {'content': 'hi', 'parent': 'x'}, {'content': 'hi', 'parent': [1]},
+                     {'content': 'hi', 'parent': {'id': 1}}, {'content': 'hi', 'parent': other_comment.pk}):
+            self.assertEqual(self.post(self.musicmap.pk, data).status_code, 400, data)
+
+    def test_post_forbidden(self):
+        closed = create_map(self.author, 'closed', comments_on=False)
+        self.assertEqual(self.post(closed.pk, {'content': 'hi'}).status_code, 403)
+        private = create_map(self.author, 'private', OpenRange.PRIVATE)
+        self.assertEqual(self.post(private.pk, {'content': 'hi'}, create_user('viewer')).status_code, 404)
+
+
+class CatalogTest(TestCase):
+    """
+    같은 곡은 정규화한 identity 로 Music 문서 하나만 만든다.
+    """
+
+    def setUp(self):
+        MusicMaps.objects.ensure_indexes()
+        catalog.get_cache().clear()
+        self.author = create_user('author')
+
+    def track(self, name='밤편지', artists='IU', **fields):
+        return dict({'artists': artists, 'album': 'Palette', 'name': name, 'track_number': 1}, **fields)
+
+    def test_identity(self):
+        identity = catalog.track_identity('IU', 'Palette', '밤편지', 1)
+        self.assertEqual(catalog.track_identity(' iu ', 'PALETTE', '밤편지', '1'), identity)
+        self.assertEqual(catalog.track_identity('ＩＵ', 'Palette', '밤편지', 1), identity)  # NFKC
+        self.assertNotEqual(catalog.track_identity('IU', 'Palette', '밤편지', 2), identity)
+
+    def test_upsert(self):
+        first = catalog.upsert_tracks([self.track(), self.track(artists='iu'), self.track('Palette')])
+        self.assertEqual(first[0].pk, first[1].pk)
+        second = catalog.upsert_tracks([self.track('Palette'), self.track()])
+        self.assertEqual([music.pk for music in second], [first[2].pk, first[0].pk])
+        self.assertEqual(Music.objects.count(), 2)
+
+    def test_resolve_cached(self):
+        musics = catalog.upsert_tracks([self.track(), self.track('Palette')])
+        with mock.patch.object(Music.objects, 'in_bulk') as in_bulk:
+            resolved = catalog.resolve([music.pk for music in musics])
+        in_bulk.assert_not_called()
+        self.assertEqual({pk: music.name for pk, music in resolved.items()}, {musics[0].pk: '밤편지', musics[1].pk: 'Palette'})
+
+        catalog.invalidate(musics[0].pk)
+        self.assertEqual(catalog.resolve([musics[0].pk])[musics[0].pk].name, '밤편지')
+
+    def test_playlist_order(self):
+        serializer = MusicMapCreateSerializer(data={
+            'content': 'map', 'coordinates': [127.0, 37.5], 'street_address': '서울', 'building_number': '1',
+            'open_range': OpenRange.PUBLIC,
+            'playlist': [self.track('b'), self.track('a'), self.track('B')],
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        musicmap = serializer.save(author=self.author)
+
+        data = MusicMapSerializer(MusicMaps.objects.get(pk=musicmap.pk)).data
+        self.assertEqual([music['name'] for music in data['playlist']], ['b', 'a', 'b'])  # 보낸 순서, 중복 포함
+        self.assertEqual(Music.objects.count(), 2)
+
+
+class MemorizeTest(TestCase):
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.users = [create_user('user%d' % i) for i in range(3)]
+        self.musicmap = create_map(self.author, 'map')
+
+    def state(self):
+        doc = MusicMaps.objects.mongo_find_one({'id': self.musicmap.pk}, {'memorize_users_id': True, 'memorize_count': True})
+        return set(doc.get('memorize_users_id') or ()), doc.get('memorize_count')
+
+    def test_apply_intents(self):
+        pk = self.musicmap.pk
+        for user in self.users:
+            memorize.save_intent(pk, user.pk, True)
+        memorize.save_intent(pk, self.users[0].pk, False)  # 마지막 의도만 반영된다.
+
+        self.assertEqual(memorize.apply_intents({}), 3)
+        self.assertEqual(self.state(), ({self.users[1].pk, self.users[2].pk}, 2))
+        self.assertEqual(MemorizeIntent.objects.count(), 0)
+
+        # 같은 의도를 다시 반영해도 카운터는 그대로다.
+        memorize.apply({(pk, self.users[1].pk): True})
+        self.assertEqual(self.state(), ({self.users[1].pk, self.users[2].pk}, 2))
+
+    def test_buffer(self):
+        buffer = memorize.MemorizeBuffer(interval=3600, size=100, recover_interval=3600)
+        for user in self.users:
+            buffer.record(memorize.save_intent(self.musicmap.pk, user.pk, True))
+        self.assertEqual(self.state()[1], 0)
+
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(self.state(), ({user.pk for user in self.users}, 3))
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_recover(self):
+        memorize.save_intent(self.musicmap.pk, self.users[0].pk, True)
+        self.assertEqual(memorize.recover(age=60), 0)  # 방금 저장한 의도는 저장한 프로세스가 반영한다.
+        self.assertEqual(memorize.recover(age=0), 1)
+        self.assertEqual(self.state(), ({self.users[0].pk}, 1))
+
+
+class TileTest(TestCase):
+    ZOOM = 10
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        for i in range(3):
+            create_map(self.author, 'map %d' % i, lng=127.0 + i * 0.001)
+        create_map(self.author, 'private', OpenRange.PRIVATE, lng=127.0005)
+        self.tile = tiles.tile_of(127.0, 37.5, self.ZOOM)
+
+    def clusters(self, user=None):
+        viewer = User.objects.get(pk=user.pk) if user is not None else None
+        return tiles.clusters(self.ZOOM, *self.tile, Visibility(viewer))
+
+    def count(self, user=None):
+        return sum(cluster['count'] for cluster in self.clusters(user))
+
+    def test_aggregates(self):
+        self.assertEqual(self.count(), 3)
+        self.assertEqual(self.count(self.viewer), 3)
+        self.assertEqual(self.count(self.author), 4)  # 본인의 비공개 MusicMaps 는 조회 시점에 더한다.
+
+    def test_update_and_delete(self):
+        musicmap = MusicMaps.objects.get(content='map 0')
+        musicmap.open_range = OpenRange.PRIVATE
+        musicmap.save()
+        self.assertEqual(self.count(), 2)
+
+        musicmap.location = {'type': 'Point', 'coordinates': [-70.0, -30.0]}
+        musicmap.open_range = OpenRange.PUBLIC
+        musicmap.save()
+        self.assertEqual(self.count(), 2)
+
+        MusicMaps.objects.get(content='map 1').delete()
+        self.assertEqual(self.count(), 1)
+
+    def test_rebuild(self):
+        music = Music.objects.create(track_number=1, artists='IU', name='밤편지', album='Palette', album_cover='')
+        musicmap = MusicMaps.objects.get(content='map 0')
+        musicmap.set_playlist([music])
+        musicmap.save()
+
+        before = self.clusters()
+        tiles.rebuild()
+        after = self.clusters()
+        self.assertEqual(len(before), len(after))
+        for expected, cluster in zip(before, after):
+            self.assertEqual(cluster['count'], expected['count'])
+            self.assertAlmostEqual(cluster['lng'], expected['lng'])
+            self.assertAlmostEqual(cluster['lat'], expected['lat'])
+            self.assertEqual(cluster['top_track'], expected['top_track'])
+        self.assertIn(music.pk, [cluster['top_track'] for cluster in after])
+
+    def test_world_tiles(self):
+        # 경도 180도 이상인 타일도 나누어 읽는다.
+        clusters = tiles.clusters(0, 0, 0, Visibility(User.objects.get(pk=self.author.pk)))
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 4)
+
+    def test_private_limit(self):
+        create_map(self.author, 'private 2', OpenRange.FOLLOW, lng=127.0015)
+        self.assertEqual(self.count(self.author), 5)
+        with self.settings(MUSICMAPS_TILES={'PRIVATE_LIMIT': 1}):
+            self.assertEqual(self.count(self.author), 4)
+
+
+class MapImporterTest(TestCase):
+    """
+    bulk_import 묶음 쓰기, 멈춘 뒤 이어서 가져오기
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.directory, 'checkpoint.json')
+        create_user('author')
+        self.rows = [
+            (number, {
+                'author': 'author',
+                'content': 'imported %d' % number,
+                'coordinates': [127.0 + number * 0.001, 37.5],
+                'open_range': OpenRange.PUBLIC,
+                'playlist': [{'artists': 'IU', 'album': 'Palette', 'name': '밤편지', 'track_number': 1}],
+            })
+            for number in range(1, 6)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_import(self, map_importer, rows, chunk_size=2):
+        errors = []
+        checkpoint = importer.Checkpoint(self.checkpoint_path)
+        stats = None
+        for stats in importer.run(map_importer, rows, checkpoint, chunk_size, lambda number, error: errors.append(number)):
+            pass
+        return stats, errors, checkpoint
+
+    def test_import(self):
+        rows = self.rows + [
+            (6, {'author': 'nobody', 'coordinates': [127.0, 37.5], 'open_range': OpenRange.PUBLIC}),
+            (7, importer.MalformedRow('invalid JSON')),
+        ]
+        stats, errors, _ = self.run_import(importer.MapImporter(), rows)
+
+        self.assertEqual(errors, [6, 7])
+        self.assertEqual((stats['read'], stats['inserted'], stats['invalid']), (7, 5, 2))
+        self.assertEqual(MusicMaps.objects.count(), 5)
+        self.assertEqual(Music.objects.count(), 1)  # 같은 곡은 카탈로그에 하나만 만든다.
+
+        musicmap = MusicMaps.objects.get(content='imported 1')
+        self.assertEqual(musicmap.geohash, geo.encode(127.001, 37.5, 9))
+        self.assertIn('밤편', musicmap.search_tracks.split())
+        self.assertEqual(len(timeline.read(User.objects.get(userid='author'), limit=100)), 5)
+
+    def test_resume(self):
+        class Interrupted(importer.MapImporter):
+            def after_write(self, docs, replay=False):
+                raise RuntimeError('stopped')
+
+        with self.assertRaises(RuntimeError):
+            self.run_import(Interrupted(), self.rows)
+        with open(self.checkpoint_path) as file:
+            state = json.load(file)
+        self.assertTrue(state['reserved']['written'])
+        self.assertEqual(MusicMaps.objects.count(), 2)
+
+        # 멈췄던 묶음은 다시 쓰지 않고, 집계는 끝날 때 다시 계산한다.
+        stats, errors, checkpoint = self.run_import(importer.MapImporter(), self.rows)
+        self.assertEqual(errors, [])
+        self.assertEqual((stats['read'], stats['inserted'], stats['skipped']), (5, 5, 0))
+        self.assertEqual(checkpoint.position, 5)
+        self.assertFalse(checkpoint.rebuild)
+        self.assertEqual(MusicMaps.objects.count(), 5)
+        self.assertEqual(sum(cluster['count'] for cluster in tiles.clusters(0, 0, 0, Visibility(None))), 5)
+
+        # 끝난 checkpoint 로 다시 실행하면 아무것도 하지 않는다.
+        stats, _, _ = self.run_import(importer.MapImporter(), self.rows)
+        self.assertIsNone(stats)
+        self.assertEqual(MusicMaps.objects.count(), 5)
+
+    def test_follow_import(self):
+        follower, target = create_user('follower'), User.objects.get(userid='author')
+        self.assertEqual(cache.get_follow_sets(target.pk), (set(), set()))
+        self.assertEqual(cache.get_user('follower').following_count, 0)
+
+        rows = [(1, {'follower': 'follower', 'following': 'author'}), (2, {'follower': 'author', 'following': 'author'})]
+        stats, errors, _ = self.run_import(importer.FollowImporter(), rows)
+        self.assertEqual(errors, [2])
+
+        # pymongo 로 쓴 관계도 캐시에 바로 보인다.
+        self.assertEqual(cache.get_follow_sets(target.pk)[0], {follower.pk})
+        self.assertEqual(cache.get_user('follower').following_count, 1)
+        self.assertEqual(User.objects.get(pk=target.pk).followers_count, 1)
+
+
+class SuggestionTest(TestCase):
+
+    def setUp(self):
+        self.users = [create_user('user%d' % i) for i in range(5)]
+        u0, u1, u2, u3, u4 = self.users
+        User.objects.follow(u0, [u1, u3])
+        User.objects.follow(u1, [u2, u3])
+        User.objects.follow(u3, [u2])
+        # u4 는 팔로우 관계가 없지만 u0 와 같은 지역에 MusicMaps 를 남겼다.
+        create_map(u0, 'u0', lng=127.0)
+        create_map(u4, 'u4', lng=127.001)
+
+    def suggested(self, user):
+        return [other.userid for other in FollowSuggestion.objects.suggested_users(User.objects.get(pk=user.pk), 10)]
+
+    def test_refresh(self):
+        self.assertEqual(suggestions.refresh(), len(self.users))
+        suggested = self.suggested(self.users[0])
+        self.assertEqual(suggested[0], 'user2')  # 함께 아는 친구 두 명
+        self.assertIn('user4', suggested)        # 같은 지역
+        self.assertNotIn('user1', suggested)     # 이미 팔로우한 유저
+        self.assertNotIn('user0', suggested)
+
+    def test_incremental(self):
+        suggestions.refresh()
+        u0, u1, u2 = self.users[:3]
+        followed = User.objects.follow(u1, [u0])
+        user_followed.send(sender=User, user=u1, targets=followed)
+        followed = User.objects.follow(u0, [u2])
+        user_followed.send(sender=User, user=u0, targets=followed)
+
+        self.assertNotIn('user2', self.suggested(u0))  # 새로 팔로우한 유저는 바로 뺀다.
+        stale = set(FollowSuggestion.objects.filter(stale=True).values_list('owner_id', flat=True))
+        self.assertEqual(stale, {u0.pk, u1.pk})  # 팔로우한 유저와 그 팔로워
+        self.assertEqual(suggestions.refresh(incremental=True), 2)
+        self.assertFalse(FollowSuggestion.objects.filter(stale=True).exists())
+
+
+@override_settings(MUSICMAPS_SEARCH={'BACKEND': 'local', 'SYNC_INTERVAL': 0})
+class SearchTest(TestCase):
+    """
+    local 역색인 검색의 순위, cursor, 공개 범위
+    """
+
+    def setUp(self):
+        search._index = None
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        # 가중치: address(2) > content(1)
+        self.content = create_map(self.author, '망원', street_address='서울', building_number='').pk
+        self.address = create_map(self.author, '서울', street_address='망원', building_number='').pk
+        self.private = create_map(self.author, '망원 비밀', OpenRange.PRIVATE).pk
+
+    def tearDown(self):
+        search._index = None
+
+    def search(self, text, user=None, position=None, limit=20):
+        viewer = User.objects.get(pk=user.pk) if user is not None else None
+        return search.search(search.query_terms(text), Visibility(viewer), position, limit)
+
+    def test_ranking(self):
+        self.assertEqual([doc['id'] for doc in self.search('망원')], [self.address, self.content])
+        self.assertEqual([doc['id'] for doc in self.search('없는말')], [])
+
+    def test_visibility(self):
+        self.assertNotIn(self.private, [doc['id'] for doc in self.search('망원', self.viewer)])
+        self.assertIn(self.private, [doc['id'] for doc in self.search('망원', self.author)])
+
+    def test_paging(self):
+        docs = self.search('망원', self.author)
+        first = self.search('망원', self.author, limit=1)
+        rest = self.search('망원', self.author, position=(first[-1]['score'], first[-1]['id']))
+        self.assertEqual(first + rest, docs)
+
+    def test_parse_position(self):
+        self.assertEqual(search.parse_position([1, 2]), (1.0, 2))
+        for position in (['1', 2], [float('nan'), 2], [1.0, '2'], [True, 2], [1.0, 2.5]):
+            with self.assertRaises(ValueError):
+                search.parse_position(position)
+
+    def test_tokenize_on_change(self):
+        musicmap = MusicMaps.objects.get(pk=self.content)
+        musicmap.comments_on = False
+        musicmap.save()
+        self.assertFalse(musicmap._search_changed)
+
+        musicmap.content = '합정'
+        musicmap.save()
+        self.assertTrue(musicmap._search_changed)
+        self.assertEqual([doc['id'] for doc in self.search('합정')], [self.content])
+
+    def other_process(self, pk, text):
+        # 다른 프로세스가 쓴 것처럼 이 프로세스의 역색인을 거치지 않고 term 을 바꾸고 delta 를 남긴다.
+        fields = {'search_content': ' '.join(search.document_terms(text)), 'search_address': '', 'search_tracks': ''}
+        MusicMaps.objects.mongo_update_one({'id': pk}, {'$set': fields})
+        search._publish({'pk': pk, 'fields': fields})
+
+    def test_other_process_write(self):
+        self.search('망원')  # 역색인을 읽어둔다.
+        self.other_process(self.content, '연남')
+        search._publish({'pk': self.address, 'fields': None})
+
+        with mock.patch.object(search, '_load') as load:
+            self.assertEqual([doc['id'] for doc in self.search('연남')], [self.content])
+            self.assertEqual([doc['id'] for doc in self.search('망원')], [])
+        load.assert_not_called()  # delta 만 반영하고 다시 읽지 않는다.
+        self.assertEqual(search._index.version, search.shared_version())
+
+    def test_reload_fallback(self):
+        self.search('망원')
+        MusicMaps.objects.mongo_update_one({'id': self.content}, {'$set': {'search_content': '연남'}})
+        search.invalidate()  # rebuild, bulk import
+        self.assertEqual([doc['id'] for doc in self.search('연남')], [self.content])
+
+        with self.settings(MUSICMAPS_SEARCH={'BACKEND': 'local', 'SYNC_INTERVAL': 0, 'MAX_DELTAS': 1}):
+            self.other_process(self.content, '합정')
+            self.other_process(self.address, '합정')
+            with mock.patch.object(search, '_load', wraps=search._load) as load:
+                self.assertEqual(len(self.search('합정')), 2)
+            load.assert_called_once()
+
+    def test_missing_delta(self):
+        self.search('망원')
+        search._state().update_one({'_id': 'local'}, {'$inc': {'version': 1}})  # version 만 받고 delta 를 남기지 못한 쓰기
+        self.other_process(self.content, '연남')
+
+        with mock.patch.object(search, '_load', wraps=search._load) as load:
+            self.assertEqual(self.search('연남'), [])  # 한 번은 기다린다.
+            load.assert_not_called()
+            self.assertEqual([doc['id'] for doc in self.search('연남')], [self.content])
+            load.assert_called_once()
+
+
+@override_settings(MUSICMAPS_TRENDING={'TOP_K': 2, 'SNAPSHOT_INTERVAL': 3600})
+class TrendingTest(TestCase):
+    # 다른 테스트의 MusicMaps 와 겹치지 않는 곡 pk
+    TRACKS = (10 ** 9 + 1, 10 ** 9 + 2, 10 ** 9 + 3)
+
+    def setUp(self):
+        self.conf = trending.trending_settings()
+        self.geohash = geo.encode(127.0, 37.5, 9)
+        self.region = trending.region_of(127.0, 37.5, self.conf)
+
+    def value(self, *tracks, hours=0):
+        doc = {
+            'open_range': OpenRange.PUBLIC,
+            'geohash': self.geohash,
+            'date_created': timezone.now() - datetime.timedelta(hours=hours),
+            'playlist_id': set(tracks),
+            'playlist_order': list(tracks),
+        }
+        return trending.contribution(doc, self.conf)
+
+    def window(self):
+        window = trending.TrendingWindow(self.conf)
+        window._thread, window._pid = True, os.getpid()  # background 스레드 없이 직접 sync 한다.
+        return window
+
+    def test_window(self):
+        first, second, third = self.TRACKS
+        window = self.window()
+        window.record(self.value(first, second))
+        window.record(self.value(first, third, first))  # 한 MusicMaps 의 같은 곡은 한번만 센다.
+        window.record(self.value(first))
+        window.record(self.value(third))
+
+        top = window.top(self.region, 'tracks')
+        self.assertEqual(top[0], (first, 3))
+        self.assertEqual(len(top), 2)
+        self.assertEqual(window.top(trending.GLOBAL, 'tracks')[0], (first, 3))
+
+        # 개수가 줄면 상위 목록을 다시 계산한다.
+        window.record(self.value(first), -1)
+        window.record(self.value(first, second), -1)
+        self.assertEqual(window.top(self.region, 'tracks'), [(third, 2), (first, 1)])
+
+        # 공개 범위가 PUBLIC 이 아니거나 window 밖이면 세지 않는다.
+        private = {'open_range': OpenRange.PRIVATE, 'geohash': self.geohash, 'date_created': timezone.now()}
+        self.assertIsNone(trending.contribution(private, self.conf))
+        window.record(self.value(second, hours=24 * 30))
+        self.assertEqual(window.top(self.region, 'tracks'), [(third, 2), (first, 1)])
+
+    def test_sync(self):
+        first, second, _ = self.TRACKS
+        window = self.window()
+        window.record(self.value(first, second))
+        window.record(self.value(first))
+        window.sync()
+
+        other = self.window()
+        other.sync()
+        self.assertEqual(other.top(self.region, 'tracks'), window.top(self.region, 'tracks'))
+
+        # 다른 프로세스의 증가분은 다음 sync 에서 합쳐진다.
+        other.record(self.value(second))
+        other.record(self.value(second))
+        other.sync()
+        window.sync()
+        self.assertEqual(window.top(self.region, 'tracks'), [(second, 3), (first, 2)])
+
+    def test_rebuild_reloads_window(self):
+        first = self.TRACKS[0]
+        window = self.window()
+        window.record(self.value(first, hours=3))  # 마지막으로 읽은 bucket 보다 오래된 bucket
+        window.sync()
+        self.assertEqual(window.top(self.region, 'tracks'), [(first, 1)])
+
+        # rebuild 는 MusicMaps 에서 다시 세므로 MusicMaps 가 없는 곡은 사라지고, version 이 바뀌어 window 전체를 다시 읽는다.
+        trending.rebuild()
+        window.sync()
+        self.assertEqual(window.top(self.region, 'tracks'), [])
+
+    def get(self, query=''):
+        return views.MusicMapTrending.as_view()(APIRequestFactory().get('/musicmaps/trending/?' + query))
+
+    def test_view(self):
+        music = Music.objects.create(track_number=1, artists='IU', name='밤편지', album='Palette', album_cover='')
+        window = self.window()
+        window.record(self.value(music.pk, self.TRACKS[0]))  # 카탈로그에 없는 곡은 내려주지 않는다.
+        window.sync()
+
+        with mock.patch.object(trending, 'get_window', return_value=window):
+            response = self.get('lng=127.0&lat=37.5')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['region'], self.region)
+            self.assertEqual([(track['music']['id'], track['count']) for track in response.data['tracks']], [(music.pk, 1)])
+            self.assertEqual([place['count'] for place in response.data['places']], [1])
+
+            self.assertEqual(self.get().data['region'], trending.GLOBAL)
+            self.assertEqual(self.get('lng=127.0').status_code, 400)
@@ -0,0 +1,84 @@
+"""
+댓글 스레드
+
+Comment.comments 를 따라 노드마다 조회하는 대신, 댓글마다 musicmap 과
+materialized path 를 저장해 두고 MusicMaps 의 댓글 트리 전체를
+(댓글 한번 + 작성자 한번) 의 고정된 쿼리 수로 읽어 메모리에서 조립한다.
+"""
+from django.conf import settings
+
+from accounts.models import User
+
+from .db import reserve_ids
+from .models import Comment
+
+DEFAULT_THREAD_SETTINGS = {
+    'MAX_DEPTH': 8,      # 이보다 깊은 답글은 읽지 않는다.
+    'MAX_NODES': 500,    # 한번에 읽을 최대 댓글 수
+}
+
+
+def thread_settings():
+    conf = dict(DEFAULT_THREAD_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_THREADS', {}))
+    return conf
+
+
+def add_comment(musicmap, author, content, parent=None):
+    """
+    댓글(또는 parent 에 대한 답글)을 작성한다.
+    """
+    # path 에 자신의 pk 가 들어가므로 pk 를 먼저 예약하고, path 를 채운 문서를 insert 한번으로 저장한다.
+    # (insert 후 path 를 따로 저장하면 그 사이에 path 가 빈 댓글이 스레드 조회에 보인다)
+    comment = Comment(
+        pk=reserve_ids(Comment, 1),
+        musicmap=musicmap,
+        author=author,
+        content=content,
+        depth=parent.depth + 1 if parent is not None else 0,
+    )
+    comment.path = comment.make_path(parent)
+    comment.save(force_insert=True)
+
+    # 기존 참조 배열도 함께 유지한다.
+    if parent is not None:
+        parent.comments.add(comment)
+    else:
+        musicmap.add_comment(comment)
+
+    return comment
+
+
+def load_thread(musicmap, max_depth=None, max_nodes=None):
+    """
+    musicmap 의 댓글 트리를 읽는다. 최상위 댓글 목록을 반환하고,
+    각 댓글의 답글은 comment.replies 에 담긴다.
+
+    너비 우선(depth, path 순)으로 읽으므로 max_nodes 에서 잘리더라도
+    얕은 댓글이 먼저 포함된다.
+    """
+    conf = thread_settings()
+    max_depth = conf['MAX_DEPTH'] if max_depth is None else min(max_depth, conf['MAX_DEPTH'])
+    max_nodes = conf['MAX_NODES'] if max_nodes is None else min(max_nodes, conf['MAX_NODES'])
+
+    comments = list(
+        Comment.objects.filter(musicmap_id=musicmap.pk, depth__lte=max_depth)
+        .order_by('depth', 'path')[:max_nodes]
+    )
+
+    authors = User.objects.in_bulk({comment.author_id for comment in comments})
+
+    by_path = {}
+    roots = []
+    for comment in comments:
+        comment.replies = []
+        comment.author_userid = authors[comment.author_id].userid if comment.author_id in authors else None
+        by_path[comment.path] = comment
+
+        parent_path = comment.path.rpartition('/')[0]
+        if not parent_path:
+            roots.append(comment)
+        elif parent_path in by_path:
+            by_path[parent_path].replies.append(comment)
+
+    return roots
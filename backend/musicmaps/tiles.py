@@ -0,0 +1,316 @@
+"""
+지도 타일 클러스터
+
+축소된 지도에서는 MusicMaps 를 하나씩 보내는 대신 타일(z/x/y, Web Mercator) 마다
+GRID x GRID 칸으로 묶은 클러스터(중심점, 개수, 가장 많이 담긴 곡)를 보낸다.
+
+클러스터는 zoom 단계별로 TileCluster 에 미리 집계해 두고, MusicMaps 가 생성/수정/삭제될 때
+$inc upsert 로 바뀐 만큼만 갱신한다. 수정 전 값은 DB 에서 읽은 시점의 값(MusicMaps.from_db)을 쓰고,
+위치/공개 범위/플레이리스트가 그대로면 쓰지 않는다. 이전 값을 빼고 새 값을 더하는 증분은
+칸마다 합쳐서 bulk_write 한번으로 보낸다. (낮은 zoom 에서는 같은 칸이라 대부분 상쇄된다)
+
+집계는 open_range 별로 나뉘어 있어서 로그인하지 않은 viewer 에게는 PUBLIC 집계만 보낸다.
+로그인한 viewer 에게는 여기에 본인과 팔로우한 유저의 비공개 MusicMaps 를 조회 시점에 같은 칸으로 묶어서 더한다.
+"""
+import math
+from collections import Counter
+
+from django.conf import settings
+from pymongo import UpdateOne
+
+from . import geo
+from .db import database
+from .models import MusicMaps, TileCluster
+
+OpenRange = MusicMaps.OpenRange
+
+DEFAULT_TILE_SETTINGS = {
+    'MIN_ZOOM': 0,
+    'MAX_ZOOM': 16,         # 이보다 확대하면 영역(bbox) 조회를 사용한다.
+    'GRID_BITS': 3,         # 타일을 2^3 x 2^3 칸으로 나눈다.
+    'BATCH_SIZE': 1000,
+    'PRIVATE_LIMIT': 5000,  # 타일 하나에 더할 비공개 MusicMaps 최대 수 (조회 시점에 읽으므로 제한한다)
+}
+
+MAX_LATITUDE = 85.05112878
+
+CONTRIBUTION_PROJECTION = {'_id': False, 'id': True, 'location': True, 'open_range': True, 'playlist_id': True}
+
+
+def tile_settings():
+    conf = dict(DEFAULT_TILE_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_TILES', {}))
+    return conf
+
+
+def tile_of(lng, lat, zoom):
+    """
+    (경도, 위도) 가 속한 zoom 단계의 타일 (x, y)
+    """
+    n = 1 << zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(zoom, x, y):
+    """
+    타일의 (west, south, east, north)
+    """
+    n = 1 << zoom
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, latitude(y + 1), (x + 1) / n * 360.0 - 180.0, latitude(y)
+
+
+def is_valid_tile(zoom, x, y):
+    conf = tile_settings()
+    return conf['MIN_ZOOM'] <= zoom <= conf['MAX_ZOOM'] and 0 <= x < (1 << zoom) and 0 <= y < (1 << zoom)
+
+
+def cell_of(lng, lat, zoom, bits):
+    """
+    zoom 단계에서 (경도, 위도) 가 속한 (타일 x, 타일 y, 칸 번호)
+    """
+    cx, cy = tile_of(lng, lat, zoom + bits)
+    mask = (1 << bits) - 1
+    return cx >> bits, cy >> bits, ((cy & mask) << bits) | (cx & mask)
+
+
+def cluster_key(zoom, x, y, cell, open_range):
+    return '%d/%d/%d/%d/%d' % (zoom, x, y, cell, open_range)
+
+
+def contribution(musicmap):
+    """
+    MusicMaps (인스턴스 또는 문서) 가 집계에 더하는 값. 위치가 없으면 None.
+    """
+    if isinstance(musicmap, dict):
+        location, open_range, playlist = musicmap.get('location'), musicmap.get('open_range'), musicmap.get('playlist_id')
+    else:
+        location, open_range, playlist = musicmap.location, musicmap.open_range, musicmap.playlist_id
+    point = geo.point_of(location)
+    if point is None or open_range is None:
+        return None
+    return point, int(open_range), tuple(sorted(playlist or ()))
+
+
+def accumulate(aggregates, value, sign, conf=None):
+    """
+    value 를 zoom 단계별 칸 집계 aggregates (key -> dict) 에 sign 만큼 더한다.
+    """
+    conf = conf or tile_settings()
+    (lng, lat), open_range, playlist = value
+    bits = conf['GRID_BITS']
+
+    for zoom in range(conf['MIN_ZOOM'], conf['MAX_ZOOM'] + 1):
+        x, y, cell = cell_of(lng, lat, zoom, bits)
+        key = cluster_key(zoom, x, y, cell, open_range)
+        item = aggregates.get(key)
+        if item is None:
+            item = aggregates[key] = {
+                'fields': {'zoom': zoom, 'x': x, 'y': y, 'cell': cell, 'open_range': open_range},
+                'count': 0, 'sum_lng': 0.0, 'sum_lat': 0.0, 'tracks': Counter(),
+            }
+        item['count'] += sign
+        item['sum_lng'] += sign * lng
+        item['sum_lat'] += sign * lat
+        for pk in playlist:
+            item['tracks'][pk] += sign
+
+
+def write(collection, aggregates):
+    """
+    aggregates 를 $inc upsert 로 collection 에 더한다. 증분이 모두 0 인 칸은 보내지 않는다.
+    """
+    operations = []
+    emptied = []
+    for key, item in aggregates.items():
+        increments = {field: item[field] for field in ('count', 'sum_lng', 'sum_lat') if item[field]}
+        increments.update(('tracks.%s' % pk, count) for pk, count in item['tracks'].items() if count)
+        if not increments:
+            continue
+        operations.append(UpdateOne({'key': key}, {'$setOnInsert': item['fields'], '$inc': increments}, upsert=True))
+        if item['count'] < 0:
+            emptied.append(key)
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    if emptied:
+        collection.delete_many({'key': {'$in': emptied}, 'count': {'$lte': 0}})
+    return len(operations)
+
+
+def _collection():
+    return database()[TileCluster._meta.db_table]
+
+
+def apply(*changes):
+    """
+    (value, sign) 들을 칸마다 합쳐서 한번에 반영한다.
+    """
+    aggregates = {}
+    conf = tile_settings()
+    for value, sign in changes:
+        if value is not None:
+            accumulate(aggregates, value, sign, conf)
+    if aggregates:
+        write(_collection(), aggregates)
+
+
+def add(musicmap):
+    apply((contribution(musicmap), 1))
+
+
+def remove(musicmap):
+    apply((contribution(musicmap), -1))
+
+
+def snapshot(pk):
+    """
+    DB 에 저장된 MusicMaps 의 집계 값
+    """
+    doc = MusicMaps.objects.mongo_find_one({'id': pk}, CONTRIBUTION_PROJECTION)
+    return contribution(doc) if doc is not None else None
+
+
+def previous(musicmap):
+    """
+    저장 전 집계 값 (수정될 때 이전 값을 빼기 위해 사용). DB 에서 읽은 인스턴스는 읽은 시점의 값을 쓰고,
+    그렇지 않으면 DB 를 읽는다.
+    """
+    loaded = getattr(musicmap, '_loaded_values', None)
+    if loaded is not None:
+        return contribution(loaded)
+    return snapshot(musicmap.pk)
+
+
+def update(previous, musicmap):
+    current = contribution(musicmap)
+    if previous == current:
+        return
+    apply((previous, -1), (current, 1))
+
+
+def _tile_queries(zoom, x, y):
+    """
+    타일 영역의 위치 조건 목록. 2dsphere 인덱스를 쓰도록 경도 180도 이상인 타일(zoom 0, 1)은 90도씩 나누고,
+    집계는 위도를 MAX_LATITUDE 로 잘라서 넣으므로 위/아래 끝 타일은 극 쪽 나머지도 포함한다.
+    """
+    west, south, east, north = tile_bounds(zoom, x, y)
+    parts = max(1, int(math.ceil((east - west) / 90.0)))
+    step = (east - west) / parts
+    queries = [geo.bbox_query((west + i * step, south, east if i == parts - 1 else west + (i + 1) * step, north)) for i in range(parts)]
+
+    longitude = {'$gte': west, '$lte': east}
+    if y == 0:
+        queries.append({'location.coordinates.0': longitude, 'location.coordinates.1': {'$gt': north}})
+    if y == (1 << zoom) - 1:
+        queries.append({'location.coordinates.0': longitude, 'location.coordinates.1': {'$lt': south}})
+    return queries
+
+
+def _private_docs(zoom, x, y, visibility):
+    """
+    viewer 가 볼 수 있는 PUBLIC 이 아닌 MusicMaps 중 타일 안에 있는 것. 최대 PRIVATE_LIMIT 개까지 batch 로 읽는다.
+    """
+    conf = tile_settings()
+    conditions = [{'author_id': visibility.viewer_pk, 'open_range': {'$ne': OpenRange.PUBLIC}}]
+    if visibility.following:
+        conditions.append({'author_id': {'$in': list(visibility.following)}, 'open_range': OpenRange.FOLLOW})
+    if visibility.mutual:
+        conditions.append({'author_id': {'$in': list(visibility.mutual)}, 'open_range': OpenRange.FOLLOW_BACK})
+
+    seen = set()  # 나눈 영역의 경계에 있는 문서는 두 번 읽힌다.
+    for location in _tile_queries(zoom, x, y):
+        remaining = conf['PRIVATE_LIMIT'] - len(seen)
+        if remaining <= 0:
+            return
+        query = {'$and': [{'$or': conditions}, location]}
+        cursor = MusicMaps.objects.mongo_find(query, CONTRIBUTION_PROJECTION).limit(remaining)
+        for doc in cursor.batch_size(conf['BATCH_SIZE']):
+            if doc['id'] not in seen:
+                seen.add(doc['id'])
+                yield doc
+
+
+def clusters(zoom, x, y, visibility):
+    """
+    타일 안의 클러스터 목록. 각 항목은 dict(cell, lng, lat, count, top_track(Music pk | None)).
+    """
+    bits = tile_settings()['GRID_BITS']
+    merged = {}
+
+    def cluster(cell):
+        return merged.setdefault(cell, {'count': 0, 'sum_lng': 0.0, 'sum_lat': 0.0, 'tracks': Counter()})
+
+    for doc in TileCluster.objects.mongo_find({'zoom': zoom, 'x': x, 'y': y, 'open_range': OpenRange.PUBLIC}):
+        if doc['count'] <= 0:
+            continue
+        item = cluster(doc['cell'])
+        item['count'] += doc['count']
+        item['sum_lng'] += doc['sum_lng']
+        item['sum_lat'] += doc['sum_lat']
+        item['tracks'].update({int(pk): count for pk, count in (doc.get('tracks') or {}).items()})
+
+    if visibility.viewer_pk is not None:
+        for doc in _private_docs(zoom, x, y, visibility):
+            value = contribution(doc)
+            if value is None:
+                continue
+            (lng, lat), _, playlist = value
+            tile_x, tile_y, cell = cell_of(lng, lat, zoom, bits)
+            if (tile_x, tile_y) != (x, y):
+                continue
+            item = cluster(cell)
+            item['count'] += 1
+            item['sum_lng'] += lng
+            item['sum_lat'] += lat
+            item['tracks'].update(playlist)
+
+    results = []
+    for cell, item in sorted(merged.items()):
+        top = [(count, -pk) for pk, count in item['tracks'].items() if count > 0]
+        results.append({
+            'cell': cell,
+            'lng': item['sum_lng'] / item['count'],
+            'lat': item['sum_lat'] / item['count'],
+            'count': item['count'],
+            'top_track': -max(top)[1] if top else None,
+        })
+    return results
+
+
+def rebuild():
+    """
+    모든 MusicMaps 로 집계를 다시 만든다. (bulk_create 등 signal 을 거치지 않은 쓰기 이후)
+    임시 컬렉션에 BATCH_SIZE 개씩 $inc 로 더한 뒤 TileCluster 컬렉션과 바꾸므로, 메모리에는 한 묶음의 집계만
+    올라가고 조회는 바뀌기 전까지 이전 집계를 본다. rebuild 중에 저장/삭제된 MusicMaps 의 증감은
+    이전 컬렉션에 반영되어 사라질 수 있으므로 쓰기가 적을 때 실행한다.
+    """
+    conf = tile_settings()
+    target = _collection()
+    temp = target.database['%s_rebuild' % target.name]
+    temp.drop()
+    temp.create_index([('key', 1)], name='key', unique=True)
+    temp.create_index([('zoom', 1), ('x', 1), ('y', 1), ('open_range', 1)], name='tile')
+
+    aggregates = {}
+    count = 0
+    for doc in MusicMaps.objects.mongo_find({}, CONTRIBUTION_PROJECTION).batch_size(conf['BATCH_SIZE']):
+        value = contribution(doc)
+        if value is None:
+            continue
+        accumulate(aggregates, value, 1, conf)
+        count += 1
+        if count % conf['BATCH_SIZE'] == 0:
+            write(temp, aggregates)
+            aggregates = {}
+    write(temp, aggregates)
+
+    clusters = temp.count_documents({})
+    temp.rename(target.name, dropTarget=True)
+    return clusters
@@ -0,0 +1,258 @@
+"""
+홈 타임라인
+
+MusicMaps 가 만들어지면 공개 범위(open_range)에 따라 볼 수 있는 팔로워들의
+타임라인(TimelineEntry)에 미리 넣어둔다(fan-out-on-write). 따라서 타임라인 조회는
+owner_id 인덱스 범위 조회 한번이면 된다.
+
+팔로워가 FANOUT_LIMIT 보다 많은 작성자는 쓰기 비용이 너무 크므로 펼치지 않고,
+조회할 때 해당 작성자의 MusicMaps 를 직접 읽어서 합친다(fan-out-on-read).
+"""
+from django.conf import settings
+from django.db.models import Q
+
+from accounts.models import User
+
+from . import visibility
+from .models import MusicMaps, TimelineEntry
+
+DEFAULT_TIMELINE_SETTINGS = {
+    'FANOUT_LIMIT': 10000,  # 이보다 팔로워가 많으면 fan-out-on-read
+    'MAX_LENGTH': 800,      # 유저별 타임라인 최대 길이
+    'BACKFILL': 50,         # 팔로우 시 채워넣을 최근 MusicMaps 수
+    'BATCH_SIZE': 1000,
+}
+
+OpenRange = MusicMaps.OpenRange
+
+
+def timeline_settings():
+    conf = dict(DEFAULT_TIMELINE_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_TIMELINE', {}))
+    return conf
+
+
+def is_fanout_author(author):
+    return author.followers_count <= timeline_settings()['FANOUT_LIMIT']
+
+
+def visible_open_ranges(viewer, author):
+    """
+    viewer 가 author 의 MusicMaps 중 볼 수 있는 공개 범위
+    """
+    return visibility.open_ranges(
+        viewer.pk, author.pk, set(viewer.followers_id or ()), set(viewer.following_id or ())
+    )
+
+
+def _audience(author_pk, followers_id, following_id, open_range):
+    followers = set(followers_id or ())
+
+    if open_range == OpenRange.FOLLOW_BACK:
+        followers &= set(following_id or ())
+    elif open_range == OpenRange.PRIVATE:
+        followers = set()
+
+    followers.add(author_pk)
+    return followers
+
+
+AUTHOR_FIELDS = {'_id': False, 'id': True, 'followers_id': True, 'following_id': True, 'followers_count': True}
+
+
+def _owners(author, open_range, conf):
+    """
+    author 문서(AUTHOR_FIELDS)의 MusicMaps 를 타임라인으로 받을 유저 pk 목록 (작성자 포함)
+    팔로워가 FANOUT_LIMIT 보다 많으면 작성자만 받는다.
+    """
+    if author.get('followers_count', 0) <= conf['FANOUT_LIMIT']:
+        return _audience(author['id'], author.get('followers_id'), author.get('following_id'), open_range)
+    return {author['id']}
+
+
+def _author(musicmap):
+    # musicmap.author 는 캐시된 request.user 등 오래된 사본일 수 있으므로 팔로우 목록은 DB 에서 읽는다.
+    return User.objects.mongo_find_one({'id': musicmap.author_id}, AUTHOR_FIELDS) or {'id': musicmap.author_id}
+
+
+def audience(musicmap):
+    """
+    musicmap 을 타임라인으로 받을 유저 pk 목록 (작성자 포함)
+    """
+    author = _author(musicmap)
+    return _audience(author['id'], author.get('followers_id'), author.get('following_id'), musicmap.open_range)
+
+
+def _entry(owner_id, musicmap):
+    return TimelineEntry(
+        owner_id=owner_id,
+        musicmap_id=musicmap.pk,
+        author_id=musicmap.author_id,
+        open_range=musicmap.open_range,
+        date_created=musicmap.date_created,
+    )
+
+
+def fan_out(musicmap):
+    conf = timeline_settings()
+    owners = _owners(_author(musicmap), musicmap.open_range, conf)
+    entries = [_entry(owner_id, musicmap) for owner_id in owners]
+    TimelineEntry.objects.bulk_create(entries, batch_size=conf['BATCH_SIZE'])
+
+
+def refresh(musicmap):
+    """
+    공개 범위가 바뀐 MusicMaps 를 다시 펼친다. 더 이상 볼 수 없는 유저의 항목은 지우고,
+    남은 항목의 open_range 를 바꾸고, 새로 볼 수 있게 된 유저에게 넣는다.
+    """
+    conf = timeline_settings()
+    owners = _owners(_author(musicmap), musicmap.open_range, conf)
+    entries = TimelineEntry.objects.filter(musicmap_id=musicmap.pk)
+
+    entries.exclude(owner_id__in=list(owners)).delete()
+    entries.update(open_range=musicmap.open_range)
+
+    existing = set(entries.values_list('owner_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        [_entry(owner_id, musicmap) for owner_id in owners if owner_id not in existing],
+        batch_size=conf['BATCH_SIZE'],
+    )
+
+
+def fan_out_documents(docs):
+    """
+    signal 을 거치지 않고 쓴 MusicMaps 문서(bulk_import)를 펼친다.
+    해당 MusicMaps 의 항목을 지우고 다시 넣으므로 같은 문서로 다시 호출해도 결과가 같다.
+    """
+    conf = timeline_settings()
+    authors = {
+        doc['id']: doc for doc in User.objects.mongo_find(
+            {'id': {'$in': list({doc['author_id'] for doc in docs})}}, AUTHOR_FIELDS,
+        )
+    }
+
+    entries = []
+    for doc in docs:
+        author = authors.get(doc['author_id'])
+        if author is None:
+            continue
+        owners = _owners(author, doc['open_range'], conf)
+        entries.extend(
+            TimelineEntry(
+                owner_id=owner_id,
+                musicmap_id=doc['id'],
+                author_id=doc['author_id'],
+                open_range=doc['open_range'],
+                date_created=doc['date_created'],
+            )
+            for owner_id in owners
+        )
+
+    TimelineEntry.objects.filter(musicmap_id__in=[doc['id'] for doc in docs]).delete()
+    TimelineEntry.objects.bulk_create(entries, batch_size=conf['BATCH_SIZE'])
+
+
+def remove(musicmap_pk):
+    TimelineEntry.objects.filter(musicmap_id=musicmap_pk).delete()
+
+
+def backfill(viewer, authors):
+    """
+    viewer 가 authors 를 새로 볼 수 있게 되었을 때 최근 MusicMaps 를 채워넣는다.
+    """
+    authors = [author for author in authors if is_fanout_author(author)]
+    if not authors:
+        return
+
+    conf = timeline_settings()
+    condition = Q()
+    for author in authors:
+        condition |= Q(author_id=author.pk, open_range__in=visible_open_ranges(viewer, author))
+
+    existing = set(
+        TimelineEntry.objects.filter(
+            owner_id=viewer.pk,
+            author_id__in=[author.pk for author in authors],
+        ).values_list('musicmap_id', flat=True)
+    )
+    recent = MusicMaps.objects.filter(condition).order_by('-date_created')[:conf['BACKFILL']]
+
+    entries = [_entry(viewer.pk, musicmap) for musicmap in recent if musicmap.pk not in existing]
+    TimelineEntry.objects.bulk_create(entries, batch_size=conf['BATCH_SIZE'])
+    trim(viewer.pk)
+
+
+def revoke(viewer, author):
+    """
+    viewer 가 더 이상 볼 수 없는 author 의 MusicMaps 를 타임라인에서 뺀다.
+    """
+    TimelineEntry.objects.filter(owner_id=viewer.pk, author_id=author.pk).exclude(
+        open_range__in=visible_open_ranges(viewer, author)
+    ).delete()
+
+
+def trim(owner_id):
+    """
+    MAX_LENGTH 보다 오래된 항목을 지운다.
+    """
+    max_length = timeline_settings()['MAX_LENGTH']
+    boundary = list(
+        TimelineEntry.objects.filter(owner_id=owner_id)
+        .order_by('-date_created')
+        .values_list('date_created', flat=True)[max_length:max_length + 1]
+    )
+    if boundary:
+        TimelineEntry.objects.filter(owner_id=owner_id, date_created__lte=boundary[0]).delete()
+
+
+def read(viewer, before=None, limit=20):
+    """
+    타임라인 조회. before = (date_created, musicmap pk) 이전 항목을 최신순으로 limit 개 반환한다.
+    항목은 펼칠 때의 공개 범위로 들어가 있으므로 MusicMaps 의 현재 공개 범위로 다시 거른다.
+    """
+    conf = timeline_settings()
+    visible = visibility.Visibility(viewer)
+
+    musicmaps = []
+    position = before
+    while len(musicmaps) < limit:
+        entries = TimelineEntry.objects.filter(owner_id=viewer.pk)
+        if position is not None:
+            date, pk = position
+            entries = entries.filter(Q(date_created__lt=date) | Q(date_created=date, musicmap_id__lt=pk))
+        rows = list(
+            entries.order_by('-date_created', '-musicmap_id').values_list('musicmap_id', 'date_created')[:limit]
+        )
+        if not rows:
+            break
+
+        found = MusicMaps.objects.in_bulk([pk for pk, _ in rows])
+        musicmaps.extend(
+            found[pk] for pk, _ in rows
+            if pk in found and visible.is_visible(found[pk].author_id, found[pk].open_range)
+        )
+        if len(rows) < limit:
+            break
+        position = (rows[-1][1], rows[-1][0])
+
+    # 펼쳐지지 않은 작성자(팔로워가 많은 유저)의 MusicMaps 는 조회 시점에 합친다.
+    heavy_authors = User.objects.filter(
+        pk__in=list(visible.following),
+        followers_count__gt=conf['FANOUT_LIMIT'],
+    ).values_list('pk', flat=True)
+    condition = Q()
+    for author_pk in heavy_authors:
+        condition |= Q(
+            author_id=author_pk,
+            open_range__in=visibility.open_ranges(viewer.pk, author_pk, visible.followers, visible.following),
+        )
+
+    if condition:
+        pulled = MusicMaps.objects.filter(condition)
+        if before is not None:
+            date, pk = before
+            pulled = pulled.filter(Q(date_created__lt=date) | Q(date_created=date, pk__lt=pk))
+        musicmaps.extend(pulled.order_by('-date_created', '-pk')[:limit])
+
+    musicmaps.sort(key=lambda musicmap: (musicmap.date_created, musicmap.pk), reverse=True)
+    return musicmaps[:limit]
@@ -0,0 +1,441 @@
+"""
+지역별 인기 곡/장소 (sliding window top-K)
+
+최근 WINDOW 동안 새로 게시된 전체 공개 MusicMaps 의 플레이리스트 곡과 장소(geohash 셀)를
+지역(geohash prefix) 별, 시간 bucket 별로 센다. 전체 지역은 "*" 로 함께 센다.
+
+- 프로세스마다 window 안의 bucket 별 개수와 지역 합계, 지역별 상위 TOP_K 를 메모리에 둔다.
+  MusicMaps 가 게시되면 signal 로 바로 더하고 상위 목록도 그 자리에서 고치므로, 조회는 상위 목록을 복사하는 O(K) 이다.
+- SNAPSHOT_INTERVAL 마다 background 스레드가 그 사이의 증가분을 TrendingBucket 에 $inc 로 저장하고,
+  최근 bucket 을 다시 읽어서 다른 프로세스가 저장한 개수를 합친다. window 를 벗어난 bucket 은 합계에서 빼고 지운다.
+- bulk import, rebuild 처럼 지난 bucket 까지 바꾸는 쓰기는 공유 version 을 올린다.
+  version 이 바뀌면 각 프로세스는 다음 snapshot 때 window 전체를 다시 읽는다.
+- 저장된 bucket 은 background 스레드가 처음 시작할 때 읽는다. (게시 요청에서는 DB 를 읽지 않는다)
+- 개수가 줄어드는 경우(삭제, bucket 만료)에만 해당 지역의 상위 목록을 background 스레드에서 다시 계산한다.
+- 게시 후 위치/공개 범위 수정은 반영하지 않는다. 어긋나면 python manage.py rebuild_trending 으로 다시 만든다.
+"""
+import atexit
+import datetime
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from . import geo
+from .db import database
+from .models import MusicMaps, TrendingBucket, playlist_pks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRENDING_SETTINGS = {
+    'ENABLED': True,
+    'WINDOW': 7 * 24 * 3600,    # 초
+    'BUCKET': 3600,             # 초. window 는 WINDOW // BUCKET 개의 bucket 으로 나뉜다.
+    'REGION_PRECISION': 4,      # 지역 단위 geohash 길이 (약 39km x 20km)
+    'PLACE_PRECISION': 6,       # 장소 단위 geohash 길이 (약 1.2km x 0.6km)
+    'TOP_K': 20,
+    'SNAPSHOT_INTERVAL': 30,    # 초
+    'BATCH_SIZE': 1000,
+}
+
+GLOBAL = '*'
+
+KINDS = ('tracks', 'places')
+
+STATE_COLLECTION = 'musicmaps_trending_state'
+
+
+def trending_settings():
+    conf = dict(DEFAULT_TRENDING_SETTINGS)
+    conf.update(getattr(settings, 'MUSICMAPS_TRENDING', {}))
+    return conf
+
+
+def bucket_of(value, conf):
+    """
+    datetime 또는 unix time 이 속한 bucket 번호
+    """
+    if isinstance(value, datetime.datetime):
+        if timezone.is_naive(value):
+            value = value.replace(tzinfo=datetime.timezone.utc)  # pymongo 는 UTC naive datetime 을 반환한다.
+        value = value.timestamp()
+    return int(value // conf['BUCKET'])
+
+
+def first_bucket(conf, now=None):
+    """
+    window 안에 있는 가장 오래된 bucket 번호
+    """
+    return bucket_of(time.time() if now is None else now, conf) - conf['WINDOW'] // conf['BUCKET'] + 1
+
+
+def region_of(lng, lat, conf=None):
+    conf = conf or trending_settings()
+    return geo.encode(lng, lat, conf['REGION_PRECISION'])
+
+
+def contribution(musicmap, conf):
+    """
+    MusicMaps (인스턴스 또는 문서) 가 더하는 값 (bucket, [(region, kind, item)]). 세지 않는 MusicMaps 면 None.
+    """
+    if isinstance(musicmap, dict):
+        open_range, geohash, date_created = musicmap.get('open_range'), musicmap.get('geohash'), musicmap.get('date_created')
+    else:
+        open_range, geohash, date_created = musicmap.open_range, musicmap.geohash, musicmap.date_created
+    if open_range != MusicMaps.OpenRange.PUBLIC or not geohash or date_created is None:
+        return None
+
+    place = geohash[:conf['PLACE_PRECISION']]
+    items = []
+    for region in (GLOBAL, geohash[:conf['REGION_PRECISION']]):
+        # 한 MusicMaps 에 같은 곡이 여러번 담겨도 한번만 센다.
+        items.extend((region, 'tracks', pk) for pk in dict.fromkeys(playlist_pks(musicmap)))
+        items.append((region, 'places', place))
+    return bucket_of(date_created, conf), items
+
+
+def _state():
+    return database()[STATE_COLLECTION]
+
+
+def shared_version():
+    doc = _state().find_one({'_id': 'buckets'})
+    return doc['version'] if doc else 0
+
+
+def invalidate():
+    """
+    지난 bucket 까지 바뀌었음을 알린다. 각 프로세스는 다음 snapshot 때 window 전체를 다시 읽는다.
+    """
+    _state().update_one({'_id': 'buckets'}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def _empty():
+    return {kind: Counter() for kind in KINDS}
+
+
+def _operations(counts):
+    """
+    {(region, bucket, kind, item): 증가분} 을 TrendingBucket 의 $inc upsert 로 바꾼다.
+    """
+    updates = {}
+    for (region, bucket, kind, item), delta in counts.items():
+        if delta:
+            increments = updates.setdefault((region, bucket), {})
+            increments['%s.%s' % (kind, item)] = delta
+    return [
+        UpdateOne(
+            {'key': '%s/%d' % (region, bucket)},
+            {'$setOnInsert': {'region': region, 'bucket': bucket}, '$inc': increments},
+            upsert=True,
+        )
+        for (region, bucket), increments in updates.items()
+    ]
+
+
+class TrendingWindow:
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.k = conf['TOP_K']
+        self._buckets = {}       # bucket -> region -> kind -> Counter
+        self._totals = {}        # region -> kind -> Counter (window 합계)
+        self._top = {}           # (region, kind) -> [(item, count)] 개수 내림차순
+        self._dirty = set()      # 상위 목록을 다시 계산해야 하는 (region, kind)
+        self._pending = Counter()  # (region, bucket, kind, item) -> 아직 저장하지 않은 증가분
+        self._loaded = None      # 마지막으로 다시 읽은 bucket. None 이면 아직 저장된 bucket 을 읽지 않았다.
+        self._version = None     # 마지막으로 읽은 공유 version
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _add(self, bucket, region, kind, item, delta):
+        counts = self._buckets.setdefault(bucket, {}).setdefault(region, _empty())[kind]
+        counts[item] += delta
+        if counts[item] <= 0:
+            del counts[item]
+
+        totals = self._totals.setdefault(region, _empty())[kind]
+        totals[item] += delta
+        if totals[item] <= 0:
+            del totals[item]
+
+        if delta > 0:
+            self._promote(region, kind, item, totals[item])
+        else:
+            self._dirty.add((region, kind))
+
+    def _promote(self, region, kind, item, count):
+        """
+        개수가 늘어난 item 을 상위 목록에 반영한다. 상위 목록은 항상 합계의 상위 K 개이므로
+        목록에 없던 item 은 목록이 다 차지 않았거나 최솟값보다 커진 경우에만 들어간다.
+        """
+        key = (region, kind)
+        if key in self._dirty:
+            return
+        top = self._top.get(key, [])
+        others = [entry for entry in top if entry[0] != item]
+        if len(others) == len(top) and len(top) >= self.k and count <= top[-1][1]:
+            return
+        others.append((item, count))
+        others.sort(key=lambda entry: -entry[1])
+        self._top[key] = others[:self.k]
+
+    def _recompute(self):
+        for region, kind in self._dirty:
+            totals = self._totals.get(region, _empty())[kind]
+            self._top[(region, kind)] = heapq.nlargest(self.k, totals.items(), key=lambda entry: entry[1])
+        self._dirty.clear()
+
+    def _drop(self, bucket):
+        for region, kinds in self._buckets.pop(bucket, {}).items():
+            for kind, counts in kinds.items():
+                totals = self._totals.setdefault(region, _empty())[kind]
+                totals.subtract(counts)
+                for item in counts:
+                    if totals[item] <= 0:
+                        del totals[item]
+                if counts:
+                    self._dirty.add((region, kind))
+            if not any(self._totals[region].values()):
+                del self._totals[region]
+
+    def record(self, value, sign=1):
+        """
+        contribution() 의 값을 더한다(sign=-1 이면 뺀다). window 밖이면 무시한다.
+        """
+        if value is None:
+            return
+        bucket, items = value
+        with self._lock:
+            if bucket < first_bucket(self.conf):
+                return
+            for region, kind, item in items:
+                self._add(bucket, region, kind, item, sign)
+                self._pending[(region, bucket, kind, item)] += sign
+        self._ensure_worker()
+
+    def reset(self):
+        """
+        메모리의 개수를 버리고 저장된 bucket 을 처음부터 다시 읽는다.
+        """
+        with self._sync_lock, self._lock:
+            self._buckets = {}
+            self._totals = {}
+            self._top = {}
+            self._dirty = set()
+            self._pending = Counter()
+            self._loaded = None
+        self.sync()
+
+    def warm(self):
+        """
+        저장된 bucket 을 아직 읽지 않았으면 읽는다. (조회 요청, background 스레드)
+        """
+        if self._loaded is None:
+            self.sync()
+
+    def top(self, region, kind):
+        with self._lock:
+            if (region, kind) in self._dirty:
+                self._recompute()
+            return list(self._top.get((region, kind), ()))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+
+        operations = _operations(pending)
+        try:
+            if operations:
+                TrendingBucket.objects.mongo_bulk_write(operations, ordered=False)
+        except Exception:
+            with self._lock:
+                self._pending.update(pending)
+            raise
+
+    def sync(self):
+        """
+        증가분을 저장하고, 최근 bucket 을 다시 읽어서 다른 프로세스의 개수를 합친다.
+        처음이거나 공유 version 이 바뀌었으면 window 전체를 다시 읽는다.
+        """
+        with self._sync_lock:
+            self.flush()
+
+            # bucket 을 읽기 전에 확인해야 읽는 동안 올라간 version 을 다음 snapshot 에서 알아챈다.
+            version = shared_version()
+            now = time.time()
+            oldest = first_bucket(self.conf, now)
+            current = bucket_of(now, self.conf)
+            if self._loaded is None or version != self._version:
+                start = oldest
+            else:
+                # 지난 bucket 도 다른 프로세스가 늦게 저장했을 수 있으므로 바로 전 bucket 부터 다시 읽는다.
+                start = max(oldest, self._loaded - 1)
+
+            loaded = {}
+            for doc in TrendingBucket.objects.mongo_find({'bucket': {'$gte': start}}).batch_size(self.conf['BATCH_SIZE']):
+                kinds = loaded.setdefault(doc['bucket'], {}).setdefault(doc['region'], _empty())
+                kinds['tracks'].update({int(pk): count for pk, count in (doc.get('tracks') or {}).items() if count > 0})
+                kinds['places'].update({cell: count for cell, count in (doc.get('places') or {}).items() if count > 0})
+
+            with self._lock:
+                for bucket in [bucket for bucket in self._buckets if bucket < oldest or bucket >= start]:
+                    self._drop(bucket)
+                for bucket, regions in loaded.items():
+                    for region, kinds in regions.items():
+                        for kind, counts in kinds.items():
+                            for item, count in counts.items():
+                                self._add(bucket, region, kind, item, count)
+                # 저장한 뒤에 들어온 증가분은 아직 DB 에 없으므로 다시 더한다.
+                for (region, bucket, kind, item), delta in self._pending.items():
+                    if bucket >= start:
+                        self._add(bucket, region, kind, item, delta)
+                self._recompute()
+                self._loaded = current
+                self._version = version
+
+        TrendingBucket.objects.mongo_delete_many({'bucket': {'$lt': oldest}})
+
+    def _ensure_worker(self):
+        # fork 된 worker 프로세스에서는 스레드를 새로 띄운다.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='trending-snapshot', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.warm()
+        except Exception:
+            logger.exception('trending window could not be loaded')
+        while True:
+            time.sleep(self.conf['SNAPSHOT_INTERVAL'])
+            try:
+                self.sync()
+            except Exception:
+                logger.exception('trending snapshot failed')
+
+
+_window = None
+_window_lock = threading.Lock()
+
+
+def get_window():
+    """
+    저장된 bucket 은 background 스레드가 읽으므로, 게시 signal 에서 처음 불려도 DB 를 기다리지 않는다.
+    """
+    global _window
+    if _window is None:
+        with _window_lock:
+            if _window is None:
+                window = TrendingWindow(trending_settings())
+                window._ensure_worker()
+                _window = window
+                atexit.register(_drain)
+    return _window
+
+
+def _drain():
+    try:
+        _window.flush()
+    except Exception:
+        logger.exception('trending counts could not be saved at exit')
+
+
+def add(musicmap):
+    conf = trending_settings()
+    if conf['ENABLED']:
+        get_window().record(contribution(musicmap, conf), 1)
+
+
+def remove(musicmap):
+    conf = trending_settings()
+    if conf['ENABLED']:
+        get_window().record(contribution(musicmap, conf), -1)
+
+
+def store(musicmaps):
+    """
+    MusicMaps (문서) 의 개수를 window 를 거치지 않고 TrendingBucket 에 바로 더한다. (bulk_import)
+    """
+    conf = trending_settings()
+    if not conf['ENABLED']:
+        return
+    oldest = first_bucket(conf)
+    counts = Counter()
+    for musicmap in musicmaps:
+        value = contribution(musicmap, conf)
+        if value is None or value[0] < oldest:
+            continue
+        bucket, items = value
+        for region, kind, item in items:
+            counts[(region, bucket, kind, item)] += 1
+
+    operations = _operations(counts)
+    if operations:
+        TrendingBucket.objects.mongo_bulk_write(operations, ordered=False)
+        invalidate()
+
+
+def trending(region=GLOBAL):
+    """
+    region 의 {'tracks': [(Music pk, count)], 'places': [(geohash, count)]}
+    """
+    window = get_window()
+    window.warm()  # background 스레드가 아직 읽지 못했으면 조회 요청에서 읽는다.
+    return {kind: window.top(region, kind) for kind in KINDS}
+
+
+def rebuild():
+    """
+    window 안의 MusicMaps 로 TrendingBucket 을 다시 만든다. (bulk_import 등 signal 을 거치지 않은 쓰기 이후)
+    임시 컬렉션에 만든 뒤 TrendingBucket 컬렉션과 바꾸므로 조회와 snapshot 은 바뀌기 전까지 이전 bucket 을 본다.
+    바꾼 뒤 공유 version 을 올려서, 이 프로세스는 바로, 다른 프로세스는 다음 snapshot 때 window 전체를 다시 읽는다.
+    rebuild 중에 게시된 MusicMaps 는 한번 더 세거나 빠질 수 있으므로 쓰기가 적을 때 실행한다.
+    """
+    conf = trending_settings()
+    start = datetime.datetime.fromtimestamp(first_bucket(conf) * conf['BUCKET'], tz=datetime.timezone.utc)
+    query = {'open_range': MusicMaps.OpenRange.PUBLIC, 'date_created': {'$gte': start}}
+    projection = {'_id': False, 'open_range': True, 'geohash': True, 'playlist_id': True, 'playlist_order': True, 'date_created': True}
+
+    docs = {}
+    for doc in MusicMaps.objects.mongo_find(query, projection).batch_size(conf['BATCH_SIZE']):
+        value = contribution(doc, conf)
+        if value is None:
+            continue
+        bucket, items = value
+        for region, kind, item in items:
+            key = '%s/%d' % (region, bucket)
+            entry = docs.setdefault(key, {'key': key, 'region': region, 'bucket': bucket, 'tracks': {}, 'places': {}})
+            entry[kind][str(item)] = entry[kind].get(str(item), 0) + 1
+
+    target = database()[TrendingBucket._meta.db_table]
+    temp = target.database['%s_rebuild' % target.name]
+    temp.drop()
+    temp.create_index([('key', 1)], name='key', unique=True)
+    temp.create_index([('bucket', 1)], name='bucket')
+
+    docs = list(docs.values())
+    for offset in range(0, len(docs), conf['BATCH_SIZE']):
+        temp.insert_many(docs[offset:offset + conf['BATCH_SIZE']], ordered=False)
+    if docs:
+        temp.rename(target.name, dropTarget=True)
+    else:
+        target.delete_many({})  # 빈 컬렉션은 만들어지지 않아 rename 할 수 없다.
+    invalidate()
+
+    if _window is not None:
+        _window.reset()
+    return len(docs)
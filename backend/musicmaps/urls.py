@@ -0,0 +1,16 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'musicmaps'
+
+urlpatterns = [
+    path('list/', views.MusicMapsList.as_view(), name='musicmaps_list'),
+    path('images/', views.MusicMapImages.as_view(), name='musicmap_images'),
+    path('search/', views.MusicMapSearch.as_view(), name='musicmap_search'),
+    path('timeline/', views.Timeline.as_view(), name='timeline'),
+    path('trending/', views.MusicMapTrending.as_view(), name='musicmap_trending'),
+    path('tiles/<int:zoom>/<int:x>/<int:y>/', views.MusicMapTile.as_view(), name='musicmap_tile'),
+    path('<int:pk>/comments/', views.MusicMapComments.as_view(), name='musicmap_comments'),
+    path('<int:pk>/memorize/', views.MusicMapMemorize.as_view(), name='musicmap_memorize'),
+]
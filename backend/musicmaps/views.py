@@ -1,5 +1,341 @@
+from django.core.exceptions import ValidationError
+from rest_framework import permissions, status
+from rest_framework.exceptions import NotFound
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
+from backend.images import derivative_urls
+from backend.metrics import serialized
+from backend.pagination import KeysetPagination
+
+from . import catalog, geo, memorize, repository, search, threads, tiles, timeline, trending
+from .visibility import Visibility
+from .models import Comment, MusicMaps
+from .serializers import (
+    CommentCreateSerializer, CommentThreadSerializer, ImageUploadSerializer, MusicMapCreateSerializer,
+    MusicMapDocumentSerializer, MusicMapSerializer, MusicSerializer
+)
+
+
+def _float_params(query_params, *names):
+    try:
+        return [float(query_params[name]) for name in names]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 class MusicMapsList(APIView):
-    pass
+    """
+    GET : 주변 MusicMaps 조회
+        반경 검색 : "lng", "lat", "radius"(m)
+        영역 검색 : "bbox" = "west,south,east,north" (date_updated 역순, cursor 페이지네이션)
+    POST : MusicMaps 게시 (JSON/MessagePack)
+        "images": [string], "content": string, "coordinates": [lng, lat], "street_address": string,
+        "building_number": string, "open_range": int, "comments_on": boolean,
+        "playlist": [{"artists", "album", "name", "track_number", "album_cover": string}]
+        images, album_cover 는 MusicMapImages 로 먼저 올린 이미지의 "image" 값이다.
+    """
+
+    def get(self, request, format=None):
+        limit = request.query_params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+
+        bbox = request.query_params.get('bbox')
+        visibility = Visibility(request.user)
+
+        if bbox is not None:
+            try:
+                bbox = geo.parse_bbox(bbox)
+            except geo.InvalidQuery as error:
+                return Response(data={'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+            def fetch(position, limit):
+                if position is not None:
+                    try:
+                        position = (MusicMaps._meta.get_field('date_updated').to_python(position[0]), int(position[1]))
+                    except (ValidationError, TypeError, ValueError):
+                        raise NotFound(paginator.invalid_cursor_message)
+                return geo.maps_within_page(bbox, visibility.mongo_filter(), position, limit)
+
+            paginator = KeysetPagination(ordering='-date_updated')
+            docs = paginator.paginate_documents(fetch, request, view=self)
+            musicmaps = MusicMaps.objects.in_bulk([doc['id'] for doc in docs])
+            serializer = MusicMapSerializer([musicmaps[doc['id']] for doc in docs if doc['id'] in musicmaps], many=True, context={'request': request})
+
+            return paginator.get_paginated_response(serialized(serializer))
+
+        else:
+            params = _float_params(request.query_params, 'lng', 'lat', 'radius')
+            if params is None:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            lng, lat, radius = params
+            try:
+                geo.validate_point(lng, lat)
+                geo.validate_radius(radius)
+            except geo.InvalidQuery as error:
+                return Response(data={'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+            if repository.enabled('nearby'):
+                docs = repository.MusicMapsRepository().nearby(lng, lat, radius, limit, visibility)
+                serializer = MusicMapDocumentSerializer(docs, many=True, context={'request': request})
+                return Response(data=serialized(serializer), status=status.HTTP_200_OK)
+
+            pks = geo.maps_near(lng, lat, radius, limit, visibility)
+
+            # 반경 검색은 거리순이므로 cursor 대신 limit 으로 자른다.
+            musicmaps = MusicMaps.objects.in_bulk(pks)
+            serializer = MusicMapSerializer([musicmaps[pk] for pk in pks if pk in musicmaps], many=True, context={'request': request})
+
+            return Response(data=serialized(serializer), status=status.HTTP_200_OK)
+
+    def post(self, request, format=None):
+        serializer = MusicMapCreateSerializer(data=request.data)
+
+        if serializer.is_valid():
+
+            musicmap = serializer.save(author=request.user)
+
+            return Response(data=serialized(MusicMapSerializer(musicmap, context={'request': request})), status=status.HTTP_201_CREATED)
+
+        else:
+
+            return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MusicMapImages(APIView):
+    """
+    POST : MusicMaps 이미지, 앨범 커버 업로드 (multipart "image")
+    response:
+        "image": string (게시할 때 images, album_cover 에 넣는 값), "urls": 원본과 파생 이미지 URL
+    """
+
+    def post(self, request, format=None):
+        serializer = ImageUploadSerializer(data=request.data)
+
+        if serializer.is_valid():
+
+            name = serializer.save()
+            data = {'image': name, 'urls': derivative_urls(name, request=request)}
+
+            return Response(data=data, status=status.HTTP_201_CREATED)
+
+        else:
+
+            return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class Timeline(APIView):
+    """
+    팔로우한 유저들의 MusicMaps 홈 타임라인 (최신순, cursor 페이지네이션)
+    """
+
+    def get(self, request, format=None):
+        paginator = KeysetPagination(ordering='-date_created')
+        paginator.request = request
+        limit = paginator.get_page_size(request)
+
+        before = paginator.decode_cursor(request)
+        if before is not None:
+            try:
+                date = MusicMaps._meta.get_field('date_created').to_python(before[0])
+                if date is None:
+                    raise ValueError(before[0])
+                before = (date, int(before[1]))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(paginator.invalid_cursor_message)
+
+        musicmaps = timeline.read(request.user, before, limit)
+
+        paginator.next_position = None
+        if len(musicmaps) == limit:
+            last = musicmaps[-1]
+            paginator.next_position = (last.date_created.isoformat(), last.pk)
+
+        serializer = MusicMapSerializer(musicmaps, many=True, context={'request': request})
+
+        return paginator.get_paginated_response(serialized(serializer))
+
+
+class MusicMapSearch(APIView):
+    """
+    MusicMaps 내용, 주소, 플레이리스트 곡(제목, 아티스트, 앨범) 검색 (관련도순, cursor 페이지네이션)
+    request query: "q"
+    """
+
+    def get(self, request, format=None):
+        terms = search.query_terms(request.query_params.get('q'))
+        if not terms:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        visibility = Visibility(request.user)
+        paginator = KeysetPagination(ordering='-score')
+
+        def fetch(position, limit):
+            if position is not None:
+                try:
+                    position = search.parse_position(position)
+                except ValueError:
+                    raise NotFound(paginator.invalid_cursor_message)
+            return search.search(terms, visibility, position, limit)
+
+        docs = paginator.paginate_documents(fetch, request, view=self)
+
+        musicmaps = MusicMaps.objects.in_bulk([doc['id'] for doc in docs])
+        serializer = MusicMapSerializer([musicmaps[doc['id']] for doc in docs if doc['id'] in musicmaps], many=True, context={'request': request})
+
+        return paginator.get_paginated_response(serialized(serializer))
+
+
+class MusicMapComments(APIView):
+    """
+    MusicMaps 댓글 스레드 조회 및 작성
+    request(POST):
+        "content" : string
+        "parent" : int (답글인 경우 댓글 id)
+    """
+
+    def get_musicmap(self, request, pk):
+        try:
+            musicmap = MusicMaps.objects.get(pk=pk)
+        except MusicMaps.DoesNotExist:
+            return None
+        if not Visibility(request.user).is_visible(musicmap.author_id, musicmap.open_range):
+            return None
+        return musicmap
+
+    def get(self, request, pk, format=None):
+        musicmap = self.get_musicmap(request, pk)
+
+        if musicmap is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        max_depth = request.query_params.get('max_depth')
+        max_depth = int(max_depth) if max_depth and max_depth.isdigit() else None
+
+        comments = threads.load_thread(musicmap, max_depth=max_depth)
+        serializer = CommentThreadSerializer(comments, many=True, context={'request': request})
+
+        return Response(data=serialized(serializer), status=status.HTTP_200_OK)
+
+    def post(self, request, pk, format=None):
+        musicmap = self.get_musicmap(request, pk)
+
+        if musicmap is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        if not musicmap.comments_on:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        data = CommentCreateSerializer(data=request.data)
+        if not data.is_valid():
+            return Response(data=data.errors, status=status.HTTP_400_BAD_REQUEST)
+        content = data.validated_data['content']
+
+        parent = None
+        parent_id = data.validated_data.get('parent')
+        if parent_id is not None:
+            try:
+                parent = Comment.objects.get(pk=parent_id, musicmap_id=musicmap.pk)
+            except Comment.DoesNotExist:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            if parent.depth + 1 > threads.thread_settings()['MAX_DEPTH']:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        comment = threads.add_comment(musicmap, request.user, content, parent)
+        comment.replies = []
+        comment.author_userid = request.user.userid
+        serializer = CommentThreadSerializer(comment, context={'request': request})
+
+        return Response(data=serialized(serializer), status=status.HTTP_201_CREATED)
+
+
+class MusicMapMemorize(APIView):
+    """
+    MusicMaps memorize(좋아요)
+    POST : memorize, DELETE : memorize 취소
+    쓰기는 버퍼에 모아서 반영하므로(musicmaps/memorize.py) memorize_count 는 잠시 늦게 바뀔 수 있다.
+    """
+
+    def get_musicmap(self, request, pk):
+        doc = MusicMaps.objects.mongo_find_one(
+            {'id': pk}, {'_id': False, 'author_id': True, 'open_range': True}
+        )
+        if doc is None or not Visibility(request.user).is_visible(doc['author_id'], doc['open_range']):
+            return None
+        return doc
+
+    def set_memorized(self, request, pk, memorized):
+        doc = self.get_musicmap(request, pk)
+
+        if doc is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        memorize.set_memorized(pk, request.user.pk, memorized)
+
+        return Response(data={'memorized': memorized}, status=status.HTTP_200_OK)
+
+    def post(self, request, pk, format=None):
+        return self.set_memorized(request, pk, True)
+
+    def delete(self, request, pk, format=None):
+        return self.set_memorized(request, pk, False)
+
+
+class MusicMapTile(APIView):
+    """
+    축소된 지도용 타일 클러스터 (z/x/y, Web Mercator)
+    response:
+        "clusters": [{"cell", "lng", "lat", "count", "top_track": Music}]
+    로그인하지 않은 경우 PUBLIC MusicMaps 만 집계된다.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, zoom, x, y, format=None):
+
+        if not tiles.is_valid_tile(zoom, x, y):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        clusters = tiles.clusters(zoom, x, y, Visibility(request.user))
+
+        musics = catalog.resolve({cluster['top_track'] for cluster in clusters if cluster['top_track'] is not None})
+        for cluster in clusters:
+            music = musics.get(cluster['top_track'])
+            cluster['top_track'] = serialized(MusicSerializer(music, context={'request': request})) if music is not None else None
+
+        data = {'zoom': zoom, 'x': x, 'y': y, 'clusters': clusters}
+
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
+class MusicMapTrending(APIView):
+    """
+    최근 일주일(WINDOW) 동안 게시된 전체 공개 MusicMaps 에 많이 담긴 곡과 많이 게시된 장소
+    request query: "lng", "lat" (없으면 전체 지역)
+    response:
+        "region": string, "tracks": [{"music": Music, "count"}], "places": [{"geohash", "lng", "lat", "count"}]
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, format=None):
+        region = trending.GLOBAL
+        if 'lng' in request.query_params or 'lat' in request.query_params:
+            params = _float_params(request.query_params, 'lng', 'lat')
+            if params is None:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            region = trending.region_of(*params)
+
+        top = trending.trending(region)
+
+        musics = catalog.resolve([pk for pk, _ in top['tracks']])
+        tracks = [
+            {'music': serialized(MusicSerializer(musics[pk], context={'request': request})), 'count': count}
+            for pk, count in top['tracks'] if pk in musics
+        ]
+        places = []
+        for cell, count in top['places']:
+            lng, lat = geo.decode(cell)
+            places.append({'geohash': cell, 'lng': lng, 'lat': lat, 'count': count})
+
+        data = {'region': region, 'tracks': tracks, 'places': places}
+
+        return Response(data=data, status=status.HTTP_200_OK)
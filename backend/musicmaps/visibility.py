@@ -0,0 +1,93 @@
+"""
+MusicMaps 공개 범위(open_range) 판정
+
+viewer 의 팔로워/팔로잉 집합(캐시)을 한번만 가져와서 여러 MusicMaps 를
+집합 연산으로 한꺼번에 판정한다. 지도 화면의 수백개 MusicMaps 도
+맵마다 팔로우 관계를 조회하지 않고 캐시 조회 한번으로 거를 수 있다.
+"""
+from accounts.cache import get_follow_sets
+
+from .models import MusicMaps
+
+OpenRange = MusicMaps.OpenRange
+
+ALL_RANGES = (OpenRange.PUBLIC, OpenRange.FOLLOW, OpenRange.FOLLOW_BACK, OpenRange.PRIVATE)
+
+
+def open_ranges(viewer_pk, author_pk, followers, following):
+    """
+    viewer 가 author 의 MusicMaps 중 볼 수 있는 공개 범위 목록
+    followers, following 은 viewer 의 팔로워/팔로잉 pk 집합이다.
+    """
+    if viewer_pk is not None and viewer_pk == author_pk:
+        return list(ALL_RANGES)
+    if author_pk not in following:
+        return [OpenRange.PUBLIC]
+    if author_pk in followers:
+        return [OpenRange.PUBLIC, OpenRange.FOLLOW, OpenRange.FOLLOW_BACK]
+    return [OpenRange.PUBLIC, OpenRange.FOLLOW]
+
+
+class Visibility:
+    """
+    한 viewer 에 대한 판정기. 팔로우 집합은 생성할 때 한번만 읽는다.
+    """
+
+    def __init__(self, viewer):
+        viewer_pk = viewer.pk if viewer is not None and viewer.is_authenticated else None
+        if viewer_pk is None:
+            self._set(None, frozenset(), frozenset())
+        else:
+            self._set(viewer_pk, *get_follow_sets(viewer_pk))
+
+    @classmethod
+    def from_sets(cls, viewer_pk, followers, following):
+        """
+        팔로워/팔로잉 집합을 이미 가지고 있는 경우 (비동기 조회 등) 캐시를 거치지 않고 만든다.
+        """
+        visibility = cls.__new__(cls)
+        visibility._set(viewer_pk, frozenset(followers or ()), frozenset(following or ()))
+        return visibility
+
+    def _set(self, viewer_pk, followers, following):
+        self.viewer_pk = viewer_pk
+        self.followers = followers
+        self.following = following
+        self.mutual = followers & following
+
+    def is_visible(self, author_pk, open_range):
+        if open_range == OpenRange.PUBLIC:
+            return True
+        if self.viewer_pk is not None and author_pk == self.viewer_pk:
+            return True
+        if open_range == OpenRange.FOLLOW:
+            return author_pk in self.following
+        if open_range == OpenRange.FOLLOW_BACK:
+            return author_pk in self.mutual
+        return False
+
+    def mongo_filter(self):
+        """
+        is_visible 과 같은 조건의 MongoDB 조회 조건
+        """
+        conditions = [{'open_range': OpenRange.PUBLIC}]
+        if self.viewer_pk is not None:
+            conditions.append({'author_id': self.viewer_pk})
+        if self.following:
+            conditions.append({'author_id': {'$in': list(self.following)}, 'open_range': OpenRange.FOLLOW})
+        if self.mutual:
+            conditions.append({'author_id': {'$in': list(self.mutual)}, 'open_range': OpenRange.FOLLOW_BACK})
+        return {'$or': conditions}
+
+    def filter(self, musicmaps):
+        return [musicmap for musicmap in musicmaps if self.is_visible(musicmap.author_id, musicmap.open_range)]
+
+    def visible_pks(self, pks):
+        """
+        pk 목록 중 볼 수 있는 것만 순서를 유지해서 반환한다. (author, open_range 만 projection 으로 읽는다)
+        """
+        if not pks:
+            return []
+        rows = MusicMaps.objects.filter(pk__in=pks).values_list('pk', 'author_id', 'open_range')
+        visible = {pk for pk, author_pk, open_range in rows if self.is_visible(author_pk, open_range)}
+        return [pk for pk in pks if pk in visible]